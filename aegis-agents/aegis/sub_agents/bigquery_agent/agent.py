@@ -17,7 +17,13 @@
 from google.adk.agents import LlmAgent
 from . import prompt
 # Import the function from the new tools.py file
-from .tools import execute_sql_query
+from .tools import (
+    execute_sql_query,
+    get_confidence_trend,
+    get_flag_events,
+    get_flag_summary,
+    get_hour_of_day_distribution,
+)
 
 MODEL = "gemini-2.5-pro"
 
@@ -27,6 +33,10 @@ bigquery_agent = LlmAgent(
     instruction=prompt.BIGQUERY_AGENT_PROMPT,
     output_key="bigquery_data_output",
     tools=[
+        get_flag_events,
+        get_flag_summary,
+        get_hour_of_day_distribution,
+        get_confidence_trend,
         execute_sql_query # Pass the function directly
     ],
 )
@@ -0,0 +1,257 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An in-process cache of query results for the BigQuery tools."""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+
+# Comments, string literals and quoted identifiers, in the order they are matched.
+_SQL_TOKENS = re.compile(
+    r"(--[^\n]*|#[^\n]*|/\*.*?\*/)"          # comments
+    r"|('(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\")"  # string literals
+    r"|(`[^`]*`)",                            # quoted identifiers
+    re.DOTALL,
+)
+# A table path such as `project.dataset.table`, project.dataset.table or `project`.dataset.table.
+_TABLE_PATH = re.compile(r"(?:`[^`]*`|[a-z_][\w-]*)(?:\s*\.\s*(?:`[^`]*`|[a-z_][\w-]*))*", re.IGNORECASE)
+_PATH_PART = re.compile(r"`([^`]*)`|([\w-]+)")
+_FROM_KEYWORD = re.compile(r"\b(from|join)\s+", re.IGNORECASE)
+_ALIAS = re.compile(r"\s+(?:as\s+)?([a-z_]\w*)", re.IGNORECASE)
+_LIST_SEPARATOR = re.compile(r"\s*,\s*")
+_CTE_NAME = re.compile(r"(?:\bwith(?:\s+recursive)?|,)\s*([a-z_]\w*)\s+as\s*\(", re.IGNORECASE)
+_CLAUSE_KEYWORDS = frozenset({
+    "where", "join", "inner", "left", "right", "full", "cross", "on", "using", "group", "order", "limit",
+    "having", "window", "qualify", "union", "except", "intersect", "for", "tablesample", "pivot", "unpivot",
+})
+_WHITESPACE = re.compile(r"\s+")
+_NONDETERMINISTIC = re.compile(r"\b(RAND|GENERATE_UUID|SESSION_USER)\s*\(", re.IGNORECASE)
+
+
+def normalize_sql(query: str) -> str:
+    """
+    Returns a cache key for `query` that ignores comments, whitespace, keyword
+    case and a trailing semicolon, but keeps string literals and quoted
+    identifiers exactly as written.
+    """
+    literals = []
+
+    def hold(match):
+        if match.group(1) is not None:
+            return " "
+        literals.append(match.group(0))
+        return f"\0{len(literals) - 1}\0"
+
+    code = _WHITESPACE.sub(" ", _SQL_TOKENS.sub(hold, query)).strip().rstrip(";").rstrip().lower()
+    return re.sub(r"\0(\d+)\0", lambda m: literals[int(m.group(1))], code)
+
+
+def strip_comments(query: str) -> str:
+    """Returns `query` with each comment replaced by a space, leaving string literals as written."""
+    return _SQL_TOKENS.sub(lambda m: " " if m.group(1) is not None else m.group(0), query)
+
+
+def _is_operator_from(code: str, position: int) -> bool:
+    """Whether the FROM at `position` is part of EXTRACT(part FROM value) or IS DISTINCT FROM."""
+    if re.search(r"\bdistinct\s*$", code[:position], re.IGNORECASE):
+        return True
+    depth = 0
+    for index in range(position - 1, -1, -1):
+        if code[index] == ")":
+            depth += 1
+        elif code[index] == "(":
+            if depth == 0:
+                return re.search(r"\bextract\s*$", code[:index], re.IGNORECASE) is not None
+            depth -= 1
+    return False
+
+
+def _table_paths(code: str) -> Iterator[Tuple[List[str], int]]:
+    """
+    Yields the name parts and offset of each table after a FROM or JOIN, including the
+    comma-separated tables of a FROM list. Subqueries, UNNEST and other table
+    functions are skipped, as are paths into an earlier table's columns, such
+    as t.event_details.corroborating_signals after FROM ... AS t.
+    """
+    aliases = set()
+    for keyword in _FROM_KEYWORD.finditer(code):
+        if keyword.group(1).lower() == "from" and _is_operator_from(code, keyword.start()):
+            continue
+        position = keyword.end()
+        while True:
+            path = _TABLE_PATH.match(code, position)
+            if path is None or re.match(r"\s*\(", code[path.end():]):
+                break
+            parts = [name for quoted, bare in _PATH_PART.findall(path.group(0)) for name in (quoted or bare).split(".")]
+            if parts[0].lower() not in aliases:
+                yield parts, path.start()
+            aliases.add(parts[-1].lower())
+            position = path.end()
+            alias = _ALIAS.match(code, position)
+            if alias is not None and alias.group(1).lower() not in _CLAUSE_KEYWORDS:
+                aliases.add(alias.group(1).lower())
+                position = alias.end()
+            separator = _LIST_SEPARATOR.match(code, position)
+            if separator is None:
+                break
+            position = separator.end()
+
+
+def locate_tables(query: str) -> Tuple[str, List[Tuple[List[str], int]]]:
+    """
+    Returns `query` with its comments and string literals blanked, and the
+    name parts and offset in that text of each table it reads, leaving out
+    names defined in a WITH clause.
+    """
+    # Comments and string literals are dropped first, so table names inside them are ignored.
+    without_literals = _SQL_TOKENS.sub(lambda m: m.group(3) or " ", query)
+    cte_names = {name.lower() for name in _CTE_NAME.findall(without_literals)}
+    return without_literals, [
+        (parts, position) for parts, position in _table_paths(without_literals)
+        if not (len(parts) == 1 and parts[0].lower() in cte_names)
+    ]
+
+
+def referenced_tables(query: str, default_project: Optional[str] = None, default_dataset: Optional[str] = None) -> List[str]:
+    """
+    Returns the names of the tables `query` reads. Two-part `dataset.table`
+    names are qualified with `default_project`, and one-part names with
+    `default_project` and `default_dataset`. Names that cannot be qualified are
+    returned as written, and names defined in a WITH clause are left out.
+    """
+    tables = set()
+    for parts, _ in locate_tables(query)[1]:
+        if len(parts) == 2 and default_project:
+            parts = [default_project] + parts
+        elif len(parts) == 1 and default_project and default_dataset:
+            parts = [default_project, default_dataset] + parts
+        tables.add(".".join(parts))
+    return sorted(tables)
+
+
+def is_cacheable(query: str) -> bool:
+    """Queries that call non-deterministic functions are never cached."""
+    return not _NONDETERMINISTIC.search(query)
+
+
+class QueryResultCache:
+    """
+    A thread-safe LRU cache of query results with a time-to-live.
+
+    Each entry records the version of every table its query read, such as the
+    table's last-modified time and streaming buffer state. A lookup with
+    different versions is a miss and drops the entry, so a write to any table a
+    query read retires its result. The TTL bounds how stale results of queries that
+    use the current date or time can get.
+
+    The cache holds at most `max_entries` results and `max_bytes` bytes of
+    result text, evicting the least recently used results first.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 32 * 1024 * 1024, ttl_secs: float = 300.0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_secs = ttl_secs
+
+        self._entries: "OrderedDict[str, Tuple[str, Dict[str, Hashable], float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, key: str, table_versions: Dict[str, Hashable]) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            result, versions, expires_at = entry
+            if expires_at < time.monotonic() or versions != table_versions:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: str, result: str, table_versions: Dict[str, Hashable]):
+        if len(result) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, dict(table_versions), time.monotonic() + self.ttl_secs)
+            self._bytes += len(result)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+    def _remove(self, key: str):
+        result, _, _ = self._entries.pop(key)
+        self._bytes -= len(result)
+
+
+class TableVersions:
+    """
+    Looks up the version of a table: its last-modified time plus the state of
+    its streaming buffer, which changes as streamed rows arrive even when the
+    last-modified time does not. Versions are reused for `check_interval_secs`
+    so a burst of cache lookups costs one metadata call per table.
+    """
+
+    def __init__(self, client, check_interval_secs: float = 10.0):
+        self.client = client
+        self.check_interval_secs = check_interval_secs
+        self._versions: Dict[str, Tuple[Hashable, float]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, tables: List[str]) -> Dict[str, Hashable]:
+        return {table: self._version(table) for table in tables}
+
+    def _version(self, table_ref: str) -> Hashable:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._versions.get(table_ref)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        table = self.client.get_table(table_ref)
+        streaming_buffer = table.streaming_buffer
+        version = (
+            table.modified,
+            streaming_buffer.estimated_rows if streaming_buffer else None,
+            streaming_buffer.oldest_entry_time if streaming_buffer else None,
+        )
+        with self._lock:
+            self._versions[table_ref] = (version, now + self.check_interval_secs)
+        return version
@@ -0,0 +1,220 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Cost and size guardrails for model-written SQL."""
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from .query_cache import locate_tables, strip_comments
+
+_TRAILING_LIMIT = re.compile(r"\blimit\s+(\d+)(\s+offset\s+\d+)?\s*$", re.IGNORECASE)
+_SET_OPERATOR = re.compile(r"\b(union|except|intersect)\b", re.IGNORECASE)
+_CLAUSE_END = re.compile(r"\b(group\s+by|order\s+by|limit|having|qualify|window)\b", re.IGNORECASE)
+
+
+class QueryRejectedError(ValueError):
+    """Raised for a query the guard will not run. The message tells the agent how to fix it."""
+
+
+def format_bytes(num_bytes: Optional[int]) -> str:
+    if num_bytes is None:
+        return "unknown"
+    for unit in ("B", "KiB", "MiB", "GiB"):
+        if num_bytes < 1024:
+            return f"{num_bytes:.0f} {unit}" if unit == "B" else f"{num_bytes:.1f} {unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f} TiB"
+
+
+def _top_level(code: str) -> str:
+    """Returns `code` with the contents of each pair of parentheses blanked, keeping offsets."""
+    flat = []
+    depth = 0
+    for char in code:
+        if char == ")":
+            depth -= 1
+        flat.append(char if depth == 0 else " ")
+        if char == "(":
+            depth += 1
+    return "".join(flat)
+
+
+def _enclosing_group(code: str, position: int) -> Tuple[int, int]:
+    """Returns the start and end of the innermost parentheses around `position`, or of all of `code`."""
+    start, depth = 0, 0
+    for index in range(position - 1, -1, -1):
+        if code[index] == ")":
+            depth += 1
+        elif code[index] == "(":
+            if depth == 0:
+                start = index + 1
+                break
+            depth -= 1
+    end, depth = len(code), 0
+    for index in range(position, len(code)):
+        if code[index] == "(":
+            depth += 1
+        elif code[index] == ")":
+            if depth == 0:
+                end = index
+                break
+            depth -= 1
+    return start, end
+
+
+def _where_clause(code: str, position: int) -> str:
+    """Returns the WHERE clause of the SELECT that reads the table at `position`, or an empty string."""
+    start, end = _enclosing_group(code, position)
+    scope = code[start:end]
+    flat = _top_level(scope)
+    statement_end = _SET_OPERATOR.search(flat, position - start)
+    flat = flat[:statement_end.start() if statement_end else len(flat)]
+    where = re.search(r"\bwhere\b", flat[position - start:], re.IGNORECASE)
+    if where is None:
+        return ""
+    clause_start = position - start + where.end()
+    clause_end = _CLAUSE_END.search(flat, clause_start)
+    return scope[clause_start:clause_end.start() if clause_end else len(flat)]
+
+
+def _strip_parentheses(expression: str) -> str:
+    """Returns `expression` without the parentheses, if any, around all of it."""
+    expression = expression.strip()
+    while expression.startswith("(") and _enclosing_group(expression, 1) == (1, len(expression) - 1):
+        expression = expression[1:-1].strip()
+    return expression
+
+
+def _conjuncts(expression: str) -> List[str]:
+    """
+    Splits a boolean expression into the terms ANDed together at its top
+    level, looking inside parentheses. A disjunction is one term, and the AND
+    of a BETWEEN is not split on.
+    """
+    expression = _strip_parentheses(expression)
+    flat = _top_level(expression)
+    if re.search(r"\bor\b", flat, re.IGNORECASE):
+        return [expression]
+    terms, start, in_between = [], 0, False
+    for keyword in re.finditer(r"\b(between|and)\b", flat, re.IGNORECASE):
+        if keyword.group(1).lower() == "between":
+            in_between = True
+        elif in_between:
+            in_between = False
+        else:
+            terms.append(expression[start:keyword.start()])
+            start = keyword.end()
+    terms.append(expression[start:])
+    if len(terms) == 1:
+        return [expression]
+    return [term for part in terms for term in _conjuncts(part)]
+
+
+def has_predicate(expression: str, column: str) -> bool:
+    """Whether `expression` compares `column`, directly or through a function such as DATE()."""
+    if column == "user_id":
+        pattern = rf"\b{column}\s*\)?\s*(=|in\s*\()"
+    else:
+        pattern = rf"\b{column}\s*\)?\s*(>=|>|<=|<|=|between\b)"
+    return re.search(pattern, expression, re.IGNORECASE) is not None
+
+
+def _is_filter(term: str, column: str) -> bool:
+    """Whether an ANDed term bounds `column` by values, rather than by a subquery or within an OR."""
+    if re.search(r"\bor\b", _top_level(term), re.IGNORECASE):
+        return False
+    operand = rf"(?:[\w`]+\.)?{column}"
+    if not re.match(rf"(?:{operand}|\w+\s*\(\s*{operand}\s*\))\s*", term, re.IGNORECASE):
+        return False
+    return has_predicate(term, column) and not re.search(r"\(\s*(select|with)\b", term, re.IGNORECASE)
+
+
+class QueryGuard:
+    """
+    Checks model-written SQL before it runs and bounds what it returns.
+
+    Queries that read a table in `required_filters`, however its name is
+    qualified, must filter on `user_id` and, when one is named, on the table's
+    time column, so they read one user's events over a bounded period. Each query is capped at `max_rows`
+    rows, and its dry-run estimate must fit within `max_bytes_billed`.
+    """
+
+    def __init__(self, max_bytes_billed: int, max_rows: int, required_filters: Dict[str, Optional[str]]):
+        self.max_bytes_billed = max_bytes_billed
+        self.max_rows = max_rows
+        self.required_filters = required_filters
+
+    def rewrite(self, query: str) -> str:
+        """
+        Returns `query` with a LIMIT of one more than `max_rows`, so truncation
+        can be detected, unless it already has a lower LIMIT. Comments and
+        trailing semicolons are removed first, so a LIMIT followed by a
+        comment is still found.
+
+        Raises QueryRejectedError if a required filter is missing from the
+        WHERE clause of a SELECT that reads the table, or is not ANDed into it.
+        These checks catch common mistakes early; the dry-run byte budget in
+        `check_estimate` is the hard limit.
+        """
+        code, tables = locate_tables(query)
+        for parts, position in tables:
+            table_name = parts[-1].lower()
+            if table_name not in self.required_filters:
+                continue
+            where = _where_clause(code, position)
+            terms = _conjuncts(where) if where.strip() else []
+            missing = [
+                column for column in ("user_id", self.required_filters[table_name])
+                if column and not any(_is_filter(term, column) for term in terms)
+            ]
+            if not missing:
+                continue
+            if any(re.search(r"\bor\b", term, re.IGNORECASE) and has_predicate(term, missing[0]) for term in terms):
+                raise QueryRejectedError(
+                    f"Queries on {table_name} must AND their filter on {missing[0]} with the rest of the "
+                    f"WHERE clause, not combine it with OR, which still scans the whole table."
+                )
+            if any(has_predicate(term, missing[0]) for term in terms):
+                raise QueryRejectedError(
+                    f"Queries on {table_name} must filter on {missing[0]} by values, not by a subquery, "
+                    f"which still scans the whole table."
+                )
+            raise QueryRejectedError(
+                f"Queries on {table_name} must filter on {' and '.join(missing)}. "
+                f"Add a WHERE clause for a single user and a time range."
+            )
+
+        body = strip_comments(query).rstrip().rstrip(";").rstrip()
+        limit = _TRAILING_LIMIT.search(body)
+        if limit is None:
+            return f"{body}\nLIMIT {self.max_rows + 1}"
+        if int(limit.group(1)) > self.max_rows:
+            return f"{body[:limit.start(1)]}{self.max_rows + 1}{body[limit.end(1):]}"
+        return body
+
+    def check_estimate(self, dry_run_job):
+        """Raises QueryRejectedError if a dry-run job is not a SELECT or would scan more than the budget."""
+        if dry_run_job.statement_type != "SELECT":
+            raise QueryRejectedError(f"Only SELECT queries are allowed, not {dry_run_job.statement_type}.")
+        estimate = dry_run_job.total_bytes_processed or 0
+        if estimate > self.max_bytes_billed:
+            raise QueryRejectedError(
+                f"The query would scan {format_bytes(estimate)}, over the budget of "
+                f"{format_bytes(self.max_bytes_billed)}. Narrow the time range or select fewer columns."
+            )
+
+    def truncate(self, rows: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], bool]:
+        """Keeps the first `max_rows` rows, and says whether any were dropped."""
+        return rows[:self.max_rows], len(rows) > self.max_rows
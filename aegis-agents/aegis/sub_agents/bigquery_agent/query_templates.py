@@ -0,0 +1,128 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parameterized queries for the requests the bigquery_agent sees most often."""
+
+from typing import Dict, List
+
+from google.cloud import bigquery
+
+MAX_DAYS = 90
+
+_PARAMETER_TYPES = {str: "STRING", int: "INT64", float: "FLOAT64", bool: "BOOL"}
+
+
+class QueryTemplate:
+    """
+    A query over the event table whose values are passed as BigQuery query
+    parameters, so the SQL never changes and model-supplied values are never
+    spliced into it.
+    """
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+
+    def query(self, table_ref: str) -> str:
+        return self.sql.format(table=table_ref)
+
+    def bind(self, user_id: str, days: int, **values) -> List[bigquery.ScalarQueryParameter]:
+        """
+        Returns the query parameters for a call. `days` may arrive as a float
+        or a string, as tool-call arguments often do, and is always bound as an
+        INT64, which INTERVAL @days DAY requires.
+
+        Raises ValueError for an empty user or a day count that is not a whole
+        number between 1 and MAX_DAYS.
+        """
+        if not user_id or not user_id.strip():
+            raise ValueError("A user_id is required.")
+        days = _whole_number("days", days)
+        if not 1 <= days <= MAX_DAYS:
+            raise ValueError(f"days must be between 1 and {MAX_DAYS}, not {days}.")
+        return [
+            bigquery.ScalarQueryParameter("user_id", "STRING", user_id.strip()),
+            bigquery.ScalarQueryParameter("days", "INT64", days),
+        ] + [bigquery.ScalarQueryParameter(name, _PARAMETER_TYPES[type(value)], value) for name, value in values.items()]
+
+
+def _whole_number(name: str, value) -> int:
+    """Returns `value` as an int, accepting 7, 7.0 and "7". Raises ValueError for anything else."""
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be a whole number, not {value!r}.")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a whole number, not {value!r}.") from None
+    if not number.is_integer():
+        raise ValueError(f"{name} must be a whole number, not {value!r}.")
+    return int(number)
+
+FLAG_EVENTS = QueryTemplate("flag_events", """
+SELECT timestamp, signal_type, flag_type, confidence, topic_category, source_platform, event_details
+FROM `{table}`
+WHERE user_id = @user_id
+  AND timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)
+  AND signal_type != 'NEUTRAL_FLAG'
+ORDER BY timestamp DESC
+LIMIT @max_rows
+""")
+
+FLAG_SUMMARY = QueryTemplate("flag_summary", """
+SELECT
+  flag_type,
+  signal_type,
+  COUNT(*) AS events,
+  ROUND(AVG(confidence), 3) AS mean_confidence,
+  MAX(confidence) AS max_confidence,
+  MIN(timestamp) AS first_seen,
+  MAX(timestamp) AS last_seen
+FROM `{table}`
+WHERE user_id = @user_id
+  AND timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)
+GROUP BY flag_type, signal_type
+ORDER BY events DESC
+""")
+
+HOUR_OF_DAY_DISTRIBUTION = QueryTemplate("hour_of_day_distribution", """
+SELECT
+  EXTRACT(HOUR FROM timestamp) AS hour_utc,
+  COUNT(*) AS events,
+  COUNTIF(signal_type != 'NEUTRAL_FLAG') AS flagged_events
+FROM `{table}`
+WHERE user_id = @user_id
+  AND timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)
+GROUP BY hour_utc
+ORDER BY hour_utc
+""")
+
+CONFIDENCE_TREND = QueryTemplate("confidence_trend", """
+SELECT
+  DATE(timestamp) AS day,
+  COUNT(*) AS events,
+  COUNTIF(signal_type = 'IMMEDIATE_FLAG') AS immediate_flags,
+  COUNTIF(signal_type = 'INTERMEDIATE_FLAG') AS intermediate_flags,
+  ROUND(AVG(confidence), 3) AS mean_confidence,
+  MAX(confidence) AS max_confidence
+FROM `{table}`
+WHERE user_id = @user_id
+  AND timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL @days DAY)
+GROUP BY day
+ORDER BY day
+""")
+
+TEMPLATES: Dict[str, QueryTemplate] = {
+    template.name: template
+    for template in (FLAG_EVENTS, FLAG_SUMMARY, HOUR_OF_DAY_DISTRIBUTION, CONFIDENCE_TREND)
+}
@@ -0,0 +1,117 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""A compact encoding of query results for tool output that is read by a model."""
+
+import json
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+DICTIONARY_NOTE = "Values in a column listed in dictionaries are indexes into that column's list."
+SHORTENED_NOTE = "Text ending in ... was shortened."
+
+
+def _compact_json(value: Any) -> str:
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False, default=str)
+
+
+def _shorten(value: Any, max_chars: int) -> Any:
+    """Shortens long text, and nested values whose JSON is long, to `max_chars` characters."""
+    if isinstance(value, (dict, list)):
+        text = _compact_json(value)
+        return value if len(text) <= max_chars else text[:max_chars] + "..."
+    if isinstance(value, str) and len(value) > max_chars:
+        return value[:max_chars] + "..."
+    return value
+
+
+def _day(value: Any) -> Optional[str]:
+    """The YYYY-MM-DD date of a timestamp, whether a datetime or an ISO 8601 string."""
+    if value is None:
+        return None
+    text = value.isoformat() if hasattr(value, "isoformat") else str(value)
+    return text[:10]
+
+
+def summarize(rows: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Counts event rows per flag_type, and per day and flag_type. Returns None
+    for results without flag_type and timestamp columns, such as aggregates.
+    """
+    if not rows or "flag_type" not in rows[0] or "timestamp" not in rows[0]:
+        return None
+    by_day: Dict[str, Counter] = defaultdict(Counter)
+    for row in rows:
+        by_day[_day(row["timestamp"])][row["flag_type"]] += 1
+    return {
+        "flag_type_counts": dict(Counter(row["flag_type"] for row in rows).most_common()),
+        "flag_type_counts_by_day": {day: dict(counts) for day, counts in sorted(by_day.items())},
+    }
+
+
+def encode_rows(
+    rows: List[Dict[str, Any]],
+    truncated: bool = False,
+    max_field_chars: int = 200,
+    many_rows: int = 50,
+    many_rows_max_field_chars: int = 60,
+) -> str:
+    """
+    Encodes query result rows as compact JSON: the column names once, then one
+    array of values per row, without indentation.
+
+    Text columns where values repeat are dictionary-encoded, so each distinct
+    value is written once. Long text and nested values are shortened to
+    `max_field_chars` characters, or to `many_rows_max_field_chars` when there
+    are more than `many_rows` rows. Event rows also get a summary of counts
+    per flag_type and day.
+    """
+    columns = list(rows[0]) if rows else []
+    max_chars = many_rows_max_field_chars if len(rows) > many_rows else max_field_chars
+
+    values_by_column = {column: [_shorten(row.get(column), max_chars) for row in rows] for column in columns}
+    # _shorten returns values it leaves alone unchanged, so any new object was shortened.
+    shortened = any(
+        value is not row.get(column)
+        for column, values in values_by_column.items()
+        for row, value in zip(rows, values)
+    )
+    dictionaries: Dict[str, List[str]] = {}
+    for column, values in values_by_column.items():
+        if not all(value is None or isinstance(value, str) for value in values):
+            continue
+        distinct = list(dict.fromkeys(value for value in values if value is not None))
+        if len(distinct) * 2 > len(values):
+            continue
+        index = {value: position for position, value in enumerate(distinct)}
+        values_by_column[column] = [None if value is None else index[value] for value in values]
+        dictionaries[column] = distinct
+
+    # The notes are only added when they apply, so small results stay plain.
+    notes = [note for note, applies in ((DICTIONARY_NOTE, dictionaries), (SHORTENED_NOTE, shortened)) if applies]
+    result: Dict[str, Any] = {"format": " ".join(notes)} if notes else {}
+    result.update(row_count=len(rows), columns=columns)
+    if truncated:
+        result["truncated"] = True
+        result["note"] = (
+            f"Only the first {len(rows)} rows are shown; the query returned more. "
+            f"Aggregate the data or narrow the filters to see the rest."
+        )
+    if dictionaries:
+        result["dictionaries"] = dictionaries
+    result["rows"] = [list(values) for values in zip(*(values_by_column[column] for column in columns))]
+    summary = summarize(rows)
+    if summary is not None:
+        result["summary"] = summary
+    return _compact_json(result)
@@ -42,20 +42,253 @@
 
 """A function-based tool for BigQuery data access."""
 
-import json
+import asyncio
+import concurrent.futures
+import contextlib
+import os
+import threading
+import time
 from google.cloud import bigquery
 from typing import Dict, List, Any
 import google.auth
 
+from .query_cache import QueryResultCache, TableVersions, is_cacheable, normalize_sql, referenced_tables
+from .query_guard import QueryGuard, QueryRejectedError, format_bytes
+from .result_format import encode_rows
+from . import query_templates
+
 _CREDENTIALS, _PROJECT_ID = google.auth.default()
 # Instantiate the BigQuery client once with explicit credentials
 _CLIENT = bigquery.Client(project=_PROJECT_ID, credentials=_CREDENTIALS)
 _TABLE_REF = f"{_PROJECT_ID}.aegis_dataset.user_activity_analysis"
 
+# Results of repeated queries are served from memory until they expire or a table they read changes.
+_QUERY_CACHE = QueryResultCache(
+    max_entries=int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", "256")),
+    max_bytes=int(os.environ.get("QUERY_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+    ttl_secs=float(os.environ.get("QUERY_CACHE_TTL_SECS", "300")),
+)
+# Model-written queries must read one user over a bounded period, fit a scan budget and return a bounded number of rows.
+_QUERY_GUARD = QueryGuard(
+    max_bytes_billed=int(os.environ.get("QUERY_MAX_BYTES_BILLED", str(1024 ** 3))),
+    max_rows=int(os.environ.get("QUERY_MAX_ROWS", "200")),
+    required_filters={"user_activity_analysis": "timestamp", "user_risk_summary": None},
+)
+# Results are returned to the model in a compact columnar form, with long fields shortened.
+_RESULT_FORMAT_SETTINGS = {
+    "max_field_chars": int(os.environ.get("RESULT_MAX_FIELD_CHARS", "200")),
+    "many_rows": int(os.environ.get("RESULT_MANY_ROWS", "50")),
+    "many_rows_max_field_chars": int(os.environ.get("RESULT_MANY_ROWS_MAX_FIELD_CHARS", "60")),
+}
+_TABLE_VERSIONS = TableVersions(_CLIENT, check_interval_secs=float(os.environ.get("QUERY_CACHE_TABLE_CHECK_SECS", "10")))
+
+# The BigQuery client is blocking, so its calls run on these threads and never stall the agent's event loop.
+_BLOCKING_IO_EXECUTOR = concurrent.futures.ThreadPoolExecutor(
+    max_workers=int(os.environ.get("BLOCKING_IO_MAX_WORKERS", "16")),
+    thread_name_prefix="bigquery-io",
+)
+# Queries running at once across all agents, event loops and threads; further calls wait for a slot.
+_MAX_CONCURRENT_QUERIES = int(os.environ.get("MAX_CONCURRENT_QUERIES", "4"))
+_QUERY_SLOTS = threading.BoundedSemaphore(_MAX_CONCURRENT_QUERIES)
+_QUERY_SLOT_MAX_WAIT_INTERVAL_SECS = 0.1
+_QUERY_TIMEOUT_SECS = float(os.environ.get("QUERY_TIMEOUT_SECS", "60"))
+_QUERY_POLL_INTERVAL_SECS = float(os.environ.get("QUERY_POLL_INTERVAL_SECS", "0.05"))
+_QUERY_MAX_POLL_INTERVAL_SECS = 2.0
+
+
+async def _run_blocking(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_BLOCKING_IO_EXECUTOR, func, *args)
+
+
+@contextlib.asynccontextmanager
+async def _query_slot():
+    """
+    Holds one of the query slots. The agent runtime may serve tool calls on
+    several event loops, so the slots are a threading semaphore rather than an
+    asyncio one. It is taken without blocking and retried after a sleep, so a
+    waiting call never holds up its event loop or an executor thread.
+    """
+    wait_interval = _QUERY_POLL_INTERVAL_SECS
+    while not _QUERY_SLOTS.acquire(blocking=False):
+        await asyncio.sleep(wait_interval)
+        wait_interval = min(wait_interval * 2, _QUERY_SLOT_MAX_WAIT_INTERVAL_SECS)
+    try:
+        yield
+    finally:
+        _QUERY_SLOTS.release()
+
+
+async def _cancel_job(job):
+    try:
+        await _run_blocking(job.cancel)
+        print(f"Cancelled query job {job.job_id}")
+    except Exception as e:
+        print(f"Could not cancel query job {job.job_id}: {e}")
+
+
+async def _run_query(
+    query: str,
+    query_parameters: List[bigquery.ScalarQueryParameter],
+    dry_run_first: bool,
+) -> List[Dict[str, Any]]:
+    """
+    Dry-runs `query` against the scan budget if asked, then submits it and polls
+    the job until it finishes, sleeping between polls so other tool calls keep
+    running. A job that outlives the timeout, or whose tool call is cancelled,
+    is cancelled in BigQuery too.
+    """
+    dry_run = None
+    if dry_run_first:
+        dry_run_config = bigquery.QueryJobConfig(dry_run=True, use_query_cache=False, query_parameters=query_parameters)
+        dry_run = await _run_blocking(lambda: _CLIENT.query(query, job_config=dry_run_config))
+        _QUERY_GUARD.check_estimate(dry_run)
+
+    # The budget is also enforced by BigQuery, in case the estimate was low or skipped.
+    job_config = bigquery.QueryJobConfig(
+        job_timeout_ms=int(_QUERY_TIMEOUT_SECS * 1000),
+        maximum_bytes_billed=_QUERY_GUARD.max_bytes_billed,
+        query_parameters=query_parameters,
+    )
+    async with _query_slot():
+        job = await _run_blocking(lambda: _CLIENT.query(query, job_config=job_config))
+        deadline = time.monotonic() + _QUERY_TIMEOUT_SECS
+        poll_interval = _QUERY_POLL_INTERVAL_SECS
+        try:
+            while not await _run_blocking(job.done):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"The query did not finish within {_QUERY_TIMEOUT_SECS:g} seconds and was cancelled.")
+                await asyncio.sleep(min(poll_interval, remaining))
+                poll_interval = min(poll_interval * 2, _QUERY_MAX_POLL_INTERVAL_SECS)
+        except BaseException:
+            await asyncio.shield(_cancel_job(job))
+            raise
+        rows = await _run_blocking(lambda: [dict(row) for row in job.result(max_results=_QUERY_GUARD.max_rows + 1)])
+    print(
+        f"Query job {job.job_id} bytes: estimated {format_bytes(dry_run and dry_run.total_bytes_processed)}, "
+        f"processed {format_bytes(job.total_bytes_processed)}, billed {format_bytes(job.total_bytes_billed)}"
+    )
+    return rows
+
+
+async def _execute(
+    query: str,
+    query_parameters: List[bigquery.ScalarQueryParameter] = (),
+    dry_run_first: bool = True,
+) -> str:
+    """Runs a query through the result cache and returns its rows in the compact format, or an error message."""
+    query_parameters = list(query_parameters)
+    try:
+        cache_key = None
+        if is_cacheable(query):
+            try:
+                table_versions = await _run_blocking(_TABLE_VERSIONS.get, referenced_tables(query, _PROJECT_ID))
+            except Exception as e:
+                # A table the cache cannot version is left for the query itself to report, so the query just runs uncached.
+                print(f"Query result not cached, could not look up table versions: {e}")
+            else:
+                cache_key = normalize_sql(query) + "".join(
+                    f"\n@{parameter.name}={parameter.value!r}" for parameter in query_parameters
+                )
+                cached = _QUERY_CACHE.get(cache_key, table_versions)
+                if cached is not None:
+                    print(f"Query cache hit: {_QUERY_CACHE.stats()}")
+                    return cached
+
+        rows = await _run_query(query, query_parameters, dry_run_first)
+        rows, truncated = _QUERY_GUARD.truncate(rows)
+        result = encode_rows(rows, truncated, **_RESULT_FORMAT_SETTINGS)
+        if cache_key is not None:
+            _QUERY_CACHE.put(cache_key, result, table_versions)
+        return result
+    except QueryRejectedError as e:
+        error_message = f"The query was rejected: {str(e)}"
+        print(error_message)
+        return error_message
+    except Exception as e:
+        error_message = f"An error occurred while executing the query: {str(e)}"
+        print(error_message)
+        return error_message
+
+
+async def _execute_template(template: query_templates.QueryTemplate, user_id: str, days: int, **values) -> str:
+    """
+    Runs a query template. Templates always filter on one user and a bounded
+    time range, so they skip the guard's rewrite and dry run.
+    """
+    try:
+        query_parameters = template.bind(user_id, days, **values)
+    except ValueError as e:
+        error_message = f"The query was rejected: {str(e)}"
+        print(error_message)
+        return error_message
+    print(f"Executing query template {template.name}: {', '.join(f'{p.name}={p.value!r}' for p in query_parameters)}")
+    return await _execute(template.query(_TABLE_REF), query_parameters, dry_run_first=False)
+
+
+async def get_flag_events(user_id: str, days: int) -> str:
+    """
+    Lists a user's flagged events, newest first, leaving out neutral activity.
+
+    Args:
+    user_id: The anonymized user ID.
+    days: How many days back to look, from 1 to 90.
+
+    Returns:
+    A JSON string of the events.
+    """
+    return await _execute_template(query_templates.FLAG_EVENTS, user_id, days, max_rows=_QUERY_GUARD.max_rows + 1)
+
+
+async def get_flag_summary(user_id: str, days: int) -> str:
+    """
+    Counts a user's events by flag_type and signal_type, with their mean and
+    max confidence and when each was first and last seen.
+
+    Args:
+    user_id: The anonymized user ID.
+    days: How many days back to look, from 1 to 90.
+
+    Returns:
+    A JSON string with one row per flag_type and signal_type.
+    """
+    return await _execute_template(query_templates.FLAG_SUMMARY, user_id, days)
+
+
+async def get_hour_of_day_distribution(user_id: str, days: int) -> str:
+    """
+    Counts a user's events and flagged events by hour of the day, in UTC.
+
+    Args:
+    user_id: The anonymized user ID.
+    days: How many days back to look, from 1 to 90.
+
+    Returns:
+    A JSON string with one row per hour that has events.
+    """
+    return await _execute_template(query_templates.HOUR_OF_DAY_DISTRIBUTION, user_id, days)
+
+
+async def get_confidence_trend(user_id: str, days: int) -> str:
+    """
+    Summarizes a user's events per day: counts of immediate and intermediate
+    flags and the mean and max confidence.
+
+    Args:
+    user_id: The anonymized user ID.
+    days: How many days back to look, from 1 to 90.
+
+    Returns:
+    A JSON string with one row per day that has events.
+    """
+    return await _execute_template(query_templates.CONFIDENCE_TREND, user_id, days)
+
+
 async def execute_sql_query(query: str) -> str:
     """
     Executes a SQL query against the user_activity_analysis table to retrieve
-    anonymized child digital well-being data.
+    anonymized child digital well-being data. Use it only for requests that
+    the query template tools do not cover.
 
     Args:
     query: The SQL query to execute.
@@ -65,16 +298,14 @@ async def execute_sql_query(query: str) -> str:
     """
     # Add this line to print the email of the principal making the call
     print(f"Authenticated as: {_CREDENTIALS.service_account_email}")
-    print(f"Executing query: {query}")
     try:
-        job = _CLIENT.query(query)
-        results = job.result()
-        rows = [dict(row) for row in results]
-        return json.dumps(rows, indent=2)
-    except Exception as e:
-        error_message = f"An error occurred while executing the query: {str(e)}"
+        query = _QUERY_GUARD.rewrite(query)
+    except QueryRejectedError as e:
+        error_message = f"The query was rejected: {str(e)}"
         print(error_message)
         return error_message
+    print(f"Executing query: {query}")
+    return await _execute(query)
 
 
 # """A function-based tool for BigQuery data access."""
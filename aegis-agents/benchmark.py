@@ -0,0 +1,455 @@
+"""
+Benchmark harness for the Aegis agent tools.
+
+The BigQuery client is replaced with an in-process stub that simulates query
+and metadata latency, so the harness runs without credentials or any cloud
+resources. The tools are called directly, without a model in the loop.
+
+Usage:
+    python benchmark.py cache --query-latency-ms 800 --calls 200 --distinct 20
+    python benchmark.py concurrency --query-latency-ms 800 --calls 1 2 4 8
+    python benchmark.py guard
+    python benchmark.py templates --query-latency-ms 800 --metadata-latency-ms 100
+    python benchmark.py format
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import google.auth
+from google.cloud import bigquery
+
+SIMULATED_QUERY_SECONDS = 0.8
+SIMULATED_METADATA_SECONDS = 0.03
+
+# The simulated user_activity_analysis table, partitioned by day.
+TABLE_USERS = 1000
+TABLE_DAYS = 365
+EVENTS_PER_USER_PER_DAY = 20
+BYTES_PER_EVENT = 400
+
+
+# --- Stubbed Google Clients ---
+class FakeQueryJob:
+    """Finishes the simulated query latency after it is submitted."""
+
+    def __init__(self, client, job_id, rows, bytes_processed):
+        self.client = client
+        self.job_id = job_id
+        self.cancelled = False
+        self.statement_type = "SELECT"
+        self.total_bytes_processed = bytes_processed
+        self.total_bytes_billed = max(bytes_processed, 10 * 1024 * 1024)
+        self._rows = rows
+        self._finishes_at = time.monotonic() + SIMULATED_QUERY_SECONDS
+
+    def done(self):
+        time.sleep(SIMULATED_METADATA_SECONDS)
+        finished = self.cancelled or time.monotonic() >= self._finishes_at
+        if finished:
+            self.client.finish(self)
+        return finished
+
+    def cancel(self):
+        self.cancelled = True
+        self.client.finish(self)
+        return True
+
+    def result(self, max_results=None):
+        time.sleep(max(self._finishes_at - time.monotonic(), 0))
+        self.client.finish(self)
+        return self._rows[:max_results]
+
+
+class FakeBigQueryClient:
+    """
+    Answers queries as if they read the simulated table: the days in an
+    `INTERVAL n DAY` filter are scanned, a `user_id =` filter narrows the rows
+    to one user, and GROUP BY queries return one row per flag type. Tracks how
+    many jobs run at once and reports a table version that changes on `write`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.query_count = 0
+        self.get_table_count = 0
+        self.running = set()
+        self.max_running = 0
+        self.modified = 1
+        self._lock = threading.Lock()
+
+    def query(self, query, job_config=None, **kwargs):
+        time.sleep(SIMULATED_METADATA_SECONDS)
+        interval = re.search(r"INTERVAL (\d+) DAY", query, re.IGNORECASE)
+        days = min(int(interval.group(1)), TABLE_DAYS) if interval else TABLE_DAYS
+        users = 1 if re.search(r"user_id\s*=", query) else TABLE_USERS
+        bytes_processed = days * TABLE_USERS * EVENTS_PER_USER_PER_DAY * BYTES_PER_EVENT
+        if job_config is not None and job_config.dry_run:
+            return SimpleNamespace(statement_type="SELECT", total_bytes_processed=bytes_processed)
+
+        if re.search(r"group by", query, re.IGNORECASE):
+            rows = [{"flag_type": flag_type, "events": 10} for flag_type in ("NEUTRAL", "NSFW", "CYBERBULLYING")]
+        else:
+            limit = re.search(r"LIMIT (\d+)\s*$", query, re.IGNORECASE)
+            count = days * users * EVENTS_PER_USER_PER_DAY
+            rows = [
+                {
+                    "user_id": f"user{i % users}",
+                    "timestamp": f"2025-08-{1 + i % 28:02d}T12:00:00+00:00",
+                    "signal_type": "NEUTRAL_FLAG",
+                    "flag_type": "NEUTRAL",
+                    "confidence": 0.9,
+                    "topic_category": "Educational Content",
+                    "source_platform": "Chrome Extension",
+                }
+                for i in range(min(count, int(limit.group(1))) if limit else count)
+            ]
+        with self._lock:
+            self.query_count += 1
+            job = FakeQueryJob(self, f"job_{self.query_count}", rows, bytes_processed)
+            self.running.add(job.job_id)
+            self.max_running = max(self.max_running, len(self.running))
+        return job
+
+    def finish(self, job):
+        with self._lock:
+            self.running.discard(job.job_id)
+
+    def get_table(self, table_ref):
+        time.sleep(SIMULATED_METADATA_SECONDS)
+        with self._lock:
+            self.get_table_count += 1
+        return SimpleNamespace(modified=self.modified, streaming_buffer=None)
+
+    def write(self):
+        self.modified += 1
+
+
+def load_tools():
+    """Imports the BigQuery tools with the stubbed client in place."""
+    credentials = SimpleNamespace(service_account_email="benchmark@example.com")
+    with mock.patch.object(google.auth, "default", return_value=(credentials, "benchmark-project")), \
+            mock.patch.object(bigquery, "Client", FakeBigQueryClient):
+        from aegis.sub_agents.bigquery_agent import tools
+    return tools
+
+
+def make_queries(table_ref, count):
+    """Distinct queries, each written the way a model might vary it between turns."""
+    queries = []
+    for i in range(count):
+        queries.append([
+            f"SELECT flag_type, COUNT(*) AS events FROM `{table_ref}` "
+            f"WHERE user_id = 'user{i}' AND timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY) "
+            f"GROUP BY flag_type",
+            f"select flag_type, count(*) as events\n  from `{table_ref}`\n  where user_id = 'user{i}'\n"
+            f"    and timestamp >= timestamp_sub(current_timestamp(), interval 7 day)\n  group by flag_type;",
+        ])
+    return queries
+
+
+# --- Scenarios ---
+async def run_calls(tools, queries, calls, write_every):
+    latencies = []
+    for call in range(calls):
+        if write_every and call and call % write_every == 0:
+            tools._CLIENT.write()
+        query = random.choice(random.choice(queries))
+        start = time.perf_counter()
+        await tools.execute_sql_query(query)
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def cache_scenario(args):
+    tools = load_tools()
+    queries = make_queries(tools._TABLE_REF, args.distinct)
+    print(f"Simulated latency: query {args.query_latency_ms} ms, table metadata {args.metadata_latency_ms} ms")
+    print(f"{args.calls} calls over {args.distinct} distinct queries, a table write every {args.write_every} calls")
+    print(f"{'mode':>10} {'queries run':>12} {'p50 ms':>8} {'mean ms':>8} {'hit rate':>9}")
+
+    random.seed(0)
+    with mock.patch.object(tools, "is_cacheable", return_value=False), mock.patch("builtins.print"):
+        latencies = asyncio.run(run_calls(tools, queries, args.calls, args.write_every))
+    queries_run = tools._CLIENT.query_count
+    print(f"{'uncached':>10} {queries_run:>12} {statistics.median(latencies) * 1000:>8.1f} "
+          f"{statistics.mean(latencies) * 1000:>8.1f} {'-':>9}")
+
+    random.seed(0)
+    with mock.patch("builtins.print"):
+        latencies = asyncio.run(run_calls(tools, queries, args.calls, args.write_every))
+    stats = tools._QUERY_CACHE.stats()
+    print(f"{'cached':>10} {tools._CLIENT.query_count - queries_run:>12} {statistics.median(latencies) * 1000:>8.1f} "
+          f"{statistics.mean(latencies) * 1000:>8.1f} {stats['hit_rate']:>9.0%}")
+    print(f"Cache stats: {stats}")
+
+
+async def run_concurrent_calls(tools, calls, run_id):
+    """
+    Makes `calls` tool calls at once while a ticker measures the longest the
+    event loop went without running it.
+    """
+    stall = 0.0
+
+    async def ticker():
+        nonlocal stall
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(0.005)
+            stall = max(stall, time.perf_counter() - before - 0.005)
+
+    ticking = asyncio.create_task(ticker())
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        tools.execute_sql_query(
+            f"SELECT * FROM `{tools._TABLE_REF}` WHERE user_id = 'run{run_id}-user{i}' "
+            f"AND timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 1 DAY)"
+        )
+        for i in range(calls)
+    ))
+    elapsed = time.perf_counter() - start
+    ticking.cancel()
+    return elapsed, stall
+
+
+async def run_timeout(tools):
+    with mock.patch.object(tools, "_QUERY_TIMEOUT_SECS", SIMULATED_QUERY_SECONDS / 2):
+        result = await tools.execute_sql_query(
+            f"SELECT * FROM `{tools._TABLE_REF}` WHERE user_id = 'timeout' "
+            f"AND timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 1 DAY)"
+        )
+    return result
+
+
+def concurrency_scenario(args):
+    tools = load_tools()
+    print(f"Simulated latency: query {args.query_latency_ms} ms, each BigQuery request {args.metadata_latency_ms} ms")
+    print(f"Concurrent query limit: {tools._MAX_CONCURRENT_QUERIES}")
+    print(f"{'calls':>6} {'wall ms':>9} {'serial ms':>10} {'max running':>12} {'loop stall ms':>14}")
+    for run_id, calls in enumerate(args.calls):
+        tools._CLIENT.max_running = 0
+        with mock.patch("builtins.print"):
+            elapsed, stall = asyncio.run(run_concurrent_calls(tools, calls, run_id))
+        print(f"{calls:>6} {elapsed * 1000:>9.0f} {calls * args.query_latency_ms:>10.0f} "
+              f"{tools._CLIENT.max_running:>12} {stall * 1000:>14.1f}")
+
+    with mock.patch("builtins.print"):
+        result = asyncio.run(run_timeout(tools))
+    print(f"Timeout at half the query latency: {result!r}, jobs still running: {len(tools._CLIENT.running)}")
+
+
+def make_guard_queries(table_ref):
+    user = "user_id = 'user1'"
+    return [
+        ("no user filter", f"SELECT * FROM `{table_ref}` WHERE timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY)"),
+        ("no time filter", f"SELECT * FROM `{table_ref}` WHERE {user}"),
+        ("dataset.table name", f"SELECT * FROM {table_ref.split('.', 1)[1]} WHERE {user}"),
+        ("a year of events", f"SELECT * FROM `{table_ref}` WHERE {user} AND timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 365 DAY)"),
+        ("a month of events", f"SELECT * FROM `{table_ref}` WHERE {user} AND timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 30 DAY)"),
+        ("weekly flag counts", f"SELECT flag_type, COUNT(*) AS events FROM `{table_ref}` WHERE {user} "
+                               f"AND timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY) GROUP BY flag_type"),
+    ]
+
+
+def guard_scenario(args):
+    tools = load_tools()
+    print(f"Simulated table: {TABLE_USERS} users, {TABLE_DAYS} days, {EVENTS_PER_USER_PER_DAY} events per user per day")
+    print(f"Budget: {tools.format_bytes(tools._QUERY_GUARD.max_bytes_billed)}, {tools._QUERY_GUARD.max_rows} rows")
+    print(f"{'query':>20} {'outcome':>9} {'result chars':>13} {'unguarded chars':>16}  bytes")
+    for label, query in make_guard_queries(tools._TABLE_REF):
+        unguarded = json.dumps([dict(row) for row in tools._CLIENT.query(query).result()], indent=2)
+        with mock.patch("builtins.print") as printed:
+            result = asyncio.run(tools.execute_sql_query(query))
+        byte_logs = [call.args[0] for call in printed.call_args_list if "bytes:" in str(call.args[0])]
+        if result.startswith("The query was rejected"):
+            outcome = "rejected"
+        elif '"truncated":true' in result:
+            outcome = "truncated"
+        else:
+            outcome = "ok"
+        detail = byte_logs[0].split("bytes: ", 1)[1] if byte_logs else result
+        print(f"{label:>20} {outcome:>9} {len(result):>13} {len(unguarded):>16}  {detail}")
+
+
+def make_intents(table_ref):
+    """Common requests, each as the SQL the model used to write and as a template tool call."""
+    user = "user_id = 'user1'"
+    week = "timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY)"
+    return [
+        ("flag events", "get_flag_events",
+         f"SELECT timestamp, signal_type, flag_type, confidence, topic_category, source_platform, event_details\n"
+         f"FROM `{table_ref}`\nWHERE {user} AND {week} AND signal_type != 'NEUTRAL_FLAG'\nORDER BY timestamp DESC"),
+        ("flag summary", "get_flag_summary",
+         f"SELECT flag_type, signal_type, COUNT(*) AS events, ROUND(AVG(confidence), 3) AS mean_confidence,\n"
+         f"  MAX(confidence) AS max_confidence, MIN(timestamp) AS first_seen, MAX(timestamp) AS last_seen\n"
+         f"FROM `{table_ref}`\nWHERE {user} AND {week}\nGROUP BY flag_type, signal_type\nORDER BY events DESC"),
+        ("hour of day", "get_hour_of_day_distribution",
+         f"SELECT EXTRACT(HOUR FROM timestamp) AS hour_utc, COUNT(*) AS events,\n"
+         f"  COUNTIF(signal_type != 'NEUTRAL_FLAG') AS flagged_events\n"
+         f"FROM `{table_ref}`\nWHERE {user} AND {week}\nGROUP BY hour_utc\nORDER BY hour_utc"),
+        ("confidence trend", "get_confidence_trend",
+         f"SELECT DATE(timestamp) AS day, COUNT(*) AS events, COUNTIF(signal_type = 'IMMEDIATE_FLAG') AS immediate_flags,\n"
+         f"  ROUND(AVG(confidence), 3) AS mean_confidence, MAX(confidence) AS max_confidence\n"
+         f"FROM `{table_ref}`\nWHERE {user} AND {week}\nGROUP BY day\nORDER BY day"),
+    ]
+
+
+def estimate_tokens(text):
+    """Roughly four characters per token, which is close for SQL and JSON."""
+    return max(1, round(len(text) / 4))
+
+
+async def time_call(call):
+    start = time.perf_counter()
+    await call
+    return time.perf_counter() - start
+
+
+def templates_scenario(args):
+    tools = load_tools()
+    arguments = {"user_id": "user1", "days": 7}
+    print(f"Simulated latency: query {args.query_latency_ms} ms, each BigQuery request {args.metadata_latency_ms} ms; "
+          f"model output at {args.decode_tokens_per_sec:g} tokens/sec")
+    print(f"{'intent':>18} {'SQL tokens':>11} {'args tokens':>12} {'SQL tool ms':>12} {'template ms':>12} {'saved ms':>9}")
+    total_saved = 0.0
+    with mock.patch.object(tools, "is_cacheable", return_value=False), mock.patch("builtins.print"):
+        rows = []
+        for label, tool_name, sql in make_intents(tools._TABLE_REF):
+            sql_tokens = estimate_tokens(json.dumps({"query": sql}))
+            args_tokens = estimate_tokens(json.dumps(arguments))
+            sql_secs = asyncio.run(time_call(tools.execute_sql_query(sql)))
+            template_secs = asyncio.run(time_call(getattr(tools, tool_name)(**arguments)))
+            saved = sql_secs - template_secs + (sql_tokens - args_tokens) / args.decode_tokens_per_sec
+            total_saved += saved
+            rows.append((label, sql_tokens, args_tokens, sql_secs, template_secs, saved))
+    for label, sql_tokens, args_tokens, sql_secs, template_secs, saved in rows:
+        print(f"{label:>18} {sql_tokens:>11} {args_tokens:>12} {sql_secs * 1000:>12.0f} {template_secs * 1000:>12.0f} "
+              f"{saved * 1000:>9.0f}")
+    print(f"Mean time saved per call, including model output: {total_saved / len(rows) * 1000:.0f} ms")
+    declarations = "".join(
+        tool_name + (getattr(tools, tool_name).__doc__ or "") for _, tool_name, _ in make_intents(tools._TABLE_REF)
+    )
+    print(f"The template tool declarations add about {estimate_tokens(declarations)} input tokens per model request")
+
+
+FLAG_TYPES = [
+    ("IMMEDIATE_FLAG", "SELF_INJURY"), ("INTERMEDIATE_FLAG", "CYBERBULLYING"),
+    ("INTERMEDIATE_FLAG", "INAPPROPRIATE_CONTENT"), ("NEUTRAL_FLAG", "NEUTRAL"),
+]
+CONTEXTS = [
+    "Searched for ways to hide marks on arms and read several forum threads describing methods in detail",
+    "Received repeated messages in a group chat mocking appearance, with classmates piling on over an evening",
+    "Opened a video site recommending mature content after following a link shared in a gaming community",
+    "Watching educational videos on history and taking notes for an upcoming school assignment",
+]
+
+
+def make_result_rows(count, days):
+    """Event rows shaped like user_activity_analysis, with event_details as the pipeline writes them."""
+    random.seed(count)
+    start = datetime.datetime(2025, 8, 1, tzinfo=datetime.timezone.utc)
+    rows = []
+    for i in range(count):
+        kind = random.randrange(len(FLAG_TYPES))
+        signal_type, flag_type = FLAG_TYPES[kind]
+        rows.append({
+            "user_id": "Alice",
+            "timestamp": start + datetime.timedelta(days=random.randrange(days), seconds=random.randrange(86400)),
+            "signal_type": signal_type,
+            "flag_type": flag_type,
+            "confidence": round(random.uniform(0.5, 1.0), 3),
+            "topic_category": ["Self Harm", "Social Dynamics", "Adult Content", "Educational Content"][kind],
+            "source_platform": "Chrome Extension",
+            "event_details": {
+                "context": CONTEXTS[kind] + f" (session {i})",
+                "corroborating_signals": random.sample(
+                    ["late night activity", "repeated searches", "private browsing", "new contact", "deleted messages"], 2
+                ),
+            },
+            "is_circuit_breaker_processed": kind == 0,
+        })
+    return sorted(rows, key=lambda row: row["timestamp"], reverse=True)
+
+
+def make_trend_rows(days):
+    start = datetime.date(2025, 8, 1)
+    return [
+        {"day": start + datetime.timedelta(days=i), "events": 40 + i % 7, "immediate_flags": i % 3,
+         "intermediate_flags": 2 + i % 4, "mean_confidence": 0.712, "max_confidence": 0.98}
+        for i in range(days)
+    ]
+
+
+def format_scenario(args):
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "aegis", "sub_agents", "bigquery_agent"))
+    from result_format import encode_rows
+
+    result_sets = [
+        ("10 events", make_result_rows(10, 7)),
+        ("200 events", make_result_rows(200, 30)),
+        ("30-day trend", make_trend_rows(30)),
+    ]
+    print("Tokens estimated at four characters per token")
+    print(f"{'result set':>14} {'indented JSON':>14} {'compact JSON':>13} {'columnar, full fields':>22} "
+          f"{'columnar':>9} {'saved':>6}")
+    for label, rows in result_sets:
+        indented = estimate_tokens(json.dumps(rows, indent=2, default=str))
+        compact = estimate_tokens(json.dumps(rows, separators=(",", ":"), default=str))
+        full_fields = estimate_tokens(encode_rows(rows, max_field_chars=10 ** 9, many_rows_max_field_chars=10 ** 9))
+        columnar = estimate_tokens(encode_rows(rows))
+        print(f"{label:>14} {indented:>14} {compact:>13} {full_fields:>22} {columnar:>9} {1 - columnar / indented:>6.0%}")
+
+
+def main():
+    global SIMULATED_QUERY_SECONDS, SIMULATED_METADATA_SECONDS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="scenario", required=True)
+
+    cache = subparsers.add_parser("cache", help="Latency of repeated queries with and without the result cache.")
+    cache.add_argument("--query-latency-ms", type=float, default=800.0)
+    cache.add_argument("--metadata-latency-ms", type=float, default=30.0)
+    cache.add_argument("--calls", type=int, default=200)
+    cache.add_argument("--distinct", type=int, default=20)
+    cache.add_argument("--write-every", type=int, default=50)
+    cache.set_defaults(handler=cache_scenario)
+
+    concurrency = subparsers.add_parser("concurrency", help="Wall time and event loop stalls of concurrent tool calls.")
+    concurrency.add_argument("--query-latency-ms", type=float, default=800.0)
+    concurrency.add_argument("--metadata-latency-ms", type=float, default=30.0)
+    concurrency.add_argument("--calls", type=int, nargs="+", default=[1, 2, 4, 8])
+    concurrency.set_defaults(handler=concurrency_scenario)
+
+    guard = subparsers.add_parser("guard", help="Which queries the guardrails reject or truncate, and the result sizes.")
+    guard.add_argument("--query-latency-ms", type=float, default=50.0)
+    guard.add_argument("--metadata-latency-ms", type=float, default=5.0)
+    guard.set_defaults(handler=guard_scenario)
+
+    templates = subparsers.add_parser("templates", help="Output tokens and latency of template tools against free-form SQL.")
+    templates.add_argument("--query-latency-ms", type=float, default=800.0)
+    templates.add_argument("--metadata-latency-ms", type=float, default=100.0)
+    templates.add_argument("--decode-tokens-per-sec", type=float, default=100.0)
+    templates.set_defaults(handler=templates_scenario)
+
+    result_format = subparsers.add_parser("format", help="Tokens of representative result sets in each output format.")
+    result_format.add_argument("--query-latency-ms", type=float, default=0.0)
+    result_format.add_argument("--metadata-latency-ms", type=float, default=0.0)
+    result_format.set_defaults(handler=format_scenario)
+
+    args = parser.parse_args()
+    SIMULATED_QUERY_SECONDS = args.query_latency_ms / 1000.0
+    SIMULATED_METADATA_SECONDS = args.metadata_latency_ms / 1000.0
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The BigQuery tools look up credentials when imported, so the agents are
+imported here with them stubbed, and tests swap in a fake BigQuery client.
+"""
+
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
+
+import google.auth
+import pytest
+from google.cloud import bigquery
+
+TEST_PROJECT = "test-project"
+
+with mock.patch.object(google.auth, "default", return_value=(SimpleNamespace(service_account_email="tests@example.com"), TEST_PROJECT)), \
+        mock.patch.object(bigquery, "Client"):
+    from aegis.sub_agents.bigquery_agent import tools
+from aegis.sub_agents.bigquery_agent.query_cache import QueryResultCache, TableVersions
+
+
+class FakeQueryJob:
+    """A query job that finishes `seconds` after it is submitted, unless it is cancelled first."""
+
+    def __init__(self, client, job_id, seconds):
+        self.client = client
+        self.job_id = job_id
+        self.cancelled = False
+        self.total_bytes_processed = 1024
+        self.total_bytes_billed = 10 * 1024 * 1024
+        self._finishes_at = time.monotonic() + seconds
+
+    def done(self):
+        finished = self.cancelled or time.monotonic() >= self._finishes_at
+        if finished:
+            self.client.finish(self)
+        return finished
+
+    def cancel(self):
+        self.cancelled = True
+        self.client.finish(self)
+        return True
+
+    def result(self, max_results=None):
+        time.sleep(max(self._finishes_at - time.monotonic(), 0))
+        self.client.finish(self)
+        return [{"flag_type": "NEUTRAL", "events": 10}][:max_results]
+
+
+class FakeBigQueryClient:
+    """Runs every query for `query_seconds` and tracks how many jobs run at once."""
+
+    def __init__(self, query_seconds=0.3):
+        self.query_seconds = query_seconds
+        self.jobs = []
+        self.running = set()
+        self.max_running = 0
+        self.missing_tables = set()
+        self._lock = threading.Lock()
+
+    def query(self, query, job_config=None, **kwargs):
+        if job_config is not None and job_config.dry_run:
+            return SimpleNamespace(statement_type="SELECT", total_bytes_processed=1024)
+        with self._lock:
+            job = FakeQueryJob(self, f"job_{len(self.jobs)}", self.query_seconds)
+            self.jobs.append(job)
+            self.running.add(job.job_id)
+            self.max_running = max(self.max_running, len(self.running))
+        return job
+
+    def finish(self, job):
+        with self._lock:
+            self.running.discard(job.job_id)
+
+    def get_table(self, table_ref):
+        if table_ref in self.missing_tables:
+            raise LookupError(f"Not found: Table {table_ref}")
+        return SimpleNamespace(modified=1, streaming_buffer=None)
+
+
+@pytest.fixture
+def bigquery_client(monkeypatch):
+    """Points the BigQuery tools at a fake client, with an empty result cache."""
+    client = FakeBigQueryClient()
+    monkeypatch.setattr(tools, "_CLIENT", client)
+    monkeypatch.setattr(tools, "_TABLE_VERSIONS", TableVersions(client))
+    monkeypatch.setattr(tools, "_QUERY_CACHE", QueryResultCache())
+    return client
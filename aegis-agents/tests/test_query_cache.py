@@ -0,0 +1,45 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from aegis.sub_agents.bigquery_agent import tools
+from aegis.sub_agents.bigquery_agent.query_cache import referenced_tables
+
+
+@pytest.mark.parametrize("query, tables", [
+    ("SELECT t.event_details.context FROM `p.d.events` t", ["p.d.events"]),
+    ("SELECT * FROM d.events e, e.event_details.corroborating_signals", ["proj.d.events"]),
+    ("SELECT EXTRACT(HOUR FROM timestamp) FROM p.d.events", ["p.d.events"]),
+    ("SELECT * FROM `p`.d.a JOIN d.b USING (id) WHERE x IS DISTINCT FROM y", ["p.d.a", "proj.d.b"]),
+    ("WITH recent AS (SELECT * FROM p.d.events) SELECT * FROM recent, UNNEST(recent.signals)", ["p.d.events"]),
+    ("SELECT * FROM (SELECT 'FROM p.d.hidden' AS s) -- FROM p.d.commented", []),
+])
+def test_referenced_tables(query, tables):
+    assert referenced_tables(query, "proj") == tables
+
+
+@pytest.mark.asyncio
+async def test_query_runs_uncached_when_a_table_version_cannot_be_looked_up(bigquery_client):
+    bigquery_client.missing_tables.add(tools._TABLE_REF)
+    query = (
+        f"SELECT flag_type, COUNT(*) AS events FROM `{tools._TABLE_REF}` WHERE user_id = 'user1' "
+        f"AND timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY) GROUP BY flag_type"
+    )
+
+    first = await tools.execute_sql_query(query)
+    second = await tools.execute_sql_query(query)
+
+    assert '"flag_type"' in first and second == first
+    assert len(bigquery_client.jobs) == 2
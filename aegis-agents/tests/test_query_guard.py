@@ -0,0 +1,121 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from aegis.sub_agents.bigquery_agent.query_guard import QueryGuard, QueryRejectedError
+
+TIME_FILTER = "timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY)"
+
+
+@pytest.fixture
+def guard():
+    return QueryGuard(
+        max_bytes_billed=1024 ** 3,
+        max_rows=200,
+        required_filters={"user_activity_analysis": "timestamp", "user_risk_summary": None},
+    )
+
+
+@pytest.mark.parametrize("table", [
+    "`test-project.aegis_dataset.user_activity_analysis`",
+    "test-project.aegis_dataset.user_activity_analysis",
+    "aegis_dataset.user_activity_analysis",
+    "`aegis_dataset.user_activity_analysis`",
+    "user_activity_analysis",
+])
+def test_required_filters_apply_however_the_table_is_named(guard, table):
+    with pytest.raises(QueryRejectedError, match="user_id and timestamp"):
+        guard.rewrite(f"SELECT * FROM {table}")
+    with pytest.raises(QueryRejectedError, match="timestamp"):
+        guard.rewrite(f"SELECT * FROM {table} WHERE user_id = 'user1'")
+    assert guard.rewrite(f"SELECT * FROM {table} WHERE user_id = 'user1' AND {TIME_FILTER}")
+
+
+def test_required_filters_apply_to_joined_tables(guard):
+    with pytest.raises(QueryRejectedError, match="user_risk_summary must filter on user_id"):
+        guard.rewrite(
+            "SELECT * FROM `p.d.other` o JOIN aegis_dataset.user_risk_summary r ON o.id = r.id"
+        )
+
+
+def test_column_paths_are_not_tables(guard):
+    query = (
+        f"SELECT t.event_details.context FROM `p.aegis_dataset.user_activity_analysis` t "
+        f"WHERE user_id = 'user1' AND {TIME_FILTER}"
+    )
+    assert guard.rewrite(query).startswith(query)
+
+
+TABLE = "`p.aegis_dataset.user_activity_analysis`"
+
+
+@pytest.mark.parametrize("where, reason", [
+    ("timestamp > '2020-01-01' OR user_id = 'a'", "not combine it with OR"),
+    (f"user_id = 'a' OR {TIME_FILTER}", "not combine it with OR"),
+    (f"(user_id = 'a' OR user_id IS NULL) AND {TIME_FILTER}", "not combine it with OR"),
+    (f"user_id IN (SELECT user_id FROM {TABLE} WHERE risk_score > 0.9) AND {TIME_FILTER}", "not by a subquery"),
+    (f"user_id IN (SELECT user_id FROM {TABLE}) AND {TIME_FILTER}", "not by a subquery"),
+    (f"NOT user_id = 'a' AND {TIME_FILTER}", "must filter on user_id"),
+    ("user_id = 'a' AND event_name = 'timestamp >= x'", "must filter on timestamp"),
+])
+def test_filters_that_still_scan_the_table_are_rejected(guard, where, reason):
+    with pytest.raises(QueryRejectedError, match=reason):
+        guard.rewrite(f"SELECT * FROM {TABLE} WHERE {where}")
+
+
+def test_filters_must_be_on_the_select_that_reads_the_table(guard):
+    with pytest.raises(QueryRejectedError, match="must filter on user_id and timestamp"):
+        guard.rewrite(
+            f"SELECT * FROM `p.d.other` WHERE id IN (SELECT id FROM {TABLE}) "
+            f"AND user_id = 'a' AND {TIME_FILTER}"
+        )
+    with pytest.raises(QueryRejectedError, match="must filter on user_id and timestamp"):
+        guard.rewrite(
+            f"SELECT * FROM {TABLE} WHERE user_id = 'a' AND {TIME_FILTER} "
+            f"UNION ALL SELECT * FROM {TABLE}"
+        )
+
+
+@pytest.mark.parametrize("where", [
+    f"user_id = 'a' AND {TIME_FILTER}",
+    f"t.user_id IN ('a', 'b') AND (DATE(t.timestamp) BETWEEN '2025-08-01' AND '2025-08-20' AND (risk_score > 1 OR x))",
+    f"({TIME_FILTER}) AND (user_id = 'a' AND event_name = 'a or b')",
+    f"timestamp BETWEEN @start AND @end AND user_id = @user_id ORDER BY timestamp DESC",
+])
+def test_filters_anded_into_the_where_clause_are_accepted(guard, where):
+    assert guard.rewrite(f"SELECT * FROM {TABLE} t WHERE {where}")
+
+
+def test_filters_apply_inside_subqueries_and_ctes(guard):
+    assert guard.rewrite(
+        f"WITH recent AS (SELECT * FROM {TABLE} WHERE user_id = 'a' AND {TIME_FILTER}) "
+        f"SELECT event_name, COUNT(*) FROM recent GROUP BY event_name"
+    )
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT 1", "SELECT 1\nLIMIT 201"),
+    ("SELECT 1;", "SELECT 1\nLIMIT 201"),
+    ("SELECT 1 -- all of them", "SELECT 1\nLIMIT 201"),
+    ("SELECT 1 LIMIT 10", "SELECT 1 LIMIT 10"),
+    ("SELECT 1 LIMIT 10 -- newest", "SELECT 1 LIMIT 10"),
+    ("SELECT 1 LIMIT 10; # newest", "SELECT 1 LIMIT 10"),
+    ("SELECT 1\nLIMIT 10 /* newest */ ;\n", "SELECT 1\nLIMIT 10"),
+    ("SELECT 1 LIMIT 5000 -- everything", "SELECT 1 LIMIT 201"),
+    ("SELECT 1 LIMIT 5000 OFFSET 20", "SELECT 1 LIMIT 201 OFFSET 20"),
+    ("SELECT '-- not a comment' AS s", "SELECT '-- not a comment' AS s\nLIMIT 201"),
+])
+def test_limit_is_added_or_lowered(guard, query, expected):
+    assert guard.rewrite(query) == expected
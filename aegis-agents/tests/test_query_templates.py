@@ -0,0 +1,47 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+
+from aegis.sub_agents.bigquery_agent.query_templates import FLAG_EVENTS, MAX_DAYS
+
+
+def parameters(template_parameters):
+    return {p.name: (p.type_, p.value) for p in template_parameters}
+
+
+@pytest.mark.parametrize("days", [7, 7.0, "7", " 7 "])
+def test_days_is_bound_as_an_int64(days):
+    bound = parameters(FLAG_EVENTS.bind(" user1 ", days, max_rows=201))
+    assert bound == {"user_id": ("STRING", "user1"), "days": ("INT64", 7), "max_rows": ("INT64", 201)}
+
+
+@pytest.mark.parametrize("days, reason", [
+    (7.5, "whole number"),
+    ("7.5", "whole number"),
+    ("a week", "whole number"),
+    (None, "whole number"),
+    (True, "whole number"),
+    (float("nan"), "whole number"),
+    (0, "between 1 and"),
+    (MAX_DAYS + 1, "between 1 and"),
+])
+def test_days_that_are_not_a_whole_number_in_range_are_rejected(days, reason):
+    with pytest.raises(ValueError, match=reason):
+        FLAG_EVENTS.bind("user1", days)
+
+
+def test_user_id_is_required():
+    with pytest.raises(ValueError, match="user_id"):
+        FLAG_EVENTS.bind("  ", 7)
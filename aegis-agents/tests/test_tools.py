@@ -0,0 +1,102 @@
+# Copyright 2025 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from aegis.sub_agents.bigquery_agent import tools
+
+
+def user_query(user):
+    return (
+        f"SELECT flag_type, COUNT(*) AS events FROM `{tools._TABLE_REF}` WHERE user_id = '{user}' "
+        f"AND timestamp >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL 7 DAY) GROUP BY flag_type"
+    )
+
+
+async def run_calls(count, prefix="user"):
+    return await asyncio.gather(*(tools.execute_sql_query(user_query(f"{prefix}{i}")) for i in range(count)))
+
+
+@pytest.mark.asyncio
+async def test_queries_run_concurrently(bigquery_client):
+    start = time.monotonic()
+    results = await run_calls(3)
+    elapsed = time.monotonic() - start
+
+    assert all('"flag_type"' in result for result in results)
+    assert bigquery_client.max_running == 3
+    assert elapsed < 2 * bigquery_client.query_seconds
+
+
+@pytest.mark.asyncio
+async def test_running_queries_are_capped(bigquery_client, monkeypatch):
+    monkeypatch.setattr(tools, "_QUERY_SLOTS", threading.BoundedSemaphore(2))
+    results = await run_calls(5)
+
+    assert all('"flag_type"' in result for result in results)
+    assert len(bigquery_client.jobs) == 5
+    assert bigquery_client.max_running == 2
+
+
+def test_cap_holds_across_event_loops(bigquery_client, monkeypatch):
+    monkeypatch.setattr(tools, "_QUERY_SLOTS", threading.BoundedSemaphore(2))
+    results = []
+
+    def serve(prefix):
+        results.extend(asyncio.run(run_calls(3, prefix)))
+
+    threads = [threading.Thread(target=serve, args=(f"loop{n}-user",)) for n in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(results) == 6
+    assert all('"flag_type"' in result for result in results)
+    assert bigquery_client.max_running == 2
+
+
+@pytest.mark.asyncio
+async def test_query_past_timeout_is_cancelled(bigquery_client, monkeypatch):
+    monkeypatch.setattr(tools, "_QUERY_TIMEOUT_SECS", 0.1)
+    bigquery_client.query_seconds = 5
+
+    result = await tools.execute_sql_query(user_query("slow"))
+
+    assert "did not finish within 0.1 seconds" in result
+    [job] = bigquery_client.jobs
+    assert job.cancelled
+    assert not bigquery_client.running
+
+
+@pytest.mark.asyncio
+async def test_cancelled_tool_call_cancels_its_job(bigquery_client, monkeypatch):
+    monkeypatch.setattr(tools, "_QUERY_SLOTS", threading.BoundedSemaphore(1))
+    bigquery_client.query_seconds = 5
+    call = asyncio.create_task(tools.execute_sql_query(user_query("abandoned")))
+    while not bigquery_client.jobs:
+        await asyncio.sleep(0.01)
+
+    call.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await call
+
+    [job] = bigquery_client.jobs
+    assert job.cancelled
+    assert tools._QUERY_SLOTS.acquire(blocking=False), "the call's query slot was not released"
+    tools._QUERY_SLOTS.release()
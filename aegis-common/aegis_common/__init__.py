@@ -0,0 +1 @@
+"""Code shared by the aegis-publisher and aegis-direct-bq ingestion services."""
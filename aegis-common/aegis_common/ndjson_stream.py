@@ -0,0 +1,315 @@
+"""
+Incremental reading of NDJSON request bodies, optionally compressed with gzip or
+zstd, so large uploads are validated and forwarded in chunks instead of being
+buffered and validated whole.
+"""
+import asyncio
+import zlib
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple, Type
+
+import zstandard
+from pydantic import BaseModel, ValidationError
+
+SUPPORTED_ENCODINGS = ("identity", "gzip", "zstd")
+
+# Errors raised while reading a body that is not valid NDJSON in the declared encoding.
+BODY_ERRORS = (ValueError, zlib.error, zstandard.ZstdError)
+
+
+class LineTooLongError(ValueError):
+    """Raised when a line grows past the limit without a line break."""
+
+
+class GzipInflater:
+    """Inflates a gzip body, returning at most `max_output_bytes` per piece."""
+
+    def __init__(self, max_output_bytes: int):
+        self.max_output_bytes = max_output_bytes
+        self._inflater = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        while data:
+            yield self._inflater.decompress(data, self.max_output_bytes)
+            data = self._inflater.unconsumed_tail
+
+    def flush(self) -> bytes:
+        remaining = self._inflater.flush()
+        if not self._inflater.eof:
+            raise ValueError("The gzip body ended before the end of its stream.")
+        return remaining
+
+
+class ZstdInflater:
+    """
+    Inflates a zstd body, returning at most `max_output_bytes` per piece.
+
+    The decompressor has no output limit, so the frame's block headers are
+    read as the body arrives and input is fed to it a few blocks at a time. A
+    block inflates to at most 128 KiB, and a raw or RLE block to exactly its
+    stated size, which bounds each call however compressible the body is.
+    """
+
+    MAX_BLOCK_BYTES = 128 * 1024
+
+    def __init__(self, max_output_bytes: int):
+        self.max_output_bytes = max_output_bytes
+        self._inflater = zstandard.ZstdDecompressor().decompressobj()
+        self._blocks = _ZstdBlockReader()
+
+    def decompress(self, data: bytes) -> Iterator[bytes]:
+        batch: List[bytes] = []
+        batch_bound = 0
+        for segment, bound in self._blocks.split(data):
+            if batch and batch_bound + bound > self.max_output_bytes:
+                yield from self._inflate(b"".join(batch))
+                batch, batch_bound = [], 0
+            batch.append(segment)
+            batch_bound += bound
+        if batch:
+            yield from self._inflate(b"".join(batch))
+
+    def _inflate(self, data: bytes) -> Iterator[bytes]:
+        output = self._inflater.decompress(data)
+        # A single block can still be larger than a small `max_output_bytes`.
+        for start in range(0, len(output), self.max_output_bytes):
+            yield output[start:start + self.max_output_bytes]
+
+    def flush(self) -> bytes:
+        if not self._inflater.eof:
+            raise ValueError("The zstd body ended before the end of its frame.")
+        return b""
+
+
+class _ZstdBlockReader:
+    """
+    Follows the frame and block headers of a zstd stream as it arrives, and
+    splits it into segments that each lie within one part of the stream, with
+    the most a segment can inflate to. Headers and checksums inflate to
+    nothing. Bytes that are not a zstd frame are passed through for the
+    decompressor to reject.
+    """
+
+    _FRAME_MAGIC = 0xFD2FB528
+    _FCS_SIZES = (0, 2, 4, 8)
+    _DICTIONARY_ID_SIZES = (0, 1, 2, 4)
+
+    def __init__(self):
+        self._header = b""
+        self._header_size = 5  # The frame magic and descriptor, until the descriptor is read.
+        self._state = "frame_header"
+        self._remaining = 0
+        self._bound = 0
+        self._last_block = False
+        self._checksum = False
+
+    def split(self, data: bytes) -> Iterator[Tuple[bytes, int]]:
+        position = 0
+        while position < len(data):
+            if self._state == "invalid":
+                yield data[position:], 0
+                return
+            if self._state in ("frame_header", "block_header"):
+                taken = data[position:position + self._header_size - len(self._header)]
+                self._header += taken
+                position += len(taken)
+                yield taken, 0
+                if len(self._header) == self._header_size:
+                    self._read_header()
+                continue
+            taken = data[position:position + self._remaining]
+            position += len(taken)
+            self._remaining -= len(taken)
+            yield taken, self._bound
+            if not self._remaining:
+                self._end_part()
+
+    def _read_header(self):
+        header = self._header
+        if self._state == "block_header":
+            self._header, self._header_size = b"", 5
+            block_header = int.from_bytes(header, "little")
+            block_type, block_size = (block_header >> 1) & 3, block_header >> 3
+            self._last_block = bool(block_header & 1)
+            if block_type == 1:  # RLE: one byte repeated block_size times.
+                self._state, self._remaining, self._bound = "block", 1, block_size
+            elif block_type == 3:
+                self._state = "invalid"
+            else:
+                bound = block_size if block_type == 0 else ZstdInflater.MAX_BLOCK_BYTES
+                self._state, self._remaining, self._bound = "block", block_size, bound
+            if self._state == "block" and not self._remaining:
+                self._end_part()
+            return
+
+        magic = int.from_bytes(header[:4], "little")
+        if magic != self._FRAME_MAGIC:
+            self._state = "invalid"
+            return
+        descriptor = header[4]
+        single_segment = bool(descriptor & 0x20)
+        fcs_size = self._FCS_SIZES[descriptor >> 6] or (1 if single_segment else 0)
+        header_size = 5 + (0 if single_segment else 1) + self._DICTIONARY_ID_SIZES[descriptor & 3] + fcs_size
+        if len(header) < header_size:
+            self._header_size = header_size
+            return
+        self._checksum = bool(descriptor & 0x04)
+        self._header, self._header_size, self._state = b"", 3, "block_header"
+
+    def _end_part(self):
+        """Moves on once a block or checksum has been read in full."""
+        if self._state == "block" and self._last_block and self._checksum:
+            self._state, self._remaining, self._bound = "checksum", 4, 0
+        elif self._state == "block" and not self._last_block:
+            self._header, self._header_size, self._state = b"", 3, "block_header"
+        else:
+            self._header, self._header_size, self._state = b"", 5, "frame_header"
+
+
+def decompressor(content_encoding: Optional[str], max_output_bytes: int = 256 * 1024):
+    """
+    Returns an inflater for a body sent with `content_encoding`, or None for an
+    uncompressed body.
+    """
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return None
+    if encoding == "gzip":
+        return GzipInflater(max_output_bytes)
+    if encoding == "zstd":
+        return ZstdInflater(max_output_bytes)
+    raise ValueError(f"Unsupported Content-Encoding: {content_encoding}. Use one of {', '.join(SUPPORTED_ENCODINGS)}.")
+
+
+async def iter_lines(
+    chunks: AsyncIterator[bytes],
+    content_encoding: Optional[str] = None,
+    max_line_bytes: int = 1024 * 1024,
+) -> AsyncIterator[Tuple[int, bytes]]:
+    """
+    Yields `(line_number, line)` for every non-blank line of the body, counting
+    lines from 1. Compressed bodies are inflated a bounded piece at a time, and
+    only the current partial line is held between pieces.
+    """
+    inflater = decompressor(content_encoding)
+    pending = b""
+    line_number = 0
+    async for chunk in chunks:
+        if not chunk:
+            continue
+        for piece in (inflater.decompress(chunk) if inflater is not None else [chunk]):
+            pending += piece
+            *lines, pending = pending.split(b"\n")
+            for line in lines:
+                line_number += 1
+                if line.strip():
+                    yield line_number, line
+            if len(pending) > max_line_bytes:
+                raise LineTooLongError(f"Line {line_number + 1} is longer than {max_line_bytes} bytes.")
+
+    if inflater is not None:
+        pending += inflater.flush()
+    if pending.strip():
+        yield line_number + 1, pending
+
+
+async def validate_chunks(
+    lines: AsyncIterator[Tuple[int, bytes]],
+    model: Type[BaseModel],
+    chunk_rows: int = 500,
+) -> AsyncIterator[Tuple[List[int], List[BaseModel], List[dict]]]:
+    """
+    Validates each line against `model` and yields `(line_numbers, rows,
+    errors)` for every `chunk_rows` lines read. Lines that fail validation are
+    reported in `errors` as `{"line": n, "errors": [...]}` instead of failing
+    the upload.
+    """
+    line_numbers: List[int] = []
+    rows: List[BaseModel] = []
+    errors: List[dict] = []
+    async for line_number, line in lines:
+        try:
+            rows.append(model.model_validate_json(line))
+            line_numbers.append(line_number)
+        except ValidationError as e:
+            errors.append({
+                "line": line_number,
+                "errors": e.errors(include_url=False, include_input=False, include_context=False),
+            })
+        if len(rows) + len(errors) >= chunk_rows:
+            yield line_numbers, rows, errors
+            line_numbers, rows, errors = [], [], []
+    if rows or errors:
+        yield line_numbers, rows, errors
+
+
+class UploadReport:
+    """
+    Counts the lines of an upload and keeps the first `max_errors` line errors,
+    so the response stays small however many lines fail.
+    """
+
+    def __init__(self, max_errors: int = 100):
+        self.max_errors = max_errors
+        self.rows_received = 0
+        self.rows_accepted = 0
+        self.error_count = 0
+        self.errors: List[dict] = []
+
+    def add_errors(self, line_errors: List[dict]):
+        self.error_count += len(line_errors)
+        self.errors.extend(line_errors[:max(self.max_errors - len(self.errors), 0)])
+
+    def as_response(self, accepted_key: str) -> dict:
+        return {
+            "status": "partial" if self.error_count else "success",
+            "rows_received": self.rows_received,
+            accepted_key: self.rows_accepted,
+            "error_count": self.error_count,
+            "errors": sorted(self.errors, key=lambda error: error["line"]),
+        }
+
+
+async def stream_upload(
+    chunks: AsyncIterator[bytes],
+    content_encoding: Optional[str],
+    model: Type[BaseModel],
+    forward: Callable[[List[BaseModel]], Awaitable[Dict[int, list]]],
+    report: UploadReport,
+    chunk_rows: int = 500,
+    max_pending_chunks: int = 4,
+    max_line_bytes: int = 1024 * 1024,
+):
+    """
+    Reads, validates and forwards an NDJSON body chunk by chunk, recording the
+    outcome in `report`. `forward` receives the valid rows of one chunk and
+    returns their errors keyed by position in that chunk. At most
+    `max_pending_chunks` chunks are forwarded at once, which bounds memory.
+
+    Raises one of BODY_ERRORS if the body cannot be read. Chunks forwarded
+    before that point are still awaited and counted.
+    """
+    pending: Set[asyncio.Task] = set()
+
+    async def forward_chunk(line_numbers: List[int], rows: List[BaseModel]):
+        try:
+            errors_by_index = await forward(rows)
+        except Exception as e:
+            errors_by_index = {index: [{"message": str(e)}] for index in range(len(rows))}
+        report.rows_accepted += len(rows) - len(errors_by_index)
+        report.add_errors([
+            {"line": line_numbers[index], "errors": errors} for index, errors in sorted(errors_by_index.items())
+        ])
+
+    try:
+        lines = iter_lines(chunks, content_encoding, max_line_bytes)
+        async for line_numbers, rows, line_errors in validate_chunks(lines, model, chunk_rows):
+            report.rows_received += len(line_numbers) + len(line_errors)
+            report.add_errors(line_errors)
+            if not rows:
+                continue
+            if len(pending) >= max_pending_chunks:
+                _, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            pending.add(asyncio.create_task(forward_chunk(line_numbers, rows)))
+    finally:
+        if pending:
+            await asyncio.wait(pending)
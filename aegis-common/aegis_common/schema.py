@@ -0,0 +1,31 @@
+"""
+The record schema shared by the ingestion services, so both validate uploads
+against the same models.
+
+Request bodies are validated straight from bytes with `SIGNAL_DATA_LIST`, and
+rows are serialized straight to JSON bytes with `SIGNAL_DATA`, which skips the
+intermediate Python objects of `json.loads`, `model_dump` and `json.dumps`.
+"""
+from typing import List, Optional
+
+from pydantic import BaseModel, TypeAdapter
+
+
+class EventDetails(BaseModel):
+    context: Optional[str] = None
+    corroborating_signals: Optional[List[str]] = None
+
+
+class SignalData(BaseModel):
+    user_id: str
+    timestamp: str
+    signal_type: str
+    flag_type: str
+    confidence: float
+    topic_category: Optional[str] = None
+    source_platform: Optional[str] = None
+    event_details: Optional[EventDetails] = None
+
+
+SIGNAL_DATA = TypeAdapter(SignalData)
+SIGNAL_DATA_LIST = TypeAdapter(List[SignalData])
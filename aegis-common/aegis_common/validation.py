@@ -0,0 +1,10 @@
+"""Helpers for reporting invalid request bodies."""
+from pydantic import ValidationError
+
+
+def request_validation_errors(error: ValidationError) -> list:
+    """Formats a body validation error the way FastAPI reports invalid bodies."""
+    return [
+        {**detail, "loc": ("body", *detail["loc"])}
+        for detail in error.errors(include_url=False, include_context=False)
+    ]
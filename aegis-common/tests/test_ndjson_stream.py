@@ -0,0 +1,84 @@
+import asyncio
+import gzip
+import os
+
+import pytest
+import zstandard
+
+from aegis_common.ndjson_stream import decompressor, iter_lines
+
+MAX_OUTPUT_BYTES = 64 * 1024
+
+
+def inflate(content_encoding, body, chunk_bytes):
+    """Returns the pieces an inflater produces for `body` sent in chunks of `chunk_bytes`."""
+    inflater = decompressor(content_encoding, MAX_OUTPUT_BYTES)
+    pieces = []
+    for start in range(0, len(body), chunk_bytes):
+        pieces.extend(inflater.decompress(body[start:start + chunk_bytes]))
+    pieces.append(inflater.flush())
+    return pieces
+
+
+def ndjson(lines):
+    return b"".join(b'{"n": %d, "pad": "%s"}\n' % (i, os.urandom(8).hex().encode()) for i in range(lines))
+
+
+@pytest.mark.parametrize("compress", [
+    zstandard.ZstdCompressor().compress,
+    zstandard.ZstdCompressor(level=19, write_checksum=True).compress,
+    zstandard.ZstdCompressor(write_content_size=False).compress,
+])
+@pytest.mark.parametrize("chunk_bytes", [1, 7, 4096, 1 << 20])
+def test_zstd_bodies_inflate_in_bounded_pieces(compress, chunk_bytes):
+    # Highly compressible runs, which inflate far past the limit from a few bytes, between random lines.
+    body = ndjson(200) + b" " * (8 * 1024 * 1024) + ndjson(200) + b"\n" * (3 * 1024 * 1024)
+    compressed = compress(body)
+    assert len(compressed) < 64 * 1024
+
+    pieces = inflate("zstd", compressed, chunk_bytes)
+
+    assert max(len(piece) for piece in pieces) <= MAX_OUTPUT_BYTES
+    assert b"".join(pieces) == body
+
+
+def test_zstd_raw_blocks_are_followed():
+    # zstd stores an uncompressible body in raw blocks.
+    body = os.urandom(300 * 1024)
+    compressed = zstandard.ZstdCompressor().compress(body)
+
+    pieces = inflate("zstd", compressed, 1000)
+
+    assert max(len(piece) for piece in pieces) <= MAX_OUTPUT_BYTES
+    assert b"".join(pieces) == body
+
+
+def test_gzip_bodies_inflate_in_bounded_pieces():
+    body = ndjson(100) + b" " * (8 * 1024 * 1024)
+    pieces = inflate("gzip", gzip.compress(body), 4096)
+    assert max(len(piece) for piece in pieces) <= MAX_OUTPUT_BYTES
+    assert b"".join(pieces) == body
+
+
+@pytest.mark.parametrize("content_encoding, body", [
+    ("zstd", b"not zstd at all"),
+    ("zstd", zstandard.ZstdCompressor().compress(ndjson(50))[:-10]),
+    ("gzip", gzip.compress(ndjson(50))[:-10]),
+])
+def test_corrupt_or_truncated_bodies_are_rejected(content_encoding, body):
+    with pytest.raises((ValueError, zstandard.ZstdError)):
+        inflate(content_encoding, body, 64)
+
+
+def test_iter_lines_reads_a_zstd_body():
+    body = ndjson(1000)
+    compressed = zstandard.ZstdCompressor().compress(body)
+
+    async def chunks():
+        for start in range(0, len(compressed), 333):
+            yield compressed[start:start + 333]
+
+    async def read():
+        return [line async for _, line in iter_lines(chunks(), "zstd")]
+
+    assert asyncio.run(read()) == body.splitlines()
@@ -0,0 +1,301 @@
+"""
+Benchmark harness for the Aegis consumer pipeline.
+
+The BigQuery sinks are replaced with a simulated sink that models how each
+write method batches and commits rows, so the harness runs locally without any
+cloud resources. Rows arrive at a steady simulated rate and are event-timestamped
+with their arrival time. The sink reports the number of write calls, the cost
+per million rows at list prices, and the latency from arrival to commit.
+
+The pipeline runs on the FnApiRunner, the DirectRunner's in-process engine.
+For stateful transforms like GroupIntoBatches, the DirectRunner otherwise falls
+back to its bundle-based runner, which does not report the sink's metrics.
+
+Usage:
+    python benchmark.py sinks --rate 50 --duration-secs 600
+    python benchmark.py parse --messages 100000
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+import apache_beam as beam
+from apache_beam import metrics
+from apache_beam.options.pipeline_options import PipelineOptions
+from apache_beam.transforms import window
+
+os.environ.setdefault("GCP_PROJECT_ID", "benchmark-project")
+os.environ.setdefault("PUB_SUB_TOPIC_ID", "benchmark-topic")
+os.environ.setdefault("BIGQUERY_DATASET_ID", "benchmark_dataset")
+os.environ.setdefault("BIGQUERY_TABLE_ID", "benchmark_table")
+os.environ.setdefault("BIGQUERY_DEAD_LETTER_TABLE", "benchmark_dead_letter")
+os.environ.setdefault("TEMP_CLOUD_STORAGE", "benchmark-bucket")
+
+# List prices in USD. Streaming inserts bill each row as at least 1 KB. Batch
+# load jobs use the shared slot pool and are free.
+STREAMING_INSERT_USD_PER_BYTE = 0.01 / (200 * 1024 ** 2)
+STREAMING_INSERT_MIN_ROW_BYTES = 1024
+STORAGE_WRITE_USD_PER_BYTE = 0.025 / 1024 ** 3
+
+
+def load_main():
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import main
+    return main
+
+
+def make_row(i):
+    return {
+        "user_id": f"user{i % 3}",
+        "timestamp": "2025-08-22T12:00:00+00:00",
+        "signal_type": "NEUTRAL_FLAG",
+        "flag_type": "NEUTRAL",
+        "confidence": 0.9,
+        "topic_category": "Educational Content",
+        "source_platform": "Chrome Extension",
+        "event_details": {
+            "context": "Watching educational videos on history",
+            "corroborating_signals": ["neutral user activity"],
+        },
+    }
+
+
+def make_flagged_row(i):
+    return {
+        "user_id": f"user{i % 3}",
+        "timestamp": "2025-08-22T21:14:00+00:00",
+        "signal_type": "IMMEDIATE_FLAG",
+        "flag_type": "SELF_INJURY",
+        "confidence": 0.97,
+        "topic_category": "Mental Health",
+        "source_platform": "Chrome Extension",
+        "event_details": {
+            "context": "The browser is currently on a blog post titled 'My Struggle and How I Cope'.",
+            "corroborating_signals": [
+                "Search: 'how to hide scars'",
+                "Visited forum thread about coping alone",
+                "Closed a helpline page after 3 seconds",
+            ],
+        },
+    }
+
+
+# --- Parsing Baseline ---
+class LegacyParseAndConform(beam.DoFn):
+    """ParseAndConform as it was before the msgspec fast path, for comparison."""
+
+    def process(self, element: bytes):
+        try:
+            json_string = element.decode('utf-8')
+            data = json.loads(json_string)
+            if 'event_details' not in data or data['event_details'] is None:
+                data['event_details'] = {}
+            if 'context' not in data['event_details'] or data['event_details']['context'] is None:
+                data['event_details']['context'] = ""
+            if 'corroborating_signals' not in data['event_details'] or data['event_details']['corroborating_signals'] is None:
+                data['event_details']['corroborating_signals'] = []
+            logging.info(f"Successfully parsed message for user_id: {data.get('user_id')}")
+            yield data
+        except Exception as e:
+            yield beam.pvalue.TaggedOutput('failed_records', {
+                "timestamp": datetime.datetime.utcnow().isoformat(),
+                "error_message": f"Failed to parse or conform message: {str(e)}",
+                "raw_payload": element.decode('utf-8', errors='ignore'),
+            })
+
+
+# --- Simulated Sink ---
+class RecordWriteCall(beam.DoFn):
+    """Records one simulated write call for a group of rows."""
+
+    def __init__(self, batch_size, commit_latency_secs, usd_per_byte, min_row_bytes):
+        self.batch_size = batch_size
+        self.commit_latency_secs = commit_latency_secs
+        self.usd_per_byte = usd_per_byte
+        self.min_row_bytes = min_row_bytes
+        self.write_calls = metrics.Metrics.counter('benchmark', 'write_calls')
+        self.rows = metrics.Metrics.counter('benchmark', 'rows')
+        self.billed_bytes = metrics.Metrics.counter('benchmark', 'billed_bytes')
+        self.latency_ms = metrics.Metrics.distribution('benchmark', 'latency_ms')
+
+    def process(self, element, window=beam.DoFn.WindowParam):
+        _, rows = element
+        rows = list(rows)
+        # A full batch is written as soon as its last row arrives, anything
+        # else waits for the end of the flush interval.
+        if self.batch_size and len(rows) == self.batch_size:
+            written_at = max(arrival for arrival, _ in rows)
+        else:
+            written_at = window.end.micros / 1e6
+        committed_at = written_at + self.commit_latency_secs
+
+        self.write_calls.inc()
+        self.rows.inc(len(rows))
+        self.billed_bytes.inc(sum(max(size, self.min_row_bytes) for _, size in rows))
+        for arrival, _ in rows:
+            self.latency_ms.update(int((committed_at - arrival) * 1000))
+
+
+class SimulatedBigQuerySink(beam.PTransform):
+    """
+    Groups `(arrival_secs, row_bytes)` elements the way a write method would.
+    Rows are flushed every `flush_interval_secs` on each of `shards` keys,
+    in calls of at most `batch_size` rows when a batch size applies.
+    """
+
+    def __init__(self, flush_interval_secs, shards, batch_size, commit_latency_secs,
+                 usd_per_byte, min_row_bytes=0):
+        super().__init__()
+        self.flush_interval_secs = flush_interval_secs
+        self.shards = shards
+        self.batch_size = batch_size
+        self.record_write_call = RecordWriteCall(batch_size, commit_latency_secs, usd_per_byte, min_row_bytes)
+
+    def expand(self, rows):
+        keyed = (
+            rows
+            | "Window by Flush Interval" >> beam.WindowInto(window.FixedWindows(self.flush_interval_secs))
+            | "Key by Shard" >> beam.WithKeys(lambda _: random.randrange(self.shards))
+        )
+        if self.batch_size:
+            grouped = keyed | "Batch Rows" >> beam.GroupIntoBatches(self.batch_size)
+        else:
+            grouped = keyed | "Group Rows" >> beam.GroupByKey()
+        return grouped | "Record Write Calls" >> beam.ParDo(self.record_write_call)
+
+
+def simulated_sink(settings, args):
+    """Builds the simulated sink for a set of WriteToBigQuery arguments."""
+    method = settings['method']
+    Method = beam.io.WriteToBigQuery.Method
+    if method == Method.STREAMING_INSERTS:
+        # Without auto-sharding, rows are flushed at the end of each bundle.
+        return SimulatedBigQuerySink(
+            settings.get('triggering_frequency') or args.bundle_secs, args.shards, settings['batch_size'],
+            args.insert_latency_ms / 1000.0, STREAMING_INSERT_USD_PER_BYTE, STREAMING_INSERT_MIN_ROW_BYTES,
+        )
+    if method == Method.STORAGE_WRITE_API:
+        # At-least-once appends each bundle, exactly-once commits every triggering interval.
+        flush_interval = args.bundle_secs if settings['use_at_least_once'] else settings['triggering_frequency']
+        return SimulatedBigQuerySink(
+            flush_interval, args.shards, None, args.append_latency_ms / 1000.0, STORAGE_WRITE_USD_PER_BYTE,
+        )
+    # One load job per triggering interval.
+    return SimulatedBigQuerySink(settings['triggering_frequency'], 1, None, args.load_job_secs, 0.0)
+
+
+def run_sink(settings, args):
+    """Runs the simulated load through one sink and returns its metrics."""
+    row_bytes = len(json.dumps(make_row(0)).encode("utf-8"))
+    total_rows = int(args.rate * args.duration_secs)
+
+    options = PipelineOptions(flags=[], runner=args.runner)
+    pipeline = beam.Pipeline(options=options)
+    (
+        pipeline
+        | "Create Arrivals" >> beam.Create(range(total_rows))
+        | "Timestamp Arrivals" >> beam.Map(
+            lambda i: window.TimestampedValue((i / args.rate, row_bytes), i / args.rate)
+        )
+        | "Write to Simulated Sink" >> simulated_sink(settings, args)
+    )
+    result = pipeline.run()
+    result.wait_until_finish()
+
+    query = result.metrics().query(metrics.MetricsFilter().with_namespace('benchmark'))
+    counters = {counter.key.metric.name: counter.committed for counter in query['counters']}
+    latency = query['distributions'][0].committed
+    return counters, latency
+
+
+def sinks_scenario(args):
+    main = load_main()
+    configurations = [
+        ("streaming_inserts", main.bigquery_write_settings(
+            "STREAMING_INSERTS", batch_size=args.batch_size, auto_sharding=False)),
+        ("streaming_inserts+auto", main.bigquery_write_settings(
+            "STREAMING_INSERTS", triggering_frequency_secs=args.streaming_insert_frequency_secs, batch_size=args.batch_size)),
+        ("storage_write_at_least_once", main.bigquery_write_settings(
+            "STORAGE_WRITE_API", at_least_once=True)),
+        ("storage_write_exactly_once", main.bigquery_write_settings(
+            "STORAGE_WRITE_API", triggering_frequency_secs=args.storage_write_frequency_secs)),
+        ("file_loads", main.bigquery_write_settings(
+            "FILE_LOADS", triggering_frequency_secs=args.file_loads_frequency_secs)),
+    ]
+
+    print(f"{args.rate} rows/sec for {args.duration_secs} simulated seconds on {args.runner}")
+    print(f"{'method':>28} {'write calls':>12} {'USD / 1M rows':>14} {'mean ms':>10} {'max ms':>10}")
+    for label, settings in configurations:
+        if args.method and label not in args.method:
+            continue
+        counters, latency = run_sink(settings, args)
+        usd_per_byte = simulated_sink(settings, args).record_write_call.usd_per_byte
+        usd_per_million = counters['billed_bytes'] * usd_per_byte / counters['rows'] * 1_000_000
+        print(f"{label:>28} {counters['write_calls']:>12} {usd_per_million:>14.4f} "
+              f"{latency.mean:>10.0f} {latency.max:>10}")
+
+
+def time_parse(parse_fn, messages):
+    start = time.perf_counter()
+    for message in messages:
+        for _ in parse_fn.process(message):
+            pass
+    return time.perf_counter() - start
+
+
+def parse_scenario(args):
+    """Per-element cost of ParseAndConform.process on the generator's record shapes."""
+    main = load_main()
+    # Workers log at INFO, so formatted log lines are paid for even when discarded here.
+    logging.basicConfig(stream=open(os.devnull, "w"), level=logging.INFO, force=True)
+
+    messages = [
+        json.dumps(make_flagged_row(i) if i % 4 == 0 else make_row(i)).encode("utf-8")
+        for i in range(args.messages)
+    ]
+    fast_path = main.ParseAndConform()
+    fast_path.setup()
+
+    print(f"{args.messages} messages, best of {args.repeat}")
+    print(f"{'parser':>10} {'us/element':>12}")
+    for label, parse_fn in [("json", LegacyParseAndConform()), ("msgspec", fast_path)]:
+        elapsed = min(time_parse(parse_fn, messages) for _ in range(args.repeat))
+        print(f"{label:>10} {elapsed / args.messages * 1e6:>12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="scenario", required=True)
+
+    sinks = subparsers.add_parser("sinks", help="Cost per row and latency for each BigQuery write method.")
+    sinks.add_argument("--runner", default="FnApiRunner")
+    sinks.add_argument("--method", nargs="+", help="Only run these configurations.")
+    sinks.add_argument("--rate", type=float, default=50.0, help="Rows per simulated second.")
+    sinks.add_argument("--duration-secs", type=float, default=600.0)
+    sinks.add_argument("--shards", type=int, default=8)
+    sinks.add_argument("--batch-size", type=int, default=500)
+    sinks.add_argument("--bundle-secs", type=float, default=1.0, help="Simulated streaming bundle duration.")
+    sinks.add_argument("--streaming-insert-frequency-secs", type=float, default=2.0)
+    sinks.add_argument("--storage-write-frequency-secs", type=float, default=5.0)
+    sinks.add_argument("--file-loads-frequency-secs", type=float, default=300.0)
+    sinks.add_argument("--insert-latency-ms", type=float, default=50.0)
+    sinks.add_argument("--append-latency-ms", type=float, default=30.0)
+    sinks.add_argument("--load-job-secs", type=float, default=15.0)
+    sinks.set_defaults(handler=sinks_scenario)
+
+    parse = subparsers.add_parser("parse", help="Per-element cost of parsing and conforming messages.")
+    parse.add_argument("--messages", type=int, default=100000)
+    parse.add_argument("--repeat", type=int, default=3)
+    parse.set_defaults(handler=parse_scenario)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,26 +3,56 @@ from apache_beam.options.pipeline_options import PipelineOptions
 import json
 import os
 import datetime
+import gzip
+import hashlib
+import ipaddress
 import logging
+import random
+import re
+import threading
+import time
+import typing
+import zlib
+import zoneinfo
+from collections import OrderedDict
+import msgspec
+from google.api_core import exceptions as google_exceptions
 from google.cloud import dlp_v2
 from apache_beam import metrics
+from apache_beam.utils import shared
+from apache_beam.transforms import trigger, window
+from apache_beam.utils.windowed_value import PaneInfoTiming
+from apache_beam.utils.timestamp import Duration, Timestamp
+from apache_beam.transforms.deduplicate import DeduplicatePerKey
+from apache_beam.transforms.userstate import ReadModifyWriteStateSpec, TimerSpec, on_timer
+from apache_beam.transforms.timeutil import TimeDomain
 
 # --- Pipeline Configuration ---
 PROJECT_ID = os.environ.get("GCP_PROJECT_ID")
 PUBSUB_TOPIC = os.environ.get("PUB_SUB_TOPIC_ID")
+PUBSUB_SUBSCRIPTION = os.environ.get("PUB_SUB_SUBSCRIPTION_ID")
 BIGQUERY_DATASET = os.environ.get("BIGQUERY_DATASET_ID")
 BIGQUERY_TABLE = os.environ.get("BIGQUERY_TABLE_ID")
 TEMP_CLOUD_STORAGE = os.environ.get("TEMP_CLOUD_STORAGE")
 BIGQUERY_DEAD_LETTER_TABLE = os.environ.get("BIGQUERY_DEAD_LETTER_TABLE")
+BIGQUERY_DLP_DEAD_LETTER_TABLE = os.environ.get("BIGQUERY_DLP_DEAD_LETTER_TABLE", f"{BIGQUERY_DEAD_LETTER_TABLE}_dlp")
+BIGQUERY_SUMMARY_TABLE = os.environ.get("BIGQUERY_SUMMARY_TABLE", "user_risk_summary")
+ALERTS_PUB_SUB_TOPIC_ID = os.environ.get("ALERTS_PUB_SUB_TOPIC_ID")
+BIGQUERY_CIRCUIT_BREAKER_TABLE = os.environ.get("BIGQUERY_CIRCUIT_BREAKER_TABLE", "circuit_breaker_events")
 DLP_DEID_TEMPLATE_NAME = os.environ.get("DLP_DEID_TEMPLATE_NAME")
 
-if not all([PROJECT_ID, PUBSUB_TOPIC, BIGQUERY_DATASET, BIGQUERY_TABLE, BIGQUERY_DEAD_LETTER_TABLE, TEMP_CLOUD_STORAGE]):
+if not all([PROJECT_ID, PUBSUB_TOPIC or PUBSUB_SUBSCRIPTION, BIGQUERY_DATASET, BIGQUERY_TABLE, BIGQUERY_DEAD_LETTER_TABLE, TEMP_CLOUD_STORAGE]):
     raise ValueError("Missing one or more required environment variables.")
 
 # --- Resource Paths ---
 pubsub_topic_path = f"projects/{PROJECT_ID}/topics/{PUBSUB_TOPIC}"
+pubsub_subscription_path = f"projects/{PROJECT_ID}/subscriptions/{PUBSUB_SUBSCRIPTION}"
 bigquery_table_spec = f"{PROJECT_ID}:{BIGQUERY_DATASET}.{BIGQUERY_TABLE}"
 bigquery_dead_letter_table_spec = f"{PROJECT_ID}:{BIGQUERY_DATASET}.{BIGQUERY_DEAD_LETTER_TABLE}"
+bigquery_dlp_dead_letter_table_spec = f"{PROJECT_ID}:{BIGQUERY_DATASET}.{BIGQUERY_DLP_DEAD_LETTER_TABLE}"
+bigquery_summary_table_spec = f"{PROJECT_ID}:{BIGQUERY_DATASET}.{BIGQUERY_SUMMARY_TABLE}"
+alerts_pubsub_topic_path = f"projects/{PROJECT_ID}/topics/{ALERTS_PUB_SUB_TOPIC_ID}"
+bigquery_circuit_breaker_table_spec = f"{PROJECT_ID}:{BIGQUERY_DATASET}.{BIGQUERY_CIRCUIT_BREAKER_TABLE}"
 
 # --- BigQuery Schemas ---
 BIGQUERY_SCHEMA = {
@@ -42,7 +72,8 @@ BIGQUERY_SCHEMA = {
                 {'name': 'context', 'type': 'STRING', 'mode': 'NULLABLE'},
                 {'name': 'corroborating_signals', 'type': 'STRING', 'mode': 'REPEATED'}
             ]
-        }
+        },
+        {'name': 'is_circuit_breaker_processed', 'type': 'BOOLEAN', 'mode': 'NULLABLE'}
     ]
 }
 
@@ -50,10 +81,200 @@ DEAD_LETTER_SCHEMA = {
     'fields': [
         {'name': 'timestamp', 'type': 'TIMESTAMP', 'mode': 'REQUIRED'},
         {'name': 'error_message', 'type': 'STRING', 'mode': 'REQUIRED'},
-        {'name': 'raw_payload', 'type': 'STRING', 'mode': 'NULLABLE'}
+        {'name': 'raw_payload', 'type': 'STRING', 'mode': 'NULLABLE'},
+        {'name': 'reason_code', 'type': 'STRING', 'mode': 'NULLABLE'},
+        {'name': 'failed_field', 'type': 'STRING', 'mode': 'NULLABLE'}
     ]
 }
 
+CIRCUIT_BREAKER_EVENT_SCHEMA = {
+    'fields': [
+        {'name': 'user_id', 'type': 'STRING', 'mode': 'NULLABLE'},
+        {'name': 'tripped_at', 'type': 'TIMESTAMP', 'mode': 'REQUIRED'},
+        {'name': 'score', 'type': 'FLOAT', 'mode': 'REQUIRED'},
+        {'name': 'rolling_flag_count', 'type': 'INTEGER', 'mode': 'REQUIRED'},
+        {'name': 'signal_type', 'type': 'STRING', 'mode': 'NULLABLE'},
+        {'name': 'flag_type', 'type': 'STRING', 'mode': 'NULLABLE'}
+    ]
+}
+
+# One row per user and window. With early firings a window is written several
+# times, so readers take the row with the latest `updated_at`.
+USER_RISK_SUMMARY_SCHEMA = {
+    'fields': [
+        {'name': 'user_id', 'type': 'STRING', 'mode': 'REQUIRED'},
+        {'name': 'window_size', 'type': 'STRING', 'mode': 'REQUIRED'},
+        {'name': 'window_start', 'type': 'TIMESTAMP', 'mode': 'REQUIRED'},
+        {'name': 'window_end', 'type': 'TIMESTAMP', 'mode': 'REQUIRED'},
+        {'name': 'event_count', 'type': 'INTEGER', 'mode': 'REQUIRED'},
+        {
+            'name': 'signal_type_counts',
+            'type': 'RECORD',
+            'mode': 'REPEATED',
+            'fields': [
+                {'name': 'name', 'type': 'STRING', 'mode': 'NULLABLE'},
+                {'name': 'count', 'type': 'INTEGER', 'mode': 'NULLABLE'}
+            ]
+        },
+        {
+            'name': 'flag_type_counts',
+            'type': 'RECORD',
+            'mode': 'REPEATED',
+            'fields': [
+                {'name': 'name', 'type': 'STRING', 'mode': 'NULLABLE'},
+                {'name': 'count', 'type': 'INTEGER', 'mode': 'NULLABLE'}
+            ]
+        },
+        {'name': 'mean_confidence', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+        {'name': 'max_confidence', 'type': 'FLOAT', 'mode': 'NULLABLE'},
+        {'name': 'hour_of_day_counts', 'type': 'INTEGER', 'mode': 'REPEATED'},
+        {'name': 'is_final', 'type': 'BOOLEAN', 'mode': 'REQUIRED'},
+        {'name': 'updated_at', 'type': 'TIMESTAMP', 'mode': 'REQUIRED'}
+    ]
+}
+
+# --- Flag Taxonomy ---
+# The flag types the extension and the mock data generator can report, grouped
+# by signal type. The extension reports neutral events as NEUTRAL_FLAG and the
+# generator as NEUTRAL.
+FLAG_TAXONOMY = {
+    'IMMEDIATE_FLAG': {
+        "SUICIDE", "GORE", "DRUGS", "CHILD_ABUSE", "VIOLENCE",
+        "ILLEGAL_ACTIVITY", "EXTREMISM", "SELF_INJURY", "DANGEROUS_CHALLENGE",
+    },
+    'INTERMEDIATE_FLAG': {
+        "NSFW", "SMUT", "HURTFUL_LANGUAGE_PATTERN", "RACIAL_INSULTS",
+        "CYBERBULLYING", "MISINFORMATION", "SPAM", "HARASSMENT",
+        "INAPPROPRIATE_CONTENT", "HATEFUL_CONDUCT",
+    },
+    'NEUTRAL_FLAG': {"NEUTRAL", "NEUTRAL_FLAG"},
+}
+
+# Reason codes for dead-lettered records.
+REASON_MALFORMED_JSON = "MALFORMED_JSON"
+REASON_INVALID_TYPE = "INVALID_TYPE"
+REASON_INVALID_TIMESTAMP = "INVALID_TIMESTAMP"
+REASON_UNKNOWN_ENUM_VALUE = "UNKNOWN_ENUM_VALUE"
+REASON_DLP_REDACTION_FAILED = "DLP_REDACTION_FAILED"
+
+# --- Event Time and Deduplication ---
+# The publisher sets these attributes on every message: a deterministic event
+# ID, which the Pub/Sub source deduplicates on, and the event time, which the
+# pipeline uses as each element's timestamp. Records are deduplicated again by
+# the same ID within EVENT_DEDUP_WINDOW_SECS of event time, which also catches
+# replays published after the source's own deduplication window.
+EVENT_ID_ATTRIBUTE = "event_id"
+EVENT_TIMESTAMP_ATTRIBUTE = "event_timestamp"
+EVENT_DEDUP_WINDOW_SECS = int(os.environ.get("EVENT_DEDUP_WINDOW_SECS", "600"))
+
+# The publisher gzips large payloads and names the encoding in this attribute.
+CONTENT_ENCODING_ATTRIBUTE = "content_encoding"
+
+# The publisher copies the signal type into an attribute, so messages are
+# routed to the fast or bulk lane without decoding their payloads.
+SIGNAL_TYPE_ATTRIBUTE = "signal_type"
+
+# --- BigQuery Write Configuration ---
+# Each sink chooses its own write method, trading freshness against cost per row.
+# The main table defaults to streaming inserts for sub-second freshness. The
+# dead-letter tables default to periodic file loads, which are free but only
+# land rows once per triggering interval.
+BIGQUERY_WRITE_METHODS = {
+    'STREAMING_INSERTS': beam.io.WriteToBigQuery.Method.STREAMING_INSERTS,
+    'STORAGE_WRITE_API': beam.io.WriteToBigQuery.Method.STORAGE_WRITE_API,
+    'FILE_LOADS': beam.io.WriteToBigQuery.Method.FILE_LOADS,
+}
+
+
+def bigquery_write_settings(method, triggering_frequency_secs=None, batch_size=500,
+                            auto_sharding=True, at_least_once=False):
+    """
+    Returns the WriteToBigQuery arguments for a write method.
+
+    - STREAMING_INSERTS sends up to `batch_size` rows per insert. With
+      auto-sharding, `triggering_frequency_secs` bounds how long a partial
+      batch waits.
+    - STORAGE_WRITE_API commits exactly once every `triggering_frequency_secs`,
+      or appends as rows arrive when `at_least_once` is set.
+    - FILE_LOADS starts a load job every `triggering_frequency_secs`.
+    """
+    method = method.upper()
+    if method not in BIGQUERY_WRITE_METHODS:
+        raise ValueError(f"Unsupported BigQuery write method: {method}. "
+                         f"Expected one of {', '.join(BIGQUERY_WRITE_METHODS)}.")
+
+    settings = {
+        'method': BIGQUERY_WRITE_METHODS[method],
+        'with_auto_sharding': auto_sharding,
+    }
+    if method == 'STREAMING_INSERTS':
+        settings['batch_size'] = batch_size
+        # Beam only accepts a triggering frequency for streaming inserts with auto-sharding.
+        if auto_sharding and triggering_frequency_secs:
+            settings['triggering_frequency'] = triggering_frequency_secs
+    elif method == 'STORAGE_WRITE_API':
+        settings['use_at_least_once'] = at_least_once
+        if not at_least_once:
+            settings['triggering_frequency'] = triggering_frequency_secs or 5
+    else:
+        settings['triggering_frequency'] = triggering_frequency_secs or 300
+    return settings
+
+
+def _optional_float(value):
+    return float(value) if value else None
+
+
+BIGQUERY_WRITE_SETTINGS = bigquery_write_settings(
+    os.environ.get("BIGQUERY_WRITE_METHOD", "STREAMING_INSERTS"),
+    triggering_frequency_secs=_optional_float(os.environ.get("BIGQUERY_WRITE_TRIGGERING_FREQUENCY_SECS")),
+    batch_size=int(os.environ.get("BIGQUERY_WRITE_BATCH_SIZE", "500")),
+    auto_sharding=os.environ.get("BIGQUERY_WRITE_AUTO_SHARDING", "true").lower() == "true",
+    at_least_once=os.environ.get("BIGQUERY_WRITE_AT_LEAST_ONCE", "false").lower() == "true",
+)
+BIGQUERY_DEAD_LETTER_WRITE_SETTINGS = bigquery_write_settings(
+    os.environ.get("BIGQUERY_DEAD_LETTER_WRITE_METHOD", "FILE_LOADS"),
+    triggering_frequency_secs=_optional_float(
+        os.environ.get("BIGQUERY_DEAD_LETTER_WRITE_TRIGGERING_FREQUENCY_SECS", "600")
+    ),
+    batch_size=int(os.environ.get("BIGQUERY_DEAD_LETTER_WRITE_BATCH_SIZE", "500")),
+    auto_sharding=os.environ.get("BIGQUERY_DEAD_LETTER_WRITE_AUTO_SHARDING", "true").lower() == "true",
+    at_least_once=os.environ.get("BIGQUERY_DEAD_LETTER_WRITE_AT_LEAST_ONCE", "false").lower() == "true",
+)
+BIGQUERY_SUMMARY_WRITE_SETTINGS = bigquery_write_settings(
+    os.environ.get("BIGQUERY_SUMMARY_WRITE_METHOD", "STREAMING_INSERTS"),
+    triggering_frequency_secs=_optional_float(os.environ.get("BIGQUERY_SUMMARY_WRITE_TRIGGERING_FREQUENCY_SECS")),
+    batch_size=int(os.environ.get("BIGQUERY_SUMMARY_WRITE_BATCH_SIZE", "500")),
+    auto_sharding=os.environ.get("BIGQUERY_SUMMARY_WRITE_AUTO_SHARDING", "true").lower() == "true",
+    at_least_once=os.environ.get("BIGQUERY_SUMMARY_WRITE_AT_LEAST_ONCE", "false").lower() == "true",
+)
+
+# --- User Risk Summary Configuration ---
+# Events are aggregated per user over each of these windows. Windows longer
+# than a day slide daily, shorter ones are fixed. Windows emit early results
+# every USER_RISK_SUMMARY_EARLY_FIRING_SECS until the watermark closes them
+# (0 disables early results).
+USER_RISK_SUMMARY_WINDOWS = [
+    size.strip() for size in os.environ.get("USER_RISK_SUMMARY_WINDOWS", "1h,1d,7d").split(",") if size.strip()
+]
+USER_RISK_SUMMARY_SLIDE_SECS = 24 * 3600
+USER_RISK_SUMMARY_EARLY_FIRING_SECS = int(os.environ.get("USER_RISK_SUMMARY_EARLY_FIRING_SECS", "300"))
+USER_RISK_SUMMARY_ALLOWED_LATENESS_SECS = int(os.environ.get("USER_RISK_SUMMARY_ALLOWED_LATENESS_SECS", "3600"))
+
+# --- Circuit Breaker Configuration ---
+# Each flag adds its signal type's weight to a user's score, which halves every
+# CIRCUIT_BREAKER_HALF_LIFE_SECS. A user's breaker trips when the score, or the
+# number of flags in the rolling window, crosses its threshold, and re-arms once
+# both have fallen back below the thresholds (the score below half of its own).
+CIRCUIT_BREAKER_FLAG_WEIGHTS = {'IMMEDIATE_FLAG': 1.0, 'INTERMEDIATE_FLAG': 0.3}
+CIRCUIT_BREAKER_HALF_LIFE_SECS = float(os.environ.get("CIRCUIT_BREAKER_HALF_LIFE_SECS", str(6 * 3600)))
+CIRCUIT_BREAKER_SCORE_THRESHOLD = float(os.environ.get("CIRCUIT_BREAKER_SCORE_THRESHOLD", "2.5"))
+CIRCUIT_BREAKER_WINDOW_SECS = int(os.environ.get("CIRCUIT_BREAKER_WINDOW_SECS", str(24 * 3600)))
+CIRCUIT_BREAKER_WINDOW_BUCKETS = int(os.environ.get("CIRCUIT_BREAKER_WINDOW_BUCKETS", "24"))
+CIRCUIT_BREAKER_COUNT_THRESHOLD = int(os.environ.get("CIRCUIT_BREAKER_COUNT_THRESHOLD", "5"))
+# State for users with no events in this long is dropped.
+CIRCUIT_BREAKER_STATE_TTL_SECS = int(os.environ.get("CIRCUIT_BREAKER_STATE_TTL_SECS", str(7 * 24 * 3600)))
+
 # --- DLP Configuration ---
 # A comprehensive list of InfoType detectors for thorough PII redaction.
 # This list can be customized for specific needs.
@@ -89,130 +310,1044 @@ DLP_INFOTYPES = [
     {"name": "MEDICAL_TERM"}
 ]
 
+# Records are grouped into bounded batches so that each DLP request carries many
+# records. Batches are keyed by a random shard so they can be processed in
+# parallel, and are flushed when full or after the max buffering duration.
+DLP_BATCH_SIZE = int(os.environ.get("DLP_BATCH_SIZE", "100"))
+DLP_BATCH_MAX_BUFFERING_SECS = float(os.environ.get("DLP_BATCH_MAX_BUFFERING_SECS", "5"))
+DLP_BATCH_SHARDS = int(os.environ.get("DLP_BATCH_SHARDS", "8"))
+
+# A batch is split into as many DLP requests as needed to stay within the
+# API's content limits for a single table item.
+DLP_MAX_TABLE_CELLS = int(os.environ.get("DLP_MAX_TABLE_CELLS", "50000"))
+DLP_MAX_REQUEST_BYTES = int(os.environ.get("DLP_MAX_REQUEST_BYTES", str(450 * 1024)))
+
+# DLP requests are rate limited on each worker to its share of the project's
+# quota, and retried with exponential backoff and jitter when throttled.
+DLP_QUOTA_REQUESTS_PER_MINUTE = float(os.environ.get("DLP_QUOTA_REQUESTS_PER_MINUTE", "600"))
+DLP_EXPECTED_WORKERS = int(os.environ.get("DLP_EXPECTED_WORKERS", "1"))
+# Immediate flags are redacted one record at a time in a fast lane, with this
+# part of the quota reserved for them. The bulk lane gets the rest.
+DLP_FAST_LANE_QUOTA_REQUESTS_PER_MINUTE = float(os.environ.get("DLP_FAST_LANE_QUOTA_REQUESTS_PER_MINUTE", "60"))
+if DLP_FAST_LANE_QUOTA_REQUESTS_PER_MINUTE >= DLP_QUOTA_REQUESTS_PER_MINUTE:
+    raise ValueError("DLP_FAST_LANE_QUOTA_REQUESTS_PER_MINUTE must be lower than DLP_QUOTA_REQUESTS_PER_MINUTE.")
+DLP_MAX_RETRIES = int(os.environ.get("DLP_MAX_RETRIES", "5"))
+DLP_BACKOFF_BASE_SECS = float(os.environ.get("DLP_BACKOFF_BASE_SECS", "0.5"))
+DLP_BACKOFF_MAX_SECS = float(os.environ.get("DLP_BACKOFF_MAX_SECS", "30"))
+
+RETRYABLE_DLP_ERRORS = (
+    google_exceptions.TooManyRequests,
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.InternalServerError,
+    google_exceptions.Aborted,
+)
+
+# Redacted strings are cached per worker, so repeated texts are only sent to DLP once.
+REDACTION_CACHE_MAX_ENTRIES = int(os.environ.get("REDACTION_CACHE_MAX_ENTRIES", "50000"))
+REDACTION_CACHE_TTL_SECS = float(os.environ.get("REDACTION_CACHE_TTL_SECS", "86400"))
+
+# Texts are screened locally before DLP. Only empty and canned texts skip DLP,
+# so the screen never lets free text through unredacted.
+DLP_PREFILTER_ENABLED = os.environ.get("DLP_PREFILTER_ENABLED", "true").lower() == "true"
+
+
+# --- Local PII Screen ---
+# Verdicts returned by LocalPiiScreen.classify.
+SCREEN_CLEAN = "clean"
+SCREEN_LOCALLY_REDACTABLE = "locally_redactable"
+SCREEN_NEEDS_DLP = "needs_dlp"
+
+# Canned texts written by the extension and the mock data generator. Only
+# these exact strings, and empty text, are known to hold no PII; any other
+# text may contain names, places, health terms or dates that only DLP's
+# ML-based detectors can find.
+SCREEN_ALLOWLIST = frozenset({
+    "neutral user activity",
+    "Watching educational videos on history",
+    "Chatting with friends about a school project",
+    "Reading an e-book for literature class",
+    "Browsing for a new pair of sneakers",
+    "Listening to a curated playlist on Spotify",
+})
+
+
+def _luhn_valid(number):
+    digits = [int(d) for d in number]
+    checksum = 0
+    for i, digit in enumerate(reversed(digits)):
+        if i % 2 == 1:
+            digit *= 2
+            if digit > 9:
+                digit -= 9
+        checksum += digit
+    return checksum % 10 == 0
+
+
+def _nric_valid(nric):
+    nric = nric.upper()
+    weights = [2, 7, 6, 5, 4, 3, 2]
+    total = sum(int(d) * w for d, w in zip(nric[1:8], weights))
+    if nric[0] in "TG":
+        total += 4
+    if nric[0] in "ST":
+        return "JZIHGFEDCBA"[total % 11] == nric[8]
+    if nric[0] in "FG":
+        return "XWUTRQPNMLK"[total % 11] == nric[8]
+    # M-series checksums are not validated locally.
+    return False
+
+
+def _iban_valid(iban):
+    iban = iban.replace(" ", "").upper()
+    rearranged = iban[4:] + iban[:4]
+    return int("".join(str(int(c, 36)) for c in rearranged)) % 97 == 1
+
+
+def _ip_valid(address):
+    try:
+        ipaddress.ip_address(address)
+        return True
+    except ValueError:
+        return False
+
+
+class LocalPiiScreen:
+    """
+    A fast local pre-screen in front of DLP.
+
+    Only empty text and the exact canned strings in SCREEN_ALLOWLIST are
+    "clean" and skip DLP. Every other text is sent to DLP. Before it is sent,
+    structured identifiers (emails, phone numbers, NRIC/FIN, credit cards,
+    IBANs, IP and MAC addresses) that pass their checksums are replaced with
+    their infoType name, exactly as DLP would, so local redaction only ever
+    adds to what DLP redacts. Each text is classified as:
+      - "clean": kept as is without calling DLP.
+      - "locally_redactable": identifiers were replaced locally; the result
+        is still sent to DLP.
+      - "needs_dlp": sent to DLP unchanged.
+    Local redaction is limited to the given infoTypes.
+    """
+    DETECTORS = [
+        ("EMAIL_ADDRESS", re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+"), None),
+        ("IBAN_CODE", re.compile(r"\b[A-Z]{2}\d{2}(?: ?[A-Z0-9]{4}){2,7}(?: ?[A-Z0-9]{1,4})?\b"), _iban_valid),
+        ("CREDIT_CARD_NUMBER", re.compile(r"\b\d(?:[ -]?\d){12,18}\b"),
+         lambda match: _luhn_valid(re.sub(r"\D", "", match))),
+        ("SINGAPORE_NATIONAL_REGISTRATION_ID_CARD_NUMBER", re.compile(r"\b[STFGM]\d{7}[A-Z]\b", re.IGNORECASE), _nric_valid),
+        ("MAC_ADDRESS", re.compile(r"\b[0-9A-Fa-f]{2}(?:[:-][0-9A-Fa-f]{2}){5}\b"), None),
+        ("IP_ADDRESS", re.compile(r"\b(?:\d{1,3}\.){3}\d{1,3}\b|\b(?:[0-9A-Fa-f]{0,4}:){2,7}[0-9A-Fa-f]{0,4}\b"), _ip_valid),
+        ("PHONE_NUMBER", re.compile(r"(?<![\w+])(?:\+65[ -]?)?[689]\d{3}[ -]?\d{4}\b|\+\d{1,3}(?:[ -]?\d{2,4}){2,4}\b"), None),
+    ]
+
+    def __init__(self, info_types):
+        self.enabled_info_types = {info_type["name"] for info_type in info_types}
+
+    def classify(self, text):
+        """Returns a (verdict, text) pair, where text has any locally redacted identifiers replaced."""
+        if not text.strip() or text in SCREEN_ALLOWLIST:
+            return SCREEN_CLEAN, text
+
+        redacted = text
+        for info_type, pattern, validator in self.DETECTORS:
+            if info_type not in self.enabled_info_types:
+                continue
+            for match in pattern.findall(redacted):
+                if validator is None or validator(match):
+                    redacted = redacted.replace(match, f"[{info_type}]")
+
+        if redacted == text:
+            return SCREEN_NEEDS_DLP, text
+        return SCREEN_LOCALLY_REDACTABLE, redacted
+
+
+# --- Schema Structs ---
+# Scalar BigQuery types and the Python types messages are decoded into.
+SCHEMA_SCALAR_TYPES = {
+    'STRING': str,
+    'TIMESTAMP': str,
+    'FLOAT': float,
+    'INTEGER': int,
+    'BOOLEAN': bool,
+}
+
+
+def schema_struct(name, fields, nested=False):
+    """
+    Builds a msgspec Struct type from BigQuery schema fields, so messages can be
+    decoded straight from bytes into the table's shape. Fields missing from a
+    message are filled in by the struct: RECORD fields become empty records,
+    REPEATED fields become empty lists and, inside records, STRING fields become
+    empty strings. Explicit nulls for those fields are conformed the same way.
+    """
+    struct_fields = []
+    conform_defaults = {}
+    for field in fields:
+        if field['type'] == 'RECORD':
+            field_type = schema_struct(f"{name}_{field['name']}", field['fields'], nested=True)
+            default_factory = field_type
+        else:
+            field_type = SCHEMA_SCALAR_TYPES[field['type']]
+            default_factory = None
+            if nested and field['type'] == 'STRING':
+                default_factory = str
+
+        if field['mode'] == 'REPEATED':
+            field_type = typing.List[field_type]
+            default_factory = list
+
+        if default_factory is None:
+            struct_fields.append((field['name'], typing.Optional[field_type], None))
+        else:
+            struct_fields.append((field['name'], typing.Optional[field_type], msgspec.field(default_factory=default_factory)))
+            conform_defaults[field['name']] = default_factory
+
+    def __post_init__(self):
+        for field_name, default_factory in conform_defaults.items():
+            if getattr(self, field_name) is None:
+                setattr(self, field_name, default_factory())
+
+    return msgspec.defstruct(name, struct_fields, namespace={'__post_init__': __post_init__})
+
+
+# A timestamp in any format BigQuery accepts for TIMESTAMP values: a date, then
+# optionally a time with up to six fractional digits and a time zone, given as
+# Z, UTC, an offset or a tz database name.
+TIMESTAMP_PATTERN = re.compile(
+    r"(\d{4})-(\d{1,2})-(\d{1,2})"
+    r"(?:[Tt ](\d{1,2}):(\d{1,2}):(\d{1,2})(?:\.(\d{1,6}))?)?"
+    r"(?:\s*(?:(?P<utc>[Zz]|UTC)|(?P<offset>[+-]\d{1,2}(?::?\d{2})?)|(?P<zone>[A-Za-z_]+(?:/[A-Za-z0-9_+-]+)+)))?"
+)
+
+
+def parse_timestamp(value):
+    """
+    Parses a TIMESTAMP string the way BigQuery does and returns an aware
+    datetime. Timestamps without a time zone are in UTC. Raises ValueError for
+    anything BigQuery would reject.
+    """
+    match = TIMESTAMP_PATTERN.fullmatch(value.strip())
+    if match is None:
+        raise ValueError(f"Invalid timestamp: {value!r}")
+    year, month, day, hour, minute, second, fraction = match.groups()[:7]
+    if match.group('offset'):
+        sign, offset = match.group('offset')[0], match.group('offset')[1:].replace(':', '')
+        hours, minutes = (offset[:-2], offset[-2:]) if len(offset) > 2 else (offset, '0')
+        delta = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+        tzinfo = datetime.timezone(-delta if sign == '-' else delta)
+    elif match.group('zone'):
+        try:
+            tzinfo = zoneinfo.ZoneInfo(match.group('zone'))
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown time zone in timestamp: {value!r}")
+    else:
+        tzinfo = datetime.timezone.utc
+    return datetime.datetime(
+        int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+        int((fraction or '0').ljust(6, '0')), tzinfo=tzinfo,
+    )
+
+
+class RecordValidationError(ValueError):
+    """A record that does not conform to the table schema."""
+
+    def __init__(self, reason_code, failed_field, message):
+        super().__init__(message)
+        self.reason_code = reason_code
+        self.failed_field = failed_field
+
+
+class RecordValidator:
+    """
+    Checks what the decoded struct cannot: that TIMESTAMP fields in the schema
+    parse in a format BigQuery accepts, and that `signal_type` and `flag_type` belong to the flag taxonomy.
+    Types are already enforced when the message is decoded.
+    """
+    VALIDATION_ERROR_FIELD = re.compile(r"at `\$\.([^`]+)`")
+
+    def __init__(self, fields, taxonomy):
+        self.timestamp_paths = list(self._timestamp_paths(fields))
+        self.taxonomy = taxonomy
+        self.flag_types = set().union(*taxonomy.values())
+
+    @classmethod
+    def _timestamp_paths(cls, fields, prefix=()):
+        for field in fields:
+            path = prefix + (field['name'],)
+            if field['type'] == 'RECORD' and field['mode'] != 'REPEATED':
+                yield from cls._timestamp_paths(field['fields'], path)
+            elif field['type'] == 'TIMESTAMP' and field['mode'] != 'REPEATED':
+                yield path
+
+    def validate(self, record):
+        """Raises RecordValidationError for the first invalid field of `record`."""
+        for path in self.timestamp_paths:
+            value = record
+            for name in path:
+                value = value.get(name) if value is not None else None
+            if value is None:
+                continue
+            try:
+                parse_timestamp(value)
+            except ValueError:
+                raise RecordValidationError(
+                    REASON_INVALID_TIMESTAMP, '.'.join(path), f"Invalid timestamp: {value!r}"
+                )
+
+        signal_type = record.get('signal_type')
+        if signal_type is not None and signal_type not in self.taxonomy:
+            raise RecordValidationError(
+                REASON_UNKNOWN_ENUM_VALUE, 'signal_type', f"Unknown signal_type: {signal_type!r}"
+            )
+        flag_type = record.get('flag_type')
+        allowed_flag_types = self.taxonomy[signal_type] if signal_type is not None else self.flag_types
+        if flag_type is not None and flag_type not in allowed_flag_types:
+            scope = f" for {signal_type}" if signal_type is not None else ""
+            raise RecordValidationError(
+                REASON_UNKNOWN_ENUM_VALUE, 'flag_type', f"Unknown flag_type{scope}: {flag_type!r}"
+            )
+
+    @classmethod
+    def decode_error(cls, error):
+        """
+        Maps a msgspec decoding error to a RecordValidationError. A type error
+        without a field path is about the payload itself, such as an array or
+        a string where an object was expected, so it is reported as malformed.
+        """
+        if isinstance(error, msgspec.ValidationError):
+            match = cls.VALIDATION_ERROR_FIELD.search(str(error))
+            if match is not None:
+                return RecordValidationError(REASON_INVALID_TYPE, match.group(1), str(error))
+        return RecordValidationError(REASON_MALFORMED_JSON, None, str(error))
+
 
 class ParseAndConform(beam.DoFn):
     """
     Parses a Pub/Sub message, ensures it has a valid structure for BigQuery,
     and sends malformed records to a dead-letter output.
     It also tracks metrics for successful and failed parsing operations.
+
+    Payloads marked with a gzip content encoding are decompressed first.
+    Messages are decoded straight from bytes into a struct generated from
+    BIGQUERY_SCHEMA, which fills in missing fields and drops unknown ones.
+    Numeric strings are coerced to the schema's types. Decoded records are then
+    validated, so invalid rows are dead-lettered with a reason code here rather
+    than failing in the BigQuery sink.
+
+    With `with_publish_time`, each record is yielded as a (publish time,
+    record) pair, the publish time in seconds since the epoch or None for a
+    raw payload, so latency can be measured from when the message was published.
     """
-    def __init__(self):
+    def __init__(self, with_publish_time=False):
+        self.with_publish_time = with_publish_time
         self.parsed_records_counter = metrics.Metrics.counter('main', 'parsed_records_successfully')
         self.failed_records_counter = metrics.Metrics.counter('main', 'parsing_failures')
 
-    def process(self, element: bytes):
+    def setup(self):
+        # The struct type is built on the worker rather than pickled with the DoFn.
+        self.decoder = msgspec.json.Decoder(schema_struct('SignalRecord', BIGQUERY_SCHEMA['fields']), strict=False)
+        self.validator = RecordValidator(BIGQUERY_SCHEMA['fields'], FLAG_TAXONOMY)
+
+    def process(self, element):
+        publish_time = self.publish_time(element)
+        element = self.payload(element)
         try:
-            json_string = element.decode('utf-8')
-            data = json.loads(json_string)
-
-            # --- Data Conformance ---
-            # Ensure every record has a consistent structure, even if fields are empty.
-            # This prevents schema errors when writing to BigQuery.
-            if 'event_details' not in data or data['event_details'] is None:
-                data['event_details'] = {}
-            if 'context' not in data['event_details'] or data['event_details']['context'] is None:
-                data['event_details']['context'] = ""
-            if 'corroborating_signals' not in data['event_details'] or data['event_details']['corroborating_signals'] is None:
-                 data['event_details']['corroborating_signals'] = []
-            
+            try:
+                data = msgspec.to_builtins(self.decoder.decode(element))
+            except msgspec.DecodeError as e:
+                raise RecordValidator.decode_error(e)
+            self.validator.validate(data)
+
             self.parsed_records_counter.inc()
-            logging.info(f"Successfully parsed message for user_id: {data.get('user_id')}")
-            yield data
+            if logging.getLogger().isEnabledFor(logging.DEBUG):
+                logging.debug("Successfully parsed message for user_id: %s", data['user_id'])
+            yield (publish_time, data) if self.with_publish_time else data
 
+        except RecordValidationError as e:
+            yield self.dead_letter(element, e.reason_code, e.failed_field, str(e))
         except Exception as e:
-            self.failed_records_counter.inc()
-            error_message = f"Failed to parse or conform message: {str(e)}"
-            logging.warning(f"{error_message} | Raw Payload: {element.decode('utf-8', errors='ignore')}")
-            
-            error_record = {
-                "timestamp": datetime.datetime.utcnow().isoformat(),
-                "error_message": error_message,
-                "raw_payload": element.decode('utf-8', errors='ignore')
-            }
-            yield beam.pvalue.TaggedOutput('failed_records', error_record)
+            yield self.dead_letter(element, REASON_MALFORMED_JSON, None, str(e))
+
+    @staticmethod
+    def payload(element) -> bytes:
+        """Returns the JSON bytes of a Pub/Sub message, or of a raw payload."""
+        if not isinstance(element, beam.io.PubsubMessage):
+            return element
+        if (element.attributes or {}).get(CONTENT_ENCODING_ATTRIBUTE) == 'gzip':
+            try:
+                return gzip.decompress(element.data)
+            except (OSError, EOFError, zlib.error):
+                # Left compressed, so the record is dead-lettered as malformed.
+                metrics.Metrics.counter('main', 'decompression_failures').inc()
+        return element.data
+
+    @staticmethod
+    def publish_time(element):
+        """Returns when a Pub/Sub message was published, in seconds since the epoch, if known."""
+        publish_time = getattr(element, 'publish_time', None)
+        return publish_time.timestamp() if publish_time else None
+
+    def dead_letter(self, element, reason_code, failed_field, message):
+        self.failed_records_counter.inc()
+        metrics.Metrics.counter('main', f'invalid_records_{reason_code.lower()}').inc()
+        error_message = f"Failed to parse or conform message: {message}"
+        logging.warning(f"{error_message} | Raw Payload: {element.decode('utf-8', errors='ignore')}")
+
+        error_record = {
+            "timestamp": datetime.datetime.utcnow().isoformat(),
+            "error_message": error_message,
+            "raw_payload": element.decode('utf-8', errors='ignore'),
+            "reason_code": reason_code,
+            "failed_field": failed_field,
+        }
+        return beam.pvalue.TaggedOutput('failed_records', error_record)
+
+
+class RedactionCache:
+    """
+    A thread-safe LRU cache of redacted strings with a time-to-live. One
+    instance is shared by every RedactWithDLP instance on a worker.
+    """
+    def __init__(self, max_entries, ttl_secs):
+        self.max_entries = max_entries
+        self.ttl_secs = ttl_secs
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl_secs)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket. `acquire` reserves one token, sleeps until it is
+    available and returns the time spent waiting. One instance is shared by every
+    RedactWithDLP instance on a worker.
+    """
+    def __init__(self, rate_per_sec, capacity):
+        self.rate_per_sec = rate_per_sec
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_sec)
+            self._updated_at = now
+            # The token is reserved even if it is not available yet, so waiting
+            # callers are served in order.
+            self._tokens -= 1
+            wait_secs = max(0.0, -self._tokens / self.rate_per_sec)
+        if wait_secs:
+            time.sleep(wait_secs)
+        return wait_secs
+
+
+def plan_dlp_requests(rows, max_cells, max_bytes):
+    """
+    Splits text rows into groups of row indices that each fit in one DLP table
+    item. Rows are padded to the widest row of their request, so they are
+    grouped by width to keep one record with many signals from widening every
+    other row. Rows with no text are left out. A row that exceeds the limits on
+    its own still gets a request of its own.
+    """
+    requests = []
+    current, current_bytes = [], 0
+    for index in sorted((i for i, row in enumerate(rows) if row), key=lambda i: len(rows[i])):
+        row_bytes = sum(len(text.encode('utf-8')) for text in rows[index]) + 4 * len(rows[index])
+        cells = (len(current) + 1) * len(rows[index])
+        if current and (cells > max_cells or current_bytes + row_bytes > max_bytes):
+            requests.append(current)
+            current, current_bytes = [], 0
+        current.append(index)
+        current_bytes += row_bytes
+    if current:
+        requests.append(current)
+    return requests
 
 
 class RedactWithDLP(beam.DoFn):
     """
-    Takes a dictionary, sends specific text fields to Cloud DLP for de-identification,
-    and yields the redacted dictionary. Tracks metrics for DLP API calls and failures.
+    Takes a batch of dictionaries, sends their text fields to Cloud DLP for
+    de-identification, and yields each redacted dictionary. The batch is sent as
+    table items with one row per record: the first column holds the context and
+    the remaining columns hold the signals. Cells are mapped back by position, so
+    texts may contain newlines or any other character. The batch is split into as
+    few requests as DLP's table limits allow.
+
+    Requests are rate limited to the worker's share of `quota_requests_per_minute`
+    and retried with exponential backoff and jitter on retryable errors. Records
+    that still cannot be redacted are sent, unredacted, to the 'dlp_failures'
+    output so they never reach the main table.
+
+    Each text is first screened locally: only empty text and known canned
+    strings skip DLP, and validated structured identifiers are replaced before
+    the text is sent. Redacted strings are then cached by a hash of the text
+    and the DLP configuration, so a string that has been redacted once is
+    never sent to DLP again.
+    Tracks metrics for DLP API calls, failures, screen verdicts and cache hits.
+
+    With `keep_key`, each redacted dictionary is yielded with its batch's key.
     """
-    def __init__(self, project_id, info_types, deid_template_name=None):
+    def __init__(self, project_id, info_types, deid_template_name=None,
+                 quota_requests_per_minute=DLP_QUOTA_REQUESTS_PER_MINUTE, keep_key=False):
         self.project_id = project_id
         self.info_types = info_types
         self.deid_template_name = deid_template_name
+        self.quota_requests_per_minute = quota_requests_per_minute
+        self.keep_key = keep_key
         self.dlp_client = None
+        self.cache = None
+        self.limiter = None
+        self._shared_cache_handle = shared.Shared()
+        self._shared_limiter_handle = shared.Shared()
+        # A template may transform identifiers differently, so local redaction
+        # only replaces infoTypes when the built-in configuration is used.
+        self.screen = None
+        if DLP_PREFILTER_ENABLED:
+            self.screen = LocalPiiScreen([] if deid_template_name else info_types)
+        self.config_fingerprint = hashlib.sha256(
+            json.dumps([info_types, deid_template_name], sort_keys=True).encode('utf-8')
+        ).hexdigest()
         self.dlp_calls_counter = metrics.Metrics.counter('main', 'dlp_api_calls')
         self.dlp_failures_counter = metrics.Metrics.counter('main', 'dlp_failures')
+        self.dlp_batch_size = metrics.Metrics.distribution('main', 'dlp_batch_size')
+        self.dlp_retries_counter = metrics.Metrics.counter('main', 'dlp_retries')
+        self.dlp_throttle_wait_ms = metrics.Metrics.distribution('main', 'dlp_throttle_wait_ms')
+        self.dlp_backoff_wait_ms = metrics.Metrics.distribution('main', 'dlp_backoff_wait_ms')
+        self.cache_hits_counter = metrics.Metrics.counter('main', 'redaction_cache_hits')
+        self.cache_misses_counter = metrics.Metrics.counter('main', 'redaction_cache_misses')
+        self.screen_counters = {
+            SCREEN_CLEAN: metrics.Metrics.counter('main', 'dlp_prefilter_clean'),
+            SCREEN_LOCALLY_REDACTABLE: metrics.Metrics.counter('main', 'dlp_prefilter_locally_redacted'),
+            SCREEN_NEEDS_DLP: metrics.Metrics.counter('main', 'dlp_prefilter_needs_dlp'),
+        }
 
     def setup(self):
         # Initialize the DLP client once per worker to improve efficiency.
         self.dlp_client = dlp_v2.DlpServiceClient()
+        self.cache = self._shared_cache_handle.acquire(
+            lambda: RedactionCache(REDACTION_CACHE_MAX_ENTRIES, REDACTION_CACHE_TTL_SECS)
+        )
+        rate_per_sec = self.quota_requests_per_minute / 60.0 / DLP_EXPECTED_WORKERS
+        self.limiter = self._shared_limiter_handle.acquire(
+            lambda: TokenBucket(rate_per_sec, capacity=max(1.0, rate_per_sec))
+        )
 
-    def process(self, element: dict):
-        try:
-            original_context = element.get('event_details', {}).get('context', "")
-            original_signals = element.get('event_details', {}).get('corroborating_signals', [])
-
-            text_to_redact = [original_context] + original_signals
-            
-            # If there's no text to process, just pass the element through.
-            if not any(text_to_redact):
-                yield element
-                return
-
-            parent = f"projects/{self.project_id}"
-
-            # --- DLP Configuration ---
-            if self.deid_template_name:
-                deidentify_config = None
-                inspect_config = None
+    def process(self, element):
+        key, records = element
+        records = list(records)
+
+        # Texts are resolved from the cache where possible. Records with no
+        # uncached text are done without calling DLP.
+        pending = []
+        failed = {}
+        for record in records:
+            looked_up = [self.lookup(text) for text in
+                         [record['event_details']['context']] + record['event_details']['corroborating_signals']]
+            texts = [text for text, _ in looked_up]
+            redacted = [cached for _, cached in looked_up]
+            if None in redacted:
+                pending.append((record, texts, redacted))
+            else:
+                self.apply(record, redacted)
+
+        if pending:
+            # Cached cells, and repeats of a text already in this batch, are
+            # sent empty so DLP only processes each distinct miss once.
+            sent = set()
+            rows = []
+            for _, texts, redacted in pending:
+                row = []
+                for text, cached in zip(texts, redacted):
+                    if cached is None and text not in sent:
+                        sent.add(text)
+                        row.append(text)
+                    else:
+                        row.append("")
+                # Trailing empty cells are dropped so rows are only as wide as needed.
+                while row and not row[-1]:
+                    row.pop()
+                rows.append(row)
+
+            # Each cell is mapped back to its text by position, so a failed
+            # request only affects the records whose text it carried.
+            results = {}
+            errors = {}
+            for chunk in plan_dlp_requests(rows, DLP_MAX_TABLE_CELLS, DLP_MAX_REQUEST_BYTES):
+                chunk_rows = [rows[i] for i in chunk]
+                try:
+                    for row, response_row in zip(chunk_rows, self.deidentify_with_retry(chunk_rows)):
+                        for text, redacted_text in zip(row, response_row):
+                            if text:
+                                results[text] = redacted_text
+                except Exception as e:
+                    self.dlp_failures_counter.inc()
+                    logging.error(f"DLP redaction failed for a request of {len(chunk)} records. Error: {e}")
+                    for row in chunk_rows:
+                        for text in row:
+                            errors.setdefault(text, str(e))
+
+            for text in sent:
+                if text in results:
+                    self.cache.put(self.cache_key(text), results[text])
+
+            for record, texts, redacted in pending:
+                missing = [text for text, cached in zip(texts, redacted) if cached is None and text not in results]
+                if missing:
+                    failed[id(record)] = errors.get(missing[0], "DLP redaction failed.")
+                else:
+                    self.apply(record, [
+                        results[text] if cached is None else cached
+                        for text, cached in zip(texts, redacted)
+                    ])
+
+        for record in records:
+            error = failed.get(id(record))
+            if error is None:
+                yield (key, record) if self.keep_key else record
             else:
-                inspect_config = {"info_types": self.info_types}
-                # This configuration replaces any found PII with the infoType name, e.g., "[PERSON_NAME]".
-                deidentify_config = {
-                    "info_type_transformations": {
-                        "transformations": [
-                            {
-                                "primitive_transformation": {
-                                    "replace_with_info_type_config": {}
-                                }
+                # The unredacted record goes to the DLP dead-letter output instead of the main table.
+                yield beam.pvalue.TaggedOutput('dlp_failures', {
+                    "timestamp": datetime.datetime.utcnow().isoformat(),
+                    "error_message": f"DLP redaction failed: {error}",
+                    "raw_payload": json.dumps(record),
+                    "reason_code": REASON_DLP_REDACTION_FAILED,
+                    "failed_field": "event_details",
+                })
+
+    def cache_key(self, text):
+        return hashlib.sha256(f"{self.config_fingerprint}:{text}".encode('utf-8')).hexdigest()
+
+    def lookup(self, text):
+        """
+        Returns a (text, redacted) pair: the text to send to DLP, after any
+        local redaction, and its redacted form if the screen or cache already
+        has it, or None if DLP is needed.
+        """
+        if not text:
+            return text, text
+        if self.screen is not None:
+            verdict, text = self.screen.classify(text)
+            self.screen_counters[verdict].inc()
+            if verdict == SCREEN_CLEAN:
+                return text, text
+        redacted = self.cache.get(self.cache_key(text))
+        if redacted is None:
+            self.cache_misses_counter.inc()
+        else:
+            self.cache_hits_counter.inc()
+        return text, redacted
+
+    @staticmethod
+    def apply(record, redacted):
+        record['event_details']['context'] = redacted[0]
+        record['event_details']['corroborating_signals'] = redacted[1:]
+
+    def deidentify_with_retry(self, rows):
+        """
+        Calls `deidentify` within the worker's rate limit, retrying retryable
+        errors with exponential backoff and full jitter.
+        """
+        for attempt in range(DLP_MAX_RETRIES + 1):
+            self.dlp_throttle_wait_ms.update(int(self.limiter.acquire() * 1000))
+            try:
+                return self.deidentify(rows)
+            except RETRYABLE_DLP_ERRORS as e:
+                if attempt == DLP_MAX_RETRIES:
+                    raise
+                delay = random.uniform(0, min(DLP_BACKOFF_MAX_SECS, DLP_BACKOFF_BASE_SECS * 2 ** attempt))
+                logging.warning(f"Retrying DLP request in {delay:.2f}s after attempt {attempt + 1} failed. Error: {e}")
+                self.dlp_retries_counter.inc()
+                self.dlp_backoff_wait_ms.update(int(delay * 1000))
+                time.sleep(delay)
+
+    def deidentify(self, rows):
+        """
+        De-identifies a list of text rows with one DLP request and returns the
+        redacted rows in the same order. Rows are padded to a common width.
+        """
+        width = max(len(texts) for texts in rows)
+        headers = [{"name": "context"}] + [{"name": f"signal_{i}"} for i in range(width - 1)]
+        table = {
+            "headers": headers,
+            "rows": [
+                {"values": [{"string_value": text} for text in texts + [""] * (width - len(texts))]}
+                for texts in rows
+            ],
+        }
+
+        # --- DLP Configuration ---
+        if self.deid_template_name:
+            deidentify_config = None
+            inspect_config = None
+        else:
+            inspect_config = {"info_types": self.info_types}
+            # This configuration replaces any found PII with the infoType name, e.g., "[PERSON_NAME]".
+            deidentify_config = {
+                "info_type_transformations": {
+                    "transformations": [
+                        {
+                            "primitive_transformation": {
+                                "replace_with_info_type_config": {}
                             }
-                        ]
-                    }
+                        }
+                    ]
                 }
+            }
 
-            # --- Call the DLP API ---
-            logging.info(f"Calling DLP API for user_id: {element.get('user_id')}")
-            self.dlp_calls_counter.inc()
-            response = self.dlp_client.deidentify_content(
-                request={
-                    "parent": parent,
-                    "deidentify_template_name": self.deid_template_name,
-                    "inspect_config": inspect_config,
-                    "deidentify_config": deidentify_config,
-                    "item": {"value": "\n".join(text_to_redact)},
-                }
-            )
+        # --- Call the DLP API ---
+        logging.info(f"Calling DLP API for {len(rows)} records")
+        self.dlp_calls_counter.inc()
+        self.dlp_batch_size.update(len(rows))
+        response = self.dlp_client.deidentify_content(
+            request={
+                "parent": f"projects/{self.project_id}",
+                "deidentify_template_name": self.deid_template_name,
+                "inspect_config": inspect_config,
+                "deidentify_config": deidentify_config,
+                "item": {"table": table},
+            },
+            # Retries are handled by deidentify_with_retry, so the wait time is measured.
+            retry=None,
+        )
 
-            # --- Robust Re-assembly of Redacted Data ---
-            redacted_text_list = response.item.value.split('\n')
-            
-            # Check for length mismatch to prevent data corruption.
-            if len(redacted_text_list) != len(text_to_redact):
-                raise ValueError("DLP response length does not match request length.")
+        # --- Robust Re-assembly of Redacted Data ---
+        redacted_rows = [[cell.string_value for cell in row.values] for row in response.item.table.rows]
 
-            element['event_details']['context'] = redacted_text_list.pop(0)
-            element['event_details']['corroborating_signals'] = redacted_text_list
+        # Check for shape mismatch to prevent data corruption.
+        if len(redacted_rows) != len(rows) or any(len(row) != width for row in redacted_rows):
+            raise ValueError("DLP response table shape does not match request table shape.")
 
-            yield element
+        return redacted_rows
 
-        except Exception as e:
-            self.dlp_failures_counter.inc()
-            logging.error(f"DLP redaction failed for user_id: {element.get('user_id')}. Error: {e}")
-            # In a production system, you might want to route this to another dead-letter queue.
-            # For this example, we log the error and pass the original (unredacted) element through.
-            yield element
+
+# --- Event Deduplication ---
+def event_id(record):
+    """
+    Derives the deterministic event ID of a record from its user, time, flag
+    and context. The publisher computes the same ID for the message attribute.
+    """
+    context = (record.get('event_details') or {}).get('context') or ""
+    key = json.dumps([record.get('user_id'), record.get('timestamp'), record.get('flag_type'), context])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+class ParseAndDeduplicate(beam.PTransform):
+    """
+    Parses messages with ParseAndConform and drops duplicates of the same
+    event, such as publisher retries or replays. Returns the parsed records and
+    the records that failed to parse. With `with_publish_time`, the records are
+    (publish time, record) pairs, as from ParseAndConform.
+    """
+
+    def __init__(self, with_publish_time=False):
+        super().__init__()
+        self.with_publish_time = with_publish_time
+
+    def expand(self, messages):
+        parsed_results = messages | "Parse and Conform" >> beam.ParDo(
+            ParseAndConform(self.with_publish_time)
+        ).with_outputs('failed_records', main='parsed_records')
+        key = (lambda pair: event_id(pair[1])) if self.with_publish_time else event_id
+        records = (
+            parsed_results.parsed_records
+            | "Key by Event ID" >> beam.WithKeys(key)
+            | "Deduplicate Events" >> DeduplicatePerKey(event_time_duration=Duration(seconds=EVENT_DEDUP_WINDOW_SECS))
+            | "Drop Event IDs" >> beam.Values()
+        )
+        return records, parsed_results.failed_records
+
+
+# --- Immediate Flag Fast Lane ---
+def route_by_signal_type(message, num_partitions):
+    """
+    Sends immediate flags to the fast lane (0) and everything else to the bulk
+    lane (1), based on the message's signal type attribute. Only messages
+    published without the attribute are decoded to find their signal type.
+    """
+    signal_type = (message.attributes or {}).get(SIGNAL_TYPE_ATTRIBUTE)
+    if signal_type is None:
+        try:
+            signal_type = json.loads(ParseAndConform.payload(message)).get('signal_type')
+        except (ValueError, AttributeError):
+            pass
+    return 0 if signal_type == 'IMMEDIATE_FLAG' else 1
+
+
+class EmitAlert(beam.DoFn):
+    """
+    Encodes a redacted immediate flag, given as a (publish time, record) pair,
+    as an alert message, and records the latency from when its message was
+    published to Pub/Sub until now. The element timestamp is the event time,
+    which can be far older for delayed or backfilled events, so it is not used.
+    """
+    def __init__(self):
+        self.alerts_counter = metrics.Metrics.counter('main', 'immediate_flag_alerts')
+        self.alert_latency_ms = metrics.Metrics.distribution('main', 'immediate_flag_latency_ms')
+
+    def process(self, element):
+        publish_time, record = element
+        self.alerts_counter.inc()
+        if publish_time is not None:
+            self.alert_latency_ms.update(int((time.time() - publish_time) * 1000))
+        yield json.dumps(record).encode('utf-8')
+
+
+# --- Circuit Breaker ---
+class CircuitBreakerFn(beam.DoFn):
+    """
+    Tracks each user's flags with Beam state and emits a breaker event to the
+    'breaker_events' output when the user's breaker trips. Records are passed
+    through with `is_circuit_breaker_processed` set while the breaker is tripped.
+
+    State per user is bounded: a decay-weighted score, the time it was last
+    updated, and at most CIRCUIT_BREAKER_WINDOW_BUCKETS flag counts for the
+    rolling window. An event-time timer drops the state once the user has been
+    quiet for CIRCUIT_BREAKER_STATE_TTL_SECS.
+
+    Event time is read from each record's own timestamp. Records reach the
+    breaker through GroupIntoBatches, which gives every record in a batch one
+    element timestamp, up to the end of the global window on a final flush.
+    """
+    BREAKER_STATE = ReadModifyWriteStateSpec('breaker', beam.coders.FastPrimitivesCoder())
+    EXPIRY_TIMER = TimerSpec('expiry', TimeDomain.WATERMARK)
+
+    def __init__(self):
+        self.breaker_trips_counter = metrics.Metrics.counter('main', 'circuit_breaker_trips')
+        self.breaker_score = metrics.Metrics.distribution('main', 'circuit_breaker_score_x100')
+
+    def process(self, element, timestamp=beam.DoFn.TimestampParam,
+                breaker_state=beam.DoFn.StateParam(BREAKER_STATE),
+                expiry_timer=beam.DoFn.TimerParam(EXPIRY_TIMER)):
+        user_id, record = element
+        event_time = self.event_time(record, timestamp)
+        state = breaker_state.read() or {'score': 0.0, 'scored_at': event_time, 'buckets': {}, 'tripped': False}
+
+        weight = CIRCUIT_BREAKER_FLAG_WEIGHTS.get(record.get('signal_type'), 0.0)
+        self.add_flag(state, event_time, weight)
+        rolling_flag_count = sum(state['buckets'].values())
+
+        score_crossed = state['score'] >= CIRCUIT_BREAKER_SCORE_THRESHOLD
+        count_crossed = rolling_flag_count >= CIRCUIT_BREAKER_COUNT_THRESHOLD
+        if not state['tripped'] and weight and (score_crossed or count_crossed):
+            state['tripped'] = True
+            self.breaker_trips_counter.inc()
+            yield beam.pvalue.TaggedOutput('breaker_events', {
+                'user_id': user_id,
+                'tripped_at': datetime.datetime.fromtimestamp(event_time, datetime.timezone.utc).isoformat(),
+                'score': state['score'],
+                'rolling_flag_count': rolling_flag_count,
+                'signal_type': record.get('signal_type'),
+                'flag_type': record.get('flag_type'),
+            })
+        elif state['tripped'] and state['score'] < CIRCUIT_BREAKER_SCORE_THRESHOLD / 2 and not count_crossed:
+            state['tripped'] = False
+
+        self.breaker_score.update(int(state['score'] * 100))
+        breaker_state.write(state)
+        expiry_timer.set(Timestamp(state['scored_at'] + CIRCUIT_BREAKER_STATE_TTL_SECS))
+        yield {**record, 'is_circuit_breaker_processed': state['tripped']}
+
+    @on_timer(EXPIRY_TIMER)
+    def expire(self, breaker_state=beam.DoFn.StateParam(BREAKER_STATE)):
+        breaker_state.clear()
+
+    @staticmethod
+    def event_time(record, timestamp):
+        """
+        The record's timestamp in seconds since the epoch. Records without one
+        fall back to the element timestamp, or to the current time if that is
+        the end of the global window.
+        """
+        if record.get('timestamp'):
+            return parse_timestamp(record['timestamp']).timestamp()
+        if timestamp < window.GlobalWindow().max_timestamp():
+            return timestamp.micros / 1e6
+        return time.time()
+
+    @staticmethod
+    def add_flag(state, event_time, weight):
+        """Decays the score to the newest event time seen and counts the flag in its bucket."""
+        if event_time >= state['scored_at']:
+            state['score'] = state['score'] * 0.5 ** ((event_time - state['scored_at']) / CIRCUIT_BREAKER_HALF_LIFE_SECS)
+            state['score'] += weight
+            state['scored_at'] = event_time
+        else:
+            # Late events are decayed to the newest event time instead.
+            state['score'] += weight * 0.5 ** ((state['scored_at'] - event_time) / CIRCUIT_BREAKER_HALF_LIFE_SECS)
+
+        bucket_secs = CIRCUIT_BREAKER_WINDOW_SECS / CIRCUIT_BREAKER_WINDOW_BUCKETS
+        newest_bucket = int(state['scored_at'] // bucket_secs)
+        bucket = int(event_time // bucket_secs)
+        if weight and bucket > newest_bucket - CIRCUIT_BREAKER_WINDOW_BUCKETS:
+            state['buckets'][bucket] = state['buckets'].get(bucket, 0) + 1
+        state['buckets'] = {
+            index: count for index, count in state['buckets'].items()
+            if index > newest_bucket - CIRCUIT_BREAKER_WINDOW_BUCKETS
+        }
+
+
+# --- User Risk Summary ---
+WINDOW_SIZE_UNITS = {'m': 60, 'h': 3600, 'd': 24 * 3600}
+
+
+def window_size_secs(size):
+    """Converts a window size such as '1h', '1d' or '7d' to seconds."""
+    if len(size) < 2 or size[-1] not in WINDOW_SIZE_UNITS or not size[:-1].isdigit():
+        raise ValueError(f"Invalid window size: {size}. Expected a number followed by one of "
+                         f"{', '.join(WINDOW_SIZE_UNITS)}.")
+    return int(size[:-1]) * WINDOW_SIZE_UNITS[size[-1]]
+
+
+def risk_event(record):
+    """Keeps only the fields the summary needs, keyed by user. The hour of day is in UTC."""
+    hour = None
+    if record.get('timestamp'):
+        hour = parse_timestamp(record['timestamp']).astimezone(datetime.timezone.utc).hour
+    return record['user_id'], (record.get('signal_type'), record.get('flag_type'), record.get('confidence'), hour)
+
+
+class UserRiskCombineFn(beam.CombineFn):
+    """
+    Incrementally aggregates a user's events: counts per signal and flag type,
+    mean and max confidence, and an hour-of-day histogram.
+    """
+
+    def create_accumulator(self):
+        return {
+            'event_count': 0,
+            'signal_type_counts': {},
+            'flag_type_counts': {},
+            'confidence_sum': 0.0,
+            'confidence_count': 0,
+            'max_confidence': None,
+            'hour_of_day_counts': [0] * 24,
+        }
+
+    def add_input(self, accumulator, event):
+        signal_type, flag_type, confidence, hour = event
+        accumulator['event_count'] += 1
+        if signal_type is not None:
+            accumulator['signal_type_counts'][signal_type] = accumulator['signal_type_counts'].get(signal_type, 0) + 1
+        if flag_type is not None:
+            accumulator['flag_type_counts'][flag_type] = accumulator['flag_type_counts'].get(flag_type, 0) + 1
+        if confidence is not None:
+            accumulator['confidence_sum'] += confidence
+            accumulator['confidence_count'] += 1
+            if accumulator['max_confidence'] is None or confidence > accumulator['max_confidence']:
+                accumulator['max_confidence'] = confidence
+        if hour is not None:
+            accumulator['hour_of_day_counts'][hour] += 1
+        return accumulator
+
+    def merge_accumulators(self, accumulators):
+        merged = self.create_accumulator()
+        for accumulator in accumulators:
+            merged['event_count'] += accumulator['event_count']
+            for field in ('signal_type_counts', 'flag_type_counts'):
+                for name, count in accumulator[field].items():
+                    merged[field][name] = merged[field].get(name, 0) + count
+            merged['confidence_sum'] += accumulator['confidence_sum']
+            merged['confidence_count'] += accumulator['confidence_count']
+            if accumulator['max_confidence'] is not None and (
+                merged['max_confidence'] is None or accumulator['max_confidence'] > merged['max_confidence']
+            ):
+                merged['max_confidence'] = accumulator['max_confidence']
+            merged['hour_of_day_counts'] = [
+                total + count for total, count in zip(merged['hour_of_day_counts'], accumulator['hour_of_day_counts'])
+            ]
+        return merged
+
+    def extract_output(self, accumulator):
+        return {
+            'event_count': accumulator['event_count'],
+            'signal_type_counts': [
+                {'name': name, 'count': count} for name, count in sorted(accumulator['signal_type_counts'].items())
+            ],
+            'flag_type_counts': [
+                {'name': name, 'count': count} for name, count in sorted(accumulator['flag_type_counts'].items())
+            ],
+            'mean_confidence': (
+                accumulator['confidence_sum'] / accumulator['confidence_count']
+                if accumulator['confidence_count'] else None
+            ),
+            'max_confidence': accumulator['max_confidence'],
+            'hour_of_day_counts': list(accumulator['hour_of_day_counts']),
+        }
+
+
+class FormatUserRiskSummary(beam.DoFn):
+    """Turns a per-user aggregate into a summary table row for its window."""
+
+    def __init__(self, window_size):
+        self.window_size = window_size
+
+    def process(self, element, window=beam.DoFn.WindowParam, pane_info=beam.DoFn.PaneInfoParam):
+        user_id, summary = element
+        yield {
+            'user_id': user_id,
+            'window_size': self.window_size,
+            'window_start': window.start.to_utc_datetime().isoformat(),
+            'window_end': window.end.to_utc_datetime().isoformat(),
+            **summary,
+            'is_final': pane_info.timing != PaneInfoTiming.EARLY,
+            'updated_at': datetime.datetime.utcnow().isoformat(),
+        }
+
+
+class SummarizeUserRisk(beam.PTransform):
+    """
+    Aggregates records per user over windows of `window_size`, emitting early
+    results until the window closes and updated results for late data.
+    """
+
+    def __init__(self, window_size):
+        super().__init__()
+        self.window_size = window_size
+
+    def expand(self, records):
+        size_secs = window_size_secs(self.window_size)
+        if size_secs > USER_RISK_SUMMARY_SLIDE_SECS:
+            window_fn = window.SlidingWindows(size_secs, USER_RISK_SUMMARY_SLIDE_SECS)
+        else:
+            window_fn = window.FixedWindows(size_secs)
+
+        early_trigger = None
+        if USER_RISK_SUMMARY_EARLY_FIRING_SECS > 0:
+            early_trigger = trigger.AfterProcessingTime(USER_RISK_SUMMARY_EARLY_FIRING_SECS)
+
+        return (
+            records
+            | "Drop Records without User" >> beam.Filter(lambda record: record.get('user_id') is not None)
+            | "Key by User" >> beam.Map(risk_event)
+            | "Window" >> beam.WindowInto(
+                window_fn,
+                trigger=trigger.AfterWatermark(early=early_trigger, late=trigger.AfterCount(1)),
+                accumulation_mode=trigger.AccumulationMode.ACCUMULATING,
+                allowed_lateness=USER_RISK_SUMMARY_ALLOWED_LATENESS_SECS,
+            )
+            | "Aggregate per User" >> beam.CombinePerKey(UserRiskCombineFn())
+            | "Format Summary Rows" >> beam.ParDo(FormatUserRiskSummary(self.window_size))
+        )
 
 
 def run():
@@ -224,38 +1359,125 @@ def run():
         'region': 'us-central1',
         'temp_location': f'gs://{TEMP_CLOUD_STORAGE}/temp',
         'staging_location': f'gs://{TEMP_CLOUD_STORAGE}/staging',
+        # Installs msgspec on the workers. Apache Beam is already on the
+        # Dataflow worker image, so it is left out of this file.
+        'requirements_file': os.path.join(os.path.dirname(os.path.abspath(__file__)), 'worker-requirements.txt'),
         'streaming': True
     }
     
     options = PipelineOptions.from_dictionary(pipeline_options)
     
     with beam.Pipeline(options=options) as p:
-        messages = p | "Read from PubSub" >> beam.io.ReadFromPubSub(topic=pubsub_topic_path)
+        # Prefer a subscription, so messages published while the job is down are not lost.
+        if PUBSUB_SUBSCRIPTION:
+            source = {'subscription': pubsub_subscription_path}
+        else:
+            source = {'topic': pubsub_topic_path}
+        messages = p | "Read from PubSub" >> beam.io.ReadFromPubSub(
+            id_label=EVENT_ID_ATTRIBUTE, timestamp_attribute=EVENT_TIMESTAMP_ATTRIBUTE,
+            with_attributes=True, **source
+        )
         
-        parsed_results = (
-            messages
-            | "Parse and Conform" >> beam.ParDo(ParseAndConform()).with_outputs(
-                'failed_records', main='parsed_records'
+        # Immediate flags take a fast lane so they never wait behind DLP batching.
+        # Messages are routed on their attributes, before their payloads are parsed.
+        immediate_messages, bulk_messages = (
+            messages | "Route by Signal Type" >> beam.Partition(route_by_signal_type, 2)
+        )
+        # Immediate flags carry their publish time through the fast lane, to measure alert latency.
+        immediate_flags, immediate_failed_records = (
+            immediate_messages | "Parse Immediate Flags" >> ParseAndDeduplicate(with_publish_time=True)
+        )
+        immediate_records = immediate_flags | "Drop Publish Times" >> beam.Values()
+        bulk_records, bulk_failed_records = bulk_messages | "Parse Records" >> ParseAndDeduplicate()
+
+        good_records = (immediate_records, bulk_records) | "Merge Parsed Records" >> beam.Flatten()
+        failed_records = (
+            (immediate_failed_records, bulk_failed_records) | "Merge Parse Failures" >> beam.Flatten()
+        )
+
+        # Redact PII from the bulk of the records, many records per DLP request.
+        redaction_results = (
+            bulk_records
+            | "Key for DLP Batching" >> beam.WithKeys(lambda _: random.randrange(DLP_BATCH_SHARDS))
+            | "Batch for DLP" >> beam.GroupIntoBatches(
+                DLP_BATCH_SIZE, max_buffering_duration_secs=DLP_BATCH_MAX_BUFFERING_SECS
             )
+            | "Redact PII with DLP" >> beam.ParDo(
+                RedactWithDLP(
+                    PROJECT_ID, DLP_INFOTYPES, DLP_DEID_TEMPLATE_NAME,
+                    DLP_QUOTA_REQUESTS_PER_MINUTE - DLP_FAST_LANE_QUOTA_REQUESTS_PER_MINUTE,
+                )
+            ).with_outputs('dlp_failures', main='redacted_records')
         )
 
-        good_records = parsed_results.parsed_records
-        failed_records = parsed_results.failed_records
+        # Redact immediate flags one record per request, with their own share of the quota.
+        immediate_redaction_results = (
+            immediate_flags
+            | "Wrap Immediate Flags" >> beam.MapTuple(lambda publish_time, record: (publish_time, [record]))
+            | "Redact Immediate Flags with DLP" >> beam.ParDo(
+                RedactWithDLP(
+                    PROJECT_ID, DLP_INFOTYPES, DLP_DEID_TEMPLATE_NAME, DLP_FAST_LANE_QUOTA_REQUESTS_PER_MINUTE,
+                    keep_key=True,
+                )
+            ).with_outputs('dlp_failures', main='redacted_records')
+        )
+        redacted_immediate_flags = immediate_redaction_results.redacted_records
 
-        # Redact PII from the successfully parsed records.
         redacted_records = (
-            good_records
-            | "Redact PII with DLP" >> beam.ParDo(RedactWithDLP(PROJECT_ID, DLP_INFOTYPES, DLP_DEID_TEMPLATE_NAME))
+            (
+                redaction_results.redacted_records,
+                redacted_immediate_flags | "Drop Redacted Publish Times" >> beam.Values(),
+            )
+            | "Merge Redacted Records" >> beam.Flatten()
+        )
+        dlp_failed_records = (
+            (redaction_results.dlp_failures, immediate_redaction_results.dlp_failures)
+            | "Merge DLP Failures" >> beam.Flatten()
+        )
+
+        # Publish redacted immediate flags as alerts, tracking their latency from publish to alert.
+        alerts = redacted_immediate_flags | "Emit Alerts" >> beam.ParDo(EmitAlert())
+        if ALERTS_PUB_SUB_TOPIC_ID:
+            alerts | "Publish Alerts to PubSub" >> beam.io.WriteToPubSub(alerts_pubsub_topic_path)
+
+        # Track each user's flags and trip their circuit breaker in the stream,
+        # marking the records it processes.
+        breaker_results = (
+            redacted_records
+            | "Key by User for Circuit Breaker" >> beam.Map(lambda record: (record['user_id'], record))
+            | "Detect Circuit Breaker Trips" >> beam.ParDo(CircuitBreakerFn()).with_outputs(
+                'breaker_events', main='checked_records'
+            )
+        )
+        checked_records = breaker_results.checked_records
+        breaker_events = breaker_results.breaker_events
+
+        (
+            breaker_events
+            | "Write Circuit Breaker Events to BigQuery" >> beam.io.WriteToBigQuery(
+                bigquery_circuit_breaker_table_spec,
+                schema=CIRCUIT_BREAKER_EVENT_SCHEMA,
+                write_disposition=beam.io.BigQueryDisposition.WRITE_APPEND,
+                create_disposition=beam.io.BigQueryDisposition.CREATE_IF_NEEDED,
+                **BIGQUERY_WRITE_SETTINGS
+            )
         )
+        if ALERTS_PUB_SUB_TOPIC_ID:
+            (
+                breaker_events
+                | "Encode Circuit Breaker Events" >> beam.Map(lambda event: json.dumps(event).encode('utf-8'))
+                | "Publish Circuit Breaker Events to PubSub" >> beam.io.WriteToPubSub(alerts_pubsub_topic_path)
+            )
 
         # Write the clean, redacted records to the main BigQuery table.
         (
-            redacted_records
+            checked_records
             | "Write Good Records to BigQuery" >> beam.io.WriteToBigQuery(
                 bigquery_table_spec,
                 schema=BIGQUERY_SCHEMA,
                 write_disposition=beam.io.BigQueryDisposition.WRITE_APPEND,
-                create_disposition=beam.io.BigQueryDisposition.CREATE_IF_NEEDED
+                create_disposition=beam.io.BigQueryDisposition.CREATE_IF_NEEDED,
+                **BIGQUERY_WRITE_SETTINGS
             )
         )
         
@@ -266,7 +1488,40 @@ def run():
                 bigquery_dead_letter_table_spec,
                 schema=DEAD_LETTER_SCHEMA,
                 write_disposition=beam.io.BigQueryDisposition.WRITE_APPEND,
-                create_disposition=beam.io.BigQueryDisposition.CREATE_IF_NEEDED
+                create_disposition=beam.io.BigQueryDisposition.CREATE_IF_NEEDED,
+                **BIGQUERY_DEAD_LETTER_WRITE_SETTINGS
+            )
+        )
+
+        # Write records that could not be redacted to their own dead-letter table,
+        # so unredacted text never reaches the main table.
+        (
+            dlp_failed_records
+            | "Write DLP Failures to BigQuery" >> beam.io.WriteToBigQuery(
+                bigquery_dlp_dead_letter_table_spec,
+                schema=DEAD_LETTER_SCHEMA,
+                write_disposition=beam.io.BigQueryDisposition.WRITE_APPEND,
+                create_disposition=beam.io.BigQueryDisposition.CREATE_IF_NEEDED,
+                **BIGQUERY_DEAD_LETTER_WRITE_SETTINGS
+            )
+        )
+
+        # Aggregate each user's events per window into a compact summary table,
+        # so reports can read a few rows instead of scanning every event.
+        user_risk_summaries = [
+            good_records
+            | f"Summarize User Risk {window_size}" >> SummarizeUserRisk(window_size)
+            for window_size in USER_RISK_SUMMARY_WINDOWS
+        ]
+        (
+            user_risk_summaries
+            | "Flatten User Risk Summaries" >> beam.Flatten()
+            | "Write User Risk Summaries to BigQuery" >> beam.io.WriteToBigQuery(
+                bigquery_summary_table_spec,
+                schema=USER_RISK_SUMMARY_SCHEMA,
+                write_disposition=beam.io.BigQueryDisposition.WRITE_APPEND,
+                create_disposition=beam.io.BigQueryDisposition.CREATE_IF_NEEDED,
+                **BIGQUERY_SUMMARY_WRITE_SETTINGS
             )
         )
 
@@ -0,0 +1,19 @@
+"""
+main.py reads its configuration from the environment when imported, so
+placeholder values are set here before the tests import it.
+"""
+import os
+import sys
+
+for name, value in {
+    "GCP_PROJECT_ID": "test-project",
+    "PUB_SUB_TOPIC_ID": "test-topic",
+    "BIGQUERY_DATASET_ID": "test_dataset",
+    "BIGQUERY_TABLE_ID": "test_table",
+    "BIGQUERY_DEAD_LETTER_TABLE": "test_dead_letter",
+    "TEMP_CLOUD_STORAGE": "gs://test-bucket/temp",
+    "ALERTS_PUB_SUB_TOPIC_ID": "test-alerts",
+}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
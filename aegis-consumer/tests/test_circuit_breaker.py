@@ -0,0 +1,115 @@
+import datetime
+
+import apache_beam as beam
+from apache_beam.options.pipeline_options import PipelineOptions, StandardOptions
+from apache_beam.testing import test_stream
+
+import main
+
+START = datetime.datetime(2025, 8, 20, tzinfo=datetime.timezone.utc)
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def at(offset_secs):
+    return (START + datetime.timedelta(seconds=offset_secs)).isoformat()
+
+
+def flag(signal_type, offset_secs):
+    return {"user_id": "u1", "timestamp": at(offset_secs), "signal_type": signal_type, "flag_type": "NSFW"}
+
+
+# Outputs of the pipeline under test. The DirectRunner pickles transforms, so
+# they append here through module-level functions rather than closures.
+OUTPUTS = {"checked": [], "trips": []}
+
+
+def collect_checked(record):
+    OUTPUTS["checked"].append((record["timestamp"], record["is_circuit_breaker_processed"]))
+
+
+def collect_trip(event):
+    OUTPUTS["trips"].append(event["tripped_at"])
+
+
+def event_stream(records):
+    """Adds the records one at a time, advancing the watermark to each, so the breaker sees them in order."""
+    stream = test_stream.TestStream()
+    for record in records:
+        event_time = datetime.datetime.fromisoformat(record["timestamp"]).timestamp()
+        stream = stream.add_elements([beam.window.TimestampedValue(record, event_time)])
+        stream = stream.advance_watermark_to(event_time)
+    return stream.advance_watermark_to_infinity()
+
+
+def assert_breaker(records, expected_checked, expected_trips, batched=False):
+    """
+    Runs `records` through the circuit breaker on the DirectRunner and checks
+    each record's is_circuit_breaker_processed flag and the trip times. With
+    `batched`, records first go through GroupIntoBatches, as they do on their
+    way to DLP, so a whole batch is flushed with one element timestamp.
+
+    Outputs are collected in memory rather than with assert_that, because a
+    batch flushed at the end of the global window arrives after assert_that
+    has already grouped its input.
+    """
+    OUTPUTS["checked"].clear()
+    OUTPUTS["trips"].clear()
+    options = PipelineOptions()
+    options.view_as(StandardOptions).streaming = True
+    with beam.Pipeline(options=options) as pipeline:
+        records = pipeline | event_stream(records)
+        if batched:
+            records = (
+                records
+                | beam.WithKeys(lambda _: 0)
+                | beam.GroupIntoBatches(100)
+                | beam.FlatMap(lambda batch: batch[1])
+            )
+        results = (
+            records
+            | beam.Map(lambda record: (record["user_id"], record))
+            | beam.ParDo(main.CircuitBreakerFn()).with_outputs("breaker_events", main="checked_records")
+        )
+        results.checked_records | "Collect Records" >> beam.Map(collect_checked)
+        results.breaker_events | "Collect Trips" >> beam.Map(collect_trip)
+    assert sorted(OUTPUTS["checked"]) == sorted(expected_checked)
+    assert sorted(OUTPUTS["trips"]) == sorted(expected_trips)
+
+
+def test_breaker_trips_decays_and_rearms():
+    records = [
+        flag("IMMEDIATE_FLAG", 0),
+        flag("IMMEDIATE_FLAG", 1 * HOUR),
+        flag("IMMEDIATE_FLAG", 2 * HOUR),       # The score crosses 2.5 here.
+        flag("INTERMEDIATE_FLAG", 3 * HOUR),    # Still tripped.
+        flag("INTERMEDIATE_FLAG", 3 * DAY),     # The score has decayed, so the breaker re-arms.
+        flag("IMMEDIATE_FLAG", 3 * DAY + 1),
+        flag("IMMEDIATE_FLAG", 3 * DAY + 2),
+        flag("IMMEDIATE_FLAG", 3 * DAY + 3),    # Trips again.
+    ]
+    expected_checked = [
+        (at(0), False),
+        (at(1 * HOUR), False),
+        (at(2 * HOUR), True),
+        (at(3 * HOUR), True),
+        (at(3 * DAY), False),
+        (at(3 * DAY + 1), False),
+        (at(3 * DAY + 2), False),
+        (at(3 * DAY + 3), True),
+    ]
+    assert_breaker(records, expected_checked, [at(2 * HOUR), at(3 * DAY + 3)])
+
+
+def test_batched_records_keep_their_own_event_times():
+    # Six intermediate flags a day apart never share a rolling window, so the
+    # breaker must not trip, although the batch flush gives them one timestamp.
+    records = [flag("INTERMEDIATE_FLAG", day * DAY) for day in range(6)]
+    expected_checked = [(at(day * DAY), False) for day in range(6)]
+    assert_breaker(records, expected_checked, [], batched=True)
+
+
+def test_batched_records_trip_at_their_own_event_time():
+    records = [flag("IMMEDIATE_FLAG", hour * HOUR) for hour in range(3)]
+    expected_checked = [(at(0), False), (at(HOUR), False), (at(2 * HOUR), True)]
+    assert_breaker(records, expected_checked, [at(2 * HOUR)], batched=True)
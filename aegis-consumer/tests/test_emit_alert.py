@@ -0,0 +1,31 @@
+import json
+import time
+
+import main
+
+
+class Recorder:
+    def __init__(self):
+        self.values = []
+
+    def update(self, value):
+        self.values.append(value)
+
+
+def test_latency_is_measured_from_publish_time_not_event_time():
+    fn = main.EmitAlert()
+    fn.alert_latency_ms = Recorder()
+    # A backfilled event from a year ago, published two seconds ago.
+    record = {"user_id": "u1", "timestamp": "2024-08-20T10:00:00Z", "signal_type": "IMMEDIATE_FLAG"}
+    [alert] = fn.process((time.time() - 2, record))
+    assert json.loads(alert) == record
+    [latency_ms] = fn.alert_latency_ms.values
+    assert 2000 <= latency_ms < 10000
+
+
+def test_alerts_without_a_publish_time_are_not_measured():
+    fn = main.EmitAlert()
+    fn.alert_latency_ms = Recorder()
+    [alert] = fn.process((None, {"user_id": "u1"}))
+    assert json.loads(alert) == {"user_id": "u1"}
+    assert fn.alert_latency_ms.values == []
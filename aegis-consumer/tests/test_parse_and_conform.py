@@ -0,0 +1,100 @@
+import datetime
+import json
+
+import apache_beam as beam
+import pytest
+
+import main
+
+
+@pytest.fixture
+def parse():
+    fn = main.ParseAndConform()
+    fn.setup()
+    return fn
+
+
+def dead_letter(fn, payload):
+    [output] = fn.process(payload)
+    assert isinstance(output, beam.pvalue.TaggedOutput) and output.tag == 'failed_records'
+    return output.value
+
+
+def extension_record(**fields):
+    """A record shaped like the ones the Chrome extension sends."""
+    record = {
+        "user_id": "hashed_user_id_00001",
+        "timestamp": "2025-08-20T10:00:00.000Z",
+        "signal_type": "NEUTRAL_FLAG",
+        "flag_type": "NEUTRAL_FLAG",
+        "confidence": 0.95,
+        "topic_category": "Educational Content",
+        "source_platform": "Chrome Extension",
+        "event_details": {"context": "Reading about volcanoes", "corroborating_signals": ["Encyclopedia page"]},
+    }
+    record.update(fields)
+    return json.dumps(record).encode('utf-8')
+
+
+@pytest.mark.parametrize("flag_type", ["NEUTRAL_FLAG", "NEUTRAL"])
+def test_neutral_events_from_the_extension_and_generator_are_valid(parse, flag_type):
+    [record] = parse.process(extension_record(flag_type=flag_type))
+
+    assert record['flag_type'] == flag_type
+
+
+@pytest.mark.parametrize("timestamp, expected", [
+    ("2025-08-20T10:00:00.000Z", datetime.datetime(2025, 8, 20, 10, tzinfo=datetime.timezone.utc)),
+    ("2025-08-20 10:00:00 UTC", datetime.datetime(2025, 8, 20, 10, tzinfo=datetime.timezone.utc)),
+    ("2025-08-20 10:00:00", datetime.datetime(2025, 8, 20, 10, tzinfo=datetime.timezone.utc)),
+    ("2025-8-2 3:04:05.123456", datetime.datetime(2025, 8, 2, 3, 4, 5, 123456, tzinfo=datetime.timezone.utc)),
+    ("2025-08-20", datetime.datetime(2025, 8, 20, tzinfo=datetime.timezone.utc)),
+    ("2025-08-20T18:00:00+08:00", datetime.datetime(2025, 8, 20, 10, tzinfo=datetime.timezone.utc)),
+    ("2025-08-20 05:30:00-0430", datetime.datetime(2025, 8, 20, 10, tzinfo=datetime.timezone.utc)),
+    ("2025-08-20 12:00:00 Europe/Berlin", datetime.datetime(2025, 8, 20, 10, tzinfo=datetime.timezone.utc)),
+])
+def test_timestamps_in_bigquery_formats_are_valid(parse, timestamp, expected):
+    [record] = parse.process(extension_record(timestamp=timestamp))
+
+    assert record['timestamp'] == timestamp
+    assert main.parse_timestamp(timestamp) == expected
+
+
+@pytest.mark.parametrize("timestamp", ["yesterday", "2025-13-01", "2025-08-20T10:00", "2025-08-20 10:00:00 Mars/Base"])
+def test_timestamps_bigquery_rejects_are_dead_lettered(parse, timestamp):
+    error = dead_letter(parse, extension_record(timestamp=timestamp))
+
+    assert error['reason_code'] == main.REASON_INVALID_TIMESTAMP
+    assert error['failed_field'] == 'timestamp'
+
+
+@pytest.mark.parametrize("payload", [b'{bad', b'[1, 2]', b'"text"', b'3', b'null'])
+def test_payloads_that_are_not_json_objects_are_malformed(parse, payload):
+    error = dead_letter(parse, payload)
+
+    assert error['reason_code'] == main.REASON_MALFORMED_JSON
+    assert error['failed_field'] is None
+
+
+@pytest.mark.parametrize("payload, field", [
+    (b'{"user_id": 5}', 'user_id'),
+    (b'{"confidence": "high"}', 'confidence'),
+    (b'{"event_details": []}', 'event_details'),
+])
+def test_fields_of_the_wrong_type_are_invalid_types(parse, payload, field):
+    error = dead_letter(parse, payload)
+
+    assert error['reason_code'] == main.REASON_INVALID_TYPE
+    assert error['failed_field'] == field
+
+
+def test_records_can_carry_their_publish_time():
+    fn = main.ParseAndConform(with_publish_time=True)
+    fn.setup()
+    published = datetime.datetime(2025, 8, 20, 10, 0, 5, tzinfo=datetime.timezone.utc)
+    message = beam.io.PubsubMessage(extension_record(), {}, publish_time=published)
+    [(publish_time, record)] = fn.process(message)
+    assert publish_time == published.timestamp()
+    assert record['user_id'] == "hashed_user_id_00001"
+    [(publish_time, _)] = fn.process(extension_record())
+    assert publish_time is None
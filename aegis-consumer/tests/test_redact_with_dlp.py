@@ -0,0 +1,140 @@
+import json
+from unittest import mock
+
+import apache_beam as beam
+import pytest
+from google.api_core import exceptions as google_exceptions
+from google.cloud import dlp_v2
+
+import main
+
+
+class FakeDlpClient:
+    """
+    Replaces each name in NAMES with [PERSON_NAME], cell by cell, and records
+    every request. Requests carrying a text in `failing_texts` are rejected.
+    """
+    NAMES = ("bob", "sarah")
+
+    def __init__(self):
+        self.requests = []
+        self.failing_texts = set()
+
+    def deidentify_content(self, request, retry=None):
+        rows = [[value["string_value"] for value in row["values"]] for row in request["item"]["table"]["rows"]]
+        self.requests.append(rows)
+        if self.failing_texts.intersection(text for row in rows for text in row):
+            raise google_exceptions.InvalidArgument("Rejected by the fake DLP client.")
+        return dlp_v2.DeidentifyContentResponse(item={"table": {
+            "headers": request["item"]["table"]["headers"],
+            "rows": [{"values": [{"string_value": self.redact(text)} for text in row]} for row in rows],
+        }})
+
+    def redact(self, text):
+        for name in self.NAMES:
+            text = text.replace(name, "[PERSON_NAME]")
+        return text
+
+
+@pytest.fixture
+def dlp_client():
+    return FakeDlpClient()
+
+
+@pytest.fixture
+def redact(dlp_client):
+    """A set-up RedactWithDLP using the fake client, with a quota high enough that it never waits."""
+    fn = main.RedactWithDLP("test-project", main.DLP_INFOTYPES, quota_requests_per_minute=600000)
+    with mock.patch.object(main.dlp_v2, "DlpServiceClient", return_value=dlp_client):
+        fn.setup()
+    return fn
+
+
+def make_record(user, context, signals):
+    return {"user_id": user, "event_details": {"context": context, "corroborating_signals": list(signals)}}
+
+
+def run(fn, records):
+    """Returns the records yielded to the main output and to 'dlp_failures'."""
+    redacted, failures = [], []
+    for output in fn.process(("shard", records)):
+        if isinstance(output, beam.pvalue.TaggedOutput):
+            assert output.tag == "dlp_failures"
+            failures.append(output.value)
+        else:
+            redacted.append(output)
+    return redacted, failures
+
+
+def test_texts_with_embedded_newlines_keep_their_cells(redact, dlp_client):
+    records = [
+        make_record("u1", "met bob at the park\nthen went home\n\nbob said hi", ["line one\nline two", "sarah\n"]),
+        make_record("u2", "a\nb\nc", ["bob"]),
+    ]
+
+    redacted, failures = run(redact, records)
+
+    assert not failures
+    assert len(dlp_client.requests) == 1
+    assert redacted[0]["event_details"] == {
+        "context": "met [PERSON_NAME] at the park\nthen went home\n\n[PERSON_NAME] said hi",
+        "corroborating_signals": ["line one\nline two", "[PERSON_NAME]\n"],
+    }
+    assert redacted[1]["event_details"] == {"context": "a\nb\nc", "corroborating_signals": ["[PERSON_NAME]"]}
+
+
+def test_record_with_many_signals_is_split_from_the_rest_of_the_batch(redact, dlp_client, monkeypatch):
+    monkeypatch.setattr(main, "DLP_MAX_TABLE_CELLS", 300)
+    signals = [f"signal {i} mentions bob" for i in range(250)]
+    records = [make_record(f"u{i}", f"context {i} from sarah", [f"short signal {i}"]) for i in range(5)]
+    records.insert(2, make_record("wide", "wide context from bob", signals))
+
+    redacted, failures = run(redact, records)
+
+    assert not failures
+    assert [record["user_id"] for record in redacted] == [record["user_id"] for record in records]
+    assert redacted[2]["event_details"] == {
+        "context": "wide context from [PERSON_NAME]",
+        "corroborating_signals": [f"signal {i} mentions [PERSON_NAME]" for i in range(250)],
+    }
+    for i, record in enumerate(redacted[:2] + redacted[3:]):
+        assert record["event_details"]["context"] == f"context {i} from [PERSON_NAME]"
+    # The wide record gets a request of its own, so the narrow rows are not padded to 251 cells.
+    assert sorted((len(rows), max(len(row) for row in rows)) for rows in dlp_client.requests) == [(1, 251), (5, 2)]
+
+
+def test_failed_request_only_affects_its_own_records(redact, dlp_client, monkeypatch):
+    monkeypatch.setattr(main, "DLP_MAX_TABLE_CELLS", 2)
+    dlp_client.failing_texts.add("sarah is failing")
+    records = [
+        make_record("u1", "bob is fine", ["first"]),
+        make_record("u2", "sarah is failing", ["second"]),
+        make_record("u3", "bob is fine too", ["third"]),
+    ]
+
+    redacted, failures = run(redact, records)
+
+    assert len(dlp_client.requests) == 3
+    assert [record["user_id"] for record in redacted] == ["u1", "u3"]
+    assert redacted[0]["event_details"]["context"] == "[PERSON_NAME] is fine"
+    assert redacted[1]["event_details"]["context"] == "[PERSON_NAME] is fine too"
+    [failure] = failures
+    assert failure["reason_code"] == main.REASON_DLP_REDACTION_FAILED
+    assert "Rejected by the fake DLP client" in failure["error_message"]
+    assert json.loads(failure["raw_payload"])["user_id"] == "u2"
+
+
+def test_plan_dlp_requests_groups_rows_by_width_within_the_limits():
+    rows = [["a"] * 3, ["b"] * 250, ["c"] * 3, [], ["d"] * 3]
+
+    requests = main.plan_dlp_requests(rows, max_cells=300, max_bytes=450 * 1024)
+
+    assert requests == [[0, 2, 4], [1]]
+
+
+def test_keep_key_yields_redacted_records_with_their_batch_key(redact):
+    redact.keep_key = True
+    redacted, failures = run(redact, [make_record("u1", "bob called", [])])
+
+    assert not failures
+    assert redacted == [("shard", make_record("u1", "[PERSON_NAME] called", []))]
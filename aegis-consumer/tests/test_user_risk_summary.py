@@ -0,0 +1,17 @@
+import pytest
+
+import main
+
+
+@pytest.mark.parametrize("timestamp, hour", [
+    ("2025-08-20T23:30:00Z", 23),
+    ("2025-08-20T23:30:00+00:00", 23),
+    ("2025-08-21T07:30:00+08:00", 23),
+    ("2025-08-20T18:30:00-05:00", 23),
+    ("2025-08-20T23:30:00", 23),
+])
+def test_risk_event_hour_is_in_utc(timestamp, hour):
+    record = {"user_id": "u1", "timestamp": timestamp, "signal_type": "IMMEDIATE_FLAG",
+              "flag_type": "NSFW", "confidence": 0.9}
+
+    assert main.risk_event(record) == ("u1", ("IMMEDIATE_FLAG", "NSFW", 0.9, hour))
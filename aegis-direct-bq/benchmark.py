@@ -0,0 +1,260 @@
+"""
+Benchmark harness for the Aegis BigQuery Ingestion Service.
+
+The BigQuery client is replaced with an in-process stub that simulates RPC
+latency, so the harness runs without any cloud resources. Requests are sent
+through the ASGI app directly with httpx.
+
+Usage:
+    python benchmark.py load --latency-ms 50 --requests 200
+    python benchmark.py buffer --latency-ms 50 --requests 2000
+    python benchmark.py encoding --rows 10000
+    python benchmark.py ndjson --rows 100000
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from google.cloud import bigquery
+
+os.environ.setdefault("GCP_PROJECT_ID", "benchmark-project")
+os.environ.setdefault("BIGQUERY_DATASET_ID", "benchmark_dataset")
+os.environ.setdefault("BIGQUERY_TABLE_ID", "benchmark_table")
+
+SIMULATED_LATENCY_SECONDS = 0.05
+
+
+# --- Stubbed BigQuery Client ---
+class FakeBigQueryClient:
+    """Blocks for the simulated RPC latency and accepts every row."""
+
+    def __init__(self, *args, **kwargs):
+        self.inserted_rows = 0
+        self.insert_calls = 0
+
+    def insert_rows_json(self, table, json_rows, **kwargs):
+        time.sleep(SIMULATED_LATENCY_SECONDS)
+        self.insert_calls += 1
+        self.inserted_rows += len(json_rows)
+        return []
+
+
+def load_app():
+    """Imports the service with the stubbed client in place."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with mock.patch.object(bigquery, "Client", FakeBigQueryClient):
+        import main
+    return main
+
+
+def make_rows(count):
+    return [
+        {
+            "user_id": f"user{i % 3}",
+            "timestamp": "2025-08-22T12:00:00+00:00",
+            "signal_type": "NEUTRAL_FLAG",
+            "flag_type": "NEUTRAL",
+            "confidence": 0.9,
+            "topic_category": "Educational Content",
+            "source_platform": "Chrome Extension",
+            "event_details": {
+                "context": "Watching educational videos on history",
+                "corroborating_signals": ["neutral user activity"],
+            },
+        }
+        for i in range(count)
+    ]
+
+
+# --- Scenarios ---
+async def run_load(app, total_requests, concurrency, rows_per_request):
+    """Sends `total_requests` uploads with at most `concurrency` in flight."""
+    import httpx
+
+    rows = make_rows(rows_per_request)
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as http:
+        async def send():
+            async with semaphore:
+                response = await http.post("/upload_data", json=rows)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send() for _ in range(total_requests)))
+        return time.perf_counter() - start
+
+
+def load_scenario(args):
+    main = load_app()
+    print(f"Simulated RPC latency: {args.latency_ms} ms, {args.rows} rows per request")
+    print(f"{'concurrency':>12} {'requests/sec':>14}")
+    for concurrency in args.concurrency:
+        elapsed = asyncio.run(run_load(main.app, args.requests, concurrency, args.rows))
+        print(f"{concurrency:>12} {args.requests / elapsed:>14.1f}")
+
+
+async def run_buffer(insert_buffer, total_requests, concurrency, rows_per_request):
+    """Submits requests straight to the buffer and records each one's latency."""
+    rows = make_rows(rows_per_request)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def send():
+        async with semaphore:
+            start = time.perf_counter()
+            errors = await insert_buffer.submit(rows)
+            latencies.append(time.perf_counter() - start)
+            assert not errors, errors
+
+    start = time.perf_counter()
+    await asyncio.gather(*(send() for _ in range(total_requests)))
+    await insert_buffer.close()
+    return time.perf_counter() - start, latencies
+
+
+def buffer_scenario(args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from write_buffer import InsertBuffer
+
+    configurations = [
+        ("unbuffered", dict(max_rows=1, max_latency_ms=0)),
+        ("buffered", dict(max_rows=args.max_rows, max_latency_ms=args.max_latency_ms)),
+    ]
+    print(f"Simulated RPC latency: {args.latency_ms} ms, {args.rows} rows per request, "
+          f"{args.concurrency} concurrent requests")
+    print(f"{'mode':>12} {'rows/sec':>10} {'inserts':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for label, settings in configurations:
+        client = FakeBigQueryClient()
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            insert_buffer = InsertBuffer(lambda rows: client.insert_rows_json("table", rows), executor, **settings)
+            elapsed, latencies = asyncio.run(run_buffer(insert_buffer, args.requests, args.concurrency, args.rows))
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(f"{label:>12} {client.inserted_rows / elapsed:>10.0f} {client.insert_calls:>8} "
+              f"{quantiles[49] * 1000:>8.1f} {quantiles[98] * 1000:>8.1f}")
+
+
+def encoding_scenario(args):
+    """Bytes on the wire and encode cost for the JSON and Storage Write API backends."""
+    main = load_app()
+    from writers import StorageWriteApiWriter
+
+    rows = [main.SignalData(**row).model_dump() for row in make_rows(args.rows)]
+    storage_writer = StorageWriteApiWriter(
+        "benchmark-project", "benchmark_dataset", "benchmark_table", main.SignalData, write_client=object()
+    )
+
+    start = time.perf_counter()
+    json_bytes = sum(len(json.dumps(row).encode("utf-8")) for row in rows)
+    json_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    proto_bytes = sum(len(storage_writer._encode(row).SerializeToString()) for row in rows)
+    proto_elapsed = time.perf_counter() - start
+
+    print(f"{args.rows} rows")
+    print(f"{'backend':>14} {'bytes/row':>10} {'rows/sec encoded':>18}")
+    print(f"{'insert_all':>14} {json_bytes / args.rows:>10.1f} {args.rows / json_elapsed:>18.0f}")
+    print(f"{'storage_write':>14} {proto_bytes / args.rows:>10.1f} {args.rows / proto_elapsed:>18.0f}")
+
+
+async def run_upload(app, path, body, headers, piece_bytes=64 * 1024):
+    """Streams `body` to `path` in pieces, as a client on a slow link would."""
+    import httpx
+
+    async def pieces():
+        for start in range(0, len(body), piece_bytes):
+            yield body[start:start + piece_bytes]
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as http:
+        start = time.perf_counter()
+        response = await http.post(path, content=pieces(), headers=headers)
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+
+def ndjson_scenario(args):
+    """Throughput and peak memory of one large upload as a JSON array and as NDJSON."""
+    import zstandard
+
+    main = load_app()
+    rows = make_rows(args.rows)
+    # Vary every row, so the bodies compress like real uploads rather than
+    # like one row repeated.
+    for i, row in enumerate(rows):
+        row["user_id"] = f"user{i % 1000}"
+        row["timestamp"] = f"2025-08-22T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}+00:00"
+        row["confidence"] = round(random.random(), 3)
+        row["event_details"]["context"] += f" (video {random.randrange(10 ** 9)})"
+    ndjson = b"".join(json.dumps(row).encode("utf-8") + b"\n" for row in rows)
+    uploads = [
+        ("json array", "/upload_data", json.dumps(rows).encode("utf-8"), {"Content-Type": "application/json"}),
+        ("ndjson", "/upload_ndjson", ndjson, {}),
+        ("ndjson+gzip", "/upload_ndjson", gzip.compress(ndjson), {"Content-Encoding": "gzip"}),
+        ("ndjson+zstd", "/upload_ndjson", zstandard.ZstdCompressor().compress(ndjson), {"Content-Encoding": "zstd"}),
+    ]
+    del rows, ndjson
+
+    print(f"Simulated RPC latency: {args.latency_ms} ms, {args.rows} rows per upload")
+    print(f"{'upload':>12} {'body MB':>8} {'rows/sec':>10} {'peak MB':>8}")
+    for label, path, body, headers in uploads:
+        elapsed = asyncio.run(run_upload(main.app, path, body, headers))
+        # Peak memory is measured on a second run, since tracing slows allocation down.
+        tracemalloc.start()
+        asyncio.run(run_upload(main.app, path, body, headers))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{label:>12} {len(body) / 1e6:>8.1f} {args.rows / elapsed:>10.0f} {peak / 1e6:>8.1f}")
+
+
+def main():
+    global SIMULATED_LATENCY_SECONDS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="scenario", required=True)
+
+    load = subparsers.add_parser("load", help="Requests/sec against /upload_data at increasing concurrency.")
+    load.add_argument("--latency-ms", type=float, default=50.0)
+    load.add_argument("--requests", type=int, default=200)
+    load.add_argument("--rows", type=int, default=10)
+    load.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    load.set_defaults(handler=load_scenario)
+
+    buffer = subparsers.add_parser("buffer", help="Throughput and p99 with and without the insert buffer.")
+    buffer.add_argument("--latency-ms", type=float, default=50.0)
+    buffer.add_argument("--requests", type=int, default=2000)
+    buffer.add_argument("--rows", type=int, default=5)
+    buffer.add_argument("--concurrency", type=int, default=200)
+    buffer.add_argument("--workers", type=int, default=16)
+    buffer.add_argument("--max-rows", type=int, default=500)
+    buffer.add_argument("--max-latency-ms", type=float, default=200.0)
+    buffer.set_defaults(handler=buffer_scenario)
+
+    encoding = subparsers.add_parser("encoding", help="Wire bytes per row for the JSON and protobuf writers.")
+    encoding.add_argument("--latency-ms", type=float, default=0.0)
+    encoding.add_argument("--rows", type=int, default=10000)
+    encoding.set_defaults(handler=encoding_scenario)
+
+    ndjson = subparsers.add_parser("ndjson", help="Throughput and peak memory of a large JSON array and NDJSON upload.")
+    ndjson.add_argument("--latency-ms", type=float, default=10.0)
+    ndjson.add_argument("--rows", type=int, default=100000)
+    ndjson.set_defaults(handler=ndjson_scenario)
+
+    args = parser.parse_args()
+    SIMULATED_LATENCY_SECONDS = args.latency_ms / 1000.0
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
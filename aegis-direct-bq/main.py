@@ -1,13 +1,35 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import ValidationError
 from google.cloud import bigquery
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 from typing import List, Optional, Dict, Any
 from dotenv import load_dotenv
+from aegis_common.ndjson_stream import BODY_ERRORS, UploadReport, stream_upload
+from aegis_common.schema import SIGNAL_DATA_LIST, SignalData
+from aegis_common.validation import request_validation_errors
+from write_buffer import InsertBuffer
+from writers import FakeWriter, InsertAllWriter, StorageWriteApiWriter
 load_dotenv()
 
-app = FastAPI()
+# --- Blocking I/O Configuration ---
+# The BigQuery client is synchronous, so inserts run on a bounded thread pool
+# instead of blocking the event loop for every other request.
+BLOCKING_IO_MAX_WORKERS = int(os.environ.get("BLOCKING_IO_MAX_WORKERS", "16"))
+executor = ThreadPoolExecutor(max_workers=BLOCKING_IO_MAX_WORKERS, thread_name_prefix="blocking-io")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Flush rows still waiting in the buffer before the executor goes away.
+    await insert_buffer.close()
+    writer.close()
+    executor.shutdown(wait=True)
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "chrome-extension://npaoakoaaldapklgolhgmifigkdnpfne",
@@ -32,34 +54,57 @@ if not all([PROJECT_ID, DATASET_ID, TABLE_ID]):
 
 TABLE_REF = f"{PROJECT_ID}.{DATASET_ID}.{TABLE_ID}"
 
-# Define the new, fixed Pydantic models
-class EventDetails(BaseModel):
-    context: Optional[str] = None
-    corroborating_signals: Optional[List[str]] = None
-
-class SignalData(BaseModel):
-    user_id: str
-    timestamp: str
-    signal_type: str
-    flag_type: str
-    confidence: float
-    topic_category: Optional[str] = None
-    source_platform: Optional[str] = None
-    event_details: Optional[EventDetails] = None
+# --- Writer Backend Configuration ---
+# "insert_all" streams JSON rows with insert_rows_json. "storage_write" appends
+# protobuf-encoded rows to the table's default stream with the Storage Write API.
+# "fake" keeps rows in memory for local runs without BigQuery.
+BIGQUERY_WRITE_BACKEND = os.environ.get("BIGQUERY_WRITE_BACKEND", "insert_all")
+
+if BIGQUERY_WRITE_BACKEND == "storage_write":
+    writer = StorageWriteApiWriter(PROJECT_ID, DATASET_ID, TABLE_ID, SignalData)
+elif BIGQUERY_WRITE_BACKEND == "insert_all":
+    writer = InsertAllWriter(client, TABLE_REF)
+elif BIGQUERY_WRITE_BACKEND == "fake":
+    writer = FakeWriter()
+else:
+    raise ValueError(f"Unknown BIGQUERY_WRITE_BACKEND: {BIGQUERY_WRITE_BACKEND}")
+
+# --- Insert Buffer Configuration ---
+# Rows from concurrent requests are coalesced into a single write,
+# flushed at whichever of these limits is reached first. Set
+# INSERT_BUFFER_MAX_LATENCY_MS=0 to write every request on its own.
+INSERT_BUFFER_MAX_ROWS = int(os.environ.get("INSERT_BUFFER_MAX_ROWS", "500"))
+INSERT_BUFFER_MAX_BYTES = int(os.environ.get("INSERT_BUFFER_MAX_BYTES", str(5 * 1024 * 1024)))
+INSERT_BUFFER_MAX_LATENCY_MS = float(os.environ.get("INSERT_BUFFER_MAX_LATENCY_MS", "200"))
+
+insert_buffer = InsertBuffer(
+    writer.write,
+    executor,
+    max_rows=INSERT_BUFFER_MAX_ROWS,
+    max_bytes=INSERT_BUFFER_MAX_BYTES,
+    max_latency_ms=INSERT_BUFFER_MAX_LATENCY_MS,
+)
 
 # --- CORRECTED ENDPOINT ---
 @app.post("/upload_data")
-async def upload_data(rows: List[SignalData]):
+async def upload_data(request: Request):
     """
     Receives a list of JSON objects, validates them against the Pydantic model,
-    and streams them to a BigQuery table.
+    and streams them to a BigQuery table through the shared insert buffer.
     """
+    # The body is validated straight from bytes in one call, rather than
+    # parsed into Python objects first.
+    try:
+        rows = SIGNAL_DATA_LIST.validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(request_validation_errors(e))
+
     try:
-        # Pydantic models can be converted to a dictionary using .model_dump()
-        json_rows = [row.model_dump() for row in rows]
+        json_rows = SIGNAL_DATA_LIST.dump_python(rows)
         
-        # Stream the data to the BigQuery table
-        errors = client.insert_rows_json(TABLE_REF, json_rows)
+        # Stream the data to the BigQuery table. The buffer resolves once the
+        # insert containing these rows has completed.
+        errors = await insert_buffer.submit(json_rows)
 
         if errors:
             raise HTTPException(status_code=500, detail=f"BigQuery insert failed: {errors}")
@@ -69,6 +114,54 @@ async def upload_data(rows: List[SignalData]):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- NDJSON Upload Configuration ---
+# /upload_ndjson validates and inserts a streamed body NDJSON_CHUNK_ROWS lines
+# at a time, with at most NDJSON_MAX_PENDING_CHUNKS chunks waiting on inserts,
+# so memory stays flat however large the upload is.
+NDJSON_CHUNK_ROWS = int(os.environ.get("NDJSON_CHUNK_ROWS", "500"))
+NDJSON_MAX_PENDING_CHUNKS = int(os.environ.get("NDJSON_MAX_PENDING_CHUNKS", "4"))
+NDJSON_MAX_LINE_BYTES = int(os.environ.get("NDJSON_MAX_LINE_BYTES", str(1024 * 1024)))
+NDJSON_MAX_REPORTED_ERRORS = int(os.environ.get("NDJSON_MAX_REPORTED_ERRORS", "100"))
+
+async def insert_chunk(rows: List[SignalData]) -> Dict[int, list]:
+    """Inserts one chunk of rows and returns their errors keyed by position."""
+    errors = await insert_buffer.submit([row.model_dump() for row in rows])
+    errors_by_index: Dict[int, list] = {}
+    for error in errors:
+        index = error.get("index", -1)
+        # Errors that are not tied to a row apply to the whole chunk.
+        for position in (range(len(rows)) if index < 0 else [index]):
+            errors_by_index.setdefault(position, []).extend(error.get("errors", []))
+    return errors_by_index
+
+@app.post("/upload_ndjson")
+async def upload_ndjson(request: Request):
+    """
+    Receives newline-delimited JSON, optionally compressed with gzip or zstd as
+    named by the Content-Encoding header, and inserts it into BigQuery in
+    chunks as it arrives. Lines that fail validation or that BigQuery rejects
+    are reported by line number without failing the rest of the upload.
+    """
+    report = UploadReport(NDJSON_MAX_REPORTED_ERRORS)
+    try:
+        await stream_upload(
+            request.stream(),
+            request.headers.get("content-encoding"),
+            SignalData,
+            insert_chunk,
+            report,
+            chunk_rows=NDJSON_CHUNK_ROWS,
+            max_pending_chunks=NDJSON_MAX_PENDING_CHUNKS,
+            max_line_bytes=NDJSON_MAX_LINE_BYTES,
+        )
+    except BODY_ERRORS as e:
+        # Rows forwarded before the body broke off stay inserted.
+        raise HTTPException(
+            status_code=400, detail={**report.as_response("rows_inserted"), "status": "error", "message": str(e)}
+        )
+
+    return report.as_response("rows_inserted")
+
 @app.get("/")
 def health_check():
     return {"status": "ok"}
\ No newline at end of file
@@ -0,0 +1,5 @@
+"""Puts the service's modules on the path, so the tests can import them."""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
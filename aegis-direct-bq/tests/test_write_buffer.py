@@ -0,0 +1,81 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from write_buffer import InsertBuffer
+
+
+class RecordingWriter:
+    """Returns the queued errors for each write, recording the rows written."""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.writes = []
+
+    def __call__(self, rows):
+        self.writes.append(rows)
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+
+def error(index, message):
+    return {"index": index, "errors": [{"reason": "invalid", "message": message}]}
+
+
+@pytest.mark.asyncio
+async def test_errors_are_scattered_back_to_the_request_that_submitted_each_row(executor):
+    write_rows = RecordingWriter([error(2, "b1"), error(3, "c0"), error(5, "c2"), error(5, "c2 again")])
+    buffer = InsertBuffer(write_rows, executor, max_rows=5, max_latency_ms=10_000)
+
+    results = await asyncio.gather(
+        buffer.submit([{"r": "a0"}]),
+        buffer.submit([{"r": "b0"}, {"r": "b1"}]),
+        buffer.submit([{"r": "c0"}, {"r": "c1"}, {"r": "c2"}]),
+    )
+
+    assert len(write_rows.writes) == 1
+    assert [row["r"] for row in write_rows.writes[0]] == ["a0", "b0", "b1", "c0", "c1", "c2"]
+    assert results == [
+        [],
+        [error(1, "b1")],
+        [error(0, "c0"), error(2, "c2"), error(2, "c2 again")],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_errors_without_an_index_apply_to_every_request(executor):
+    batch_error = {"errors": [{"reason": "stopped", "message": "whole batch"}]}
+    buffer = InsertBuffer(RecordingWriter([batch_error]), executor, max_rows=2, max_latency_ms=10_000)
+
+    results = await asyncio.gather(buffer.submit([{"r": "a0"}]), buffer.submit([{"r": "b0"}]))
+
+    assert results == [[batch_error], [batch_error]]
+
+
+@pytest.mark.asyncio
+async def test_a_failed_write_fails_every_request_in_the_batch(executor):
+    buffer = InsertBuffer(RecordingWriter(RuntimeError("unavailable")), executor, max_rows=2, max_latency_ms=10_000)
+
+    results = await asyncio.gather(
+        buffer.submit([{"r": "a0"}]), buffer.submit([{"r": "b0"}]), return_exceptions=True
+    )
+
+    assert [str(result) for result in results] == ["unavailable", "unavailable"]
+
+
+@pytest.mark.asyncio
+async def test_rows_are_flushed_after_the_latency_bound(executor):
+    write_rows = RecordingWriter([error(0, "a0")])
+    buffer = InsertBuffer(write_rows, executor, max_rows=500, max_latency_ms=20)
+
+    assert await buffer.submit([{"r": "a0"}]) == [error(0, "a0")]
+    assert len(write_rows.writes) == 1
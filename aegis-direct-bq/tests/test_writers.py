@@ -0,0 +1,148 @@
+from concurrent.futures import Future
+
+import pytest
+from aegis_common.schema import SignalData
+from google.api_core import exceptions
+from google.cloud.bigquery_storage_v1 import types
+
+import writers
+
+
+class FakeAppendRowsStream:
+    """Stands in for AppendRowsStream, answering each append from its write client."""
+
+    def __init__(self, write_client, template):
+        self.write_client = write_client
+        self.closed = False
+        write_client.streams.append(self)
+
+    def send(self, request):
+        if self.closed:
+            raise RuntimeError("This stream has been closed.")
+        rows = list(request.proto_rows.rows.serialized_rows)
+        self.write_client.appends.append(rows)
+        future = Future()
+        outcome = self.write_client.outcomes.pop(0) if self.write_client.outcomes else None
+        if outcome is None:
+            future.set_result(types.AppendRowsResponse())
+        else:
+            future.set_exception(outcome)
+        return future
+
+    def close(self):
+        self.closed = True
+
+
+class FakeWriteClient:
+    """Records the streams opened and rows appended, failing appends with the queued outcomes."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.streams = []
+        self.appends = []
+
+
+def row_errors(*failures):
+    """A failed append whose response rejects the rows at the given (index, message) pairs."""
+    return exceptions.InvalidArgument("Rows were rejected.", response=types.AppendRowsResponse(row_errors=[
+        types.RowError(index=index, code=types.RowError.RowErrorCode.FIELDS_ERROR, message=message)
+        for index, message in failures
+    ]))
+
+
+@pytest.fixture(autouse=True)
+def fake_stream(monkeypatch):
+    monkeypatch.setattr(writers.writer, "AppendRowsStream", FakeAppendRowsStream)
+
+
+def make_writer(write_client):
+    return writers.StorageWriteApiWriter("p", "d", "t", SignalData, write_client=write_client)
+
+
+def make_row(user_id, timestamp="2025-08-20T10:00:00Z"):
+    return {
+        "user_id": user_id, "timestamp": timestamp, "signal_type": "INTERMEDIATE_FLAG",
+        "flag_type": "SEXUAL_CONTENT", "confidence": 0.9,
+        "event_details": {"context": "ctx", "corroborating_signals": ["a", "b"]},
+    }
+
+
+def appended_users(storage_writer, rows):
+    return [storage_writer.message_class.FromString(row).user_id for row in rows]
+
+
+def test_rejected_rows_are_reported_at_their_original_index():
+    write_client = FakeWriteClient(row_errors((2, "bad u2")), row_errors((3, "bad u5")))
+    storage_writer = make_writer(write_client)
+    rows = [make_row(f"u{i}") for i in range(6)]
+    rows[3]["timestamp"] = "not a time"
+
+    errors = storage_writer.write(rows)
+
+    # Row 3 never reaches BigQuery. The second append leaves out u2 as well, so its index 3 is u5.
+    assert [appended_users(storage_writer, rows) for rows in write_client.appends] == [
+        ["u0", "u1", "u2", "u4", "u5"], ["u0", "u1", "u4", "u5"], ["u0", "u1", "u4"],
+    ]
+    assert [(error["index"], error["errors"][0]["reason"]) for error in errors] == [
+        (2, "fields_error"), (3, "invalid"), (5, "fields_error"),
+    ]
+    assert errors[0]["errors"][0]["message"] == "bad u2"
+    assert len(write_client.streams) == 1
+
+
+def test_row_errors_that_name_no_row_fail_the_batch():
+    write_client = FakeWriteClient(row_errors((7, "out of range")))
+    storage_writer = make_writer(write_client)
+
+    errors = storage_writer.write([make_row("u0"), make_row("u1")])
+
+    assert [error["index"] for error in errors] == [0, 1]
+    assert len(write_client.appends) == 1
+
+
+@pytest.mark.parametrize("failure", [exceptions.ServiceUnavailable("Try again."), RuntimeError("Stream closed.")])
+def test_other_failures_reopen_the_stream(failure):
+    write_client = FakeWriteClient(failure)
+    storage_writer = make_writer(write_client)
+
+    with pytest.raises(type(failure)):
+        storage_writer.write([make_row("u0")])
+    assert storage_writer.write([make_row("u1")]) == []
+
+    assert [stream.closed for stream in write_client.streams] == [True, False]
+
+
+def test_row_errors_keep_the_stream_open():
+    write_client = FakeWriteClient(row_errors((0, "bad")))
+    storage_writer = make_writer(write_client)
+
+    storage_writer.write([make_row("u0"), make_row("u1")])
+    storage_writer.write([make_row("u2")])
+
+    assert len(write_client.streams) == 1
+
+
+@pytest.mark.parametrize("timestamp, micros", [
+    ("2025-08-20T10:00:00Z", 1755684000000000),
+    ("2025-08-20T10:00:00.123456Z", 1755684000123456),
+    ("2025-08-20 10:00:00 UTC", 1755684000000000),
+    ("2025-08-20 10:00:00", 1755684000000000),
+    ("2025-08-20T15:30:00.5+05:30", 1755684000500000),
+    ("2025-08-20 06:00:00 America/New_York", 1755684000000000),
+    ("2025-8-20 10:0:0", 1755684000000000),
+    ("2025-08-20", 1755648000000000),
+])
+def test_timestamps_are_encoded_as_microseconds(timestamp, micros):
+    storage_writer = make_writer(FakeWriteClient())
+    assert storage_writer._encode(make_row("u0", timestamp)).timestamp == micros
+
+
+@pytest.mark.parametrize("timestamp", ["", "yesterday", "2025-08-20T10:00", "2025-08-20 10:00:00 Mars/Base"])
+def test_timestamps_bigquery_rejects_are_row_errors(timestamp):
+    write_client = FakeWriteClient()
+    storage_writer = make_writer(write_client)
+
+    [error] = storage_writer.write([make_row("u0", timestamp)])
+
+    assert error["index"] == 0 and error["errors"][0]["reason"] == "invalid"
+    assert write_client.appends == []
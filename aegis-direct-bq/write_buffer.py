@@ -0,0 +1,115 @@
+"""
+An in-process write buffer that coalesces rows from many requests into fewer
+BigQuery streaming inserts.
+"""
+import asyncio
+import json
+from concurrent.futures import Executor
+from typing import Callable, Dict, List, Optional, Set
+
+
+class InsertBuffer:
+    """
+    Collects rows submitted by concurrent requests and writes them in a single
+    call once the buffer holds `max_rows` rows or `max_bytes` bytes, or once the
+    oldest buffered row has waited `max_latency_ms` milliseconds.
+
+    Each `submit` call awaits the flush that contains its rows and receives the
+    insert errors for those rows only, re-indexed relative to the rows it
+    submitted. This keeps per-request acknowledgement semantics while the
+    underlying inserts are shared.
+    """
+
+    def __init__(
+        self,
+        write_rows: Callable[[List[dict]], List[dict]],
+        executor: Executor,
+        max_rows: int = 500,
+        max_bytes: int = 5 * 1024 * 1024,
+        max_latency_ms: float = 200.0,
+    ):
+        self.write_rows = write_rows
+        self.executor = executor
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_latency_ms = max_latency_ms
+
+        self._pending: List[tuple] = []
+        self._pending_rows = 0
+        self._pending_bytes = 0
+        self._flush_timer: Optional[asyncio.TimerHandle] = None
+        self._flush_tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, rows: List[dict]) -> List[dict]:
+        """Buffers `rows` and returns the insert errors for them once flushed."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not rows:
+            future.set_result([])
+            return await future
+
+        self._pending.append((rows, future))
+        self._pending_rows += len(rows)
+        self._pending_bytes += sum(len(json.dumps(row)) for row in rows)
+
+        if (
+            self._pending_rows >= self.max_rows
+            or self._pending_bytes >= self.max_bytes
+            or self.max_latency_ms <= 0
+        ):
+            self._start_flush()
+        elif self._flush_timer is None:
+            self._flush_timer = loop.call_later(self.max_latency_ms / 1000.0, self._start_flush)
+
+        return await future
+
+    async def close(self):
+        """Flushes any buffered rows and waits for in-flight flushes to finish."""
+        self._start_flush()
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+    def _start_flush(self):
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        if not self._pending:
+            return
+
+        batch = self._pending
+        self._pending = []
+        self._pending_rows = 0
+        self._pending_bytes = 0
+
+        task = asyncio.get_running_loop().create_task(self._flush(batch))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush(self, batch: List[tuple]):
+        rows = [row for request_rows, _ in batch for row in request_rows]
+        loop = asyncio.get_running_loop()
+        try:
+            errors = await loop.run_in_executor(self.executor, self.write_rows, rows)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Scatter the errors back to the request that submitted each row.
+        errors_by_index: Dict[int, List[dict]] = {}
+        for error in errors or []:
+            errors_by_index.setdefault(error.get("index", -1), []).append(error)
+
+        # Errors that are not tied to a row apply to every request in the batch.
+        batch_errors = errors_by_index.pop(-1, [])
+
+        offset = 0
+        for request_rows, future in batch:
+            request_errors = list(batch_errors)
+            for position in range(len(request_rows)):
+                for error in errors_by_index.get(offset + position, []):
+                    request_errors.append({**error, "index": position})
+            offset += len(request_rows)
+            if not future.done():
+                future.set_result(request_errors)
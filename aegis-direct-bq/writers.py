@@ -0,0 +1,275 @@
+"""
+Pluggable BigQuery writer backends for the ingestion service.
+
+Every writer exposes `write(rows) -> errors` and `close()`. The returned errors
+follow the `insert_rows_json` format, a list of `{"index": i, "errors": [...]}`
+entries, so the insert buffer can scatter them back to requests without knowing
+which backend produced them.
+"""
+import datetime
+import re
+import threading
+import typing
+import zoneinfo
+from typing import Dict, List, Set, Type
+
+from google.api_core import exceptions
+from google.cloud import bigquery_storage_v1
+from google.cloud.bigquery_storage_v1 import types, writer
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+from pydantic import BaseModel
+
+# The TIMESTAMP strings BigQuery accepts: a date, an optional time with up to
+# six fractional digits, and an optional Z, UTC, UTC offset or time zone name.
+_TIMESTAMP_PATTERN = re.compile(
+    r"(\d{4})-(\d{1,2})-(\d{1,2})"
+    r"(?:[Tt ](\d{1,2}):(\d{1,2}):(\d{1,2})(?:\.(\d{1,6}))?)?"
+    r"(?:\s*(?:(?P<utc>[Zz]|UTC)|(?P<offset>[+-]\d{1,2}(?::?\d{2})?)|(?P<zone>[A-Za-z_]+(?:/[A-Za-z0-9_+-]+)+)))?"
+)
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+_PROTO_SCALAR_TYPES = {
+    str: descriptor_pb2.FieldDescriptorProto.TYPE_STRING,
+    float: descriptor_pb2.FieldDescriptorProto.TYPE_DOUBLE,
+    int: descriptor_pb2.FieldDescriptorProto.TYPE_INT64,
+    bool: descriptor_pb2.FieldDescriptorProto.TYPE_BOOL,
+}
+
+
+class InsertAllWriter:
+    """Writes rows with the legacy streaming API (`insert_rows_json`)."""
+
+    def __init__(self, client, table_ref: str):
+        self.client = client
+        self.table_ref = table_ref
+
+    def write(self, rows: List[dict]) -> List[dict]:
+        return self.client.insert_rows_json(self.table_ref, rows)
+
+    def close(self):
+        pass
+
+
+class FakeWriter:
+    """Keeps written rows in memory. Used by benchmarks and local runs."""
+
+    def __init__(self):
+        self.rows: List[dict] = []
+        self.write_calls = 0
+        self._lock = threading.Lock()
+
+    def write(self, rows: List[dict]) -> List[dict]:
+        with self._lock:
+            self.rows.extend(rows)
+            self.write_calls += 1
+        return []
+
+    def close(self):
+        pass
+
+
+def build_proto_descriptor(
+    model: Type[BaseModel],
+    timestamp_fields: Set[str] = frozenset(),
+) -> descriptor_pb2.DescriptorProto:
+    """
+    Derives a self-contained proto2 descriptor from a Pydantic model. Nested
+    models become nested message types and `List[...]` fields become repeated
+    fields. String fields named in `timestamp_fields` are encoded as int64
+    microseconds since the epoch, which is how the Storage Write API expects
+    TIMESTAMP columns.
+    """
+    descriptor = descriptor_pb2.DescriptorProto(name=model.__name__)
+    for number, (name, field) in enumerate(model.model_fields.items(), start=1):
+        annotation = _unwrap_optional(field.annotation)
+        label = descriptor_pb2.FieldDescriptorProto.LABEL_OPTIONAL
+        if typing.get_origin(annotation) in (list, List):
+            label = descriptor_pb2.FieldDescriptorProto.LABEL_REPEATED
+            annotation = _unwrap_optional(typing.get_args(annotation)[0])
+
+        proto_field = descriptor.field.add(name=name, number=number, label=label)
+        if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+            descriptor.nested_type.add().CopyFrom(build_proto_descriptor(annotation, timestamp_fields))
+            proto_field.type = descriptor_pb2.FieldDescriptorProto.TYPE_MESSAGE
+            proto_field.type_name = annotation.__name__
+        elif name in timestamp_fields:
+            proto_field.type = descriptor_pb2.FieldDescriptorProto.TYPE_INT64
+        else:
+            proto_field.type = _PROTO_SCALAR_TYPES[annotation]
+    return descriptor
+
+
+def _unwrap_optional(annotation):
+    if typing.get_origin(annotation) is typing.Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        if len(args) == 1:
+            return args[0]
+    return annotation
+
+
+def _timestamp_to_micros(value: str) -> int:
+    """
+    Converts a TIMESTAMP string to microseconds since the epoch, accepting the
+    same formats as `insert_rows_json`. Timestamps without a time zone are in
+    UTC. Raises ValueError for anything BigQuery would reject.
+    """
+    match = _TIMESTAMP_PATTERN.fullmatch(value.strip())
+    if match is None:
+        raise ValueError(f"Invalid timestamp: {value!r}")
+    year, month, day, hour, minute, second, fraction = match.groups()[:7]
+    if match.group("offset"):
+        sign, offset = match.group("offset")[0], match.group("offset")[1:].replace(":", "")
+        hours, minutes = (offset[:-2], offset[-2:]) if len(offset) > 2 else (offset, "0")
+        delta = datetime.timedelta(hours=int(hours), minutes=int(minutes))
+        tzinfo = datetime.timezone(-delta if sign == "-" else delta)
+    elif match.group("zone"):
+        try:
+            tzinfo = zoneinfo.ZoneInfo(match.group("zone"))
+        except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"Unknown time zone in timestamp: {value!r}")
+    else:
+        tzinfo = datetime.timezone.utc
+    parsed = datetime.datetime(
+        int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+        int((fraction or "0").ljust(6, "0")), tzinfo=tzinfo,
+    )
+    # Integer arithmetic, so microseconds are not lost to float rounding.
+    return (parsed - _EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def _fill_message(message, values: dict):
+    """Copies a row dict into a proto message, leaving None values unset."""
+    fields = message.DESCRIPTOR.fields_by_name
+    for name, value in values.items():
+        if value is None:
+            continue
+        field = fields[name]
+        if field.message_type is not None:
+            _fill_message(getattr(message, name), value)
+        elif isinstance(value, list):
+            getattr(message, name).extend(value)
+        else:
+            setattr(message, name, value)
+    return message
+
+
+class StorageWriteApiWriter:
+    """
+    Appends rows to the table's default stream with the BigQuery Storage Write
+    API. Rows are encoded as protobuf messages whose schema is derived from the
+    Pydantic model, which is smaller on the wire than JSON. The default stream
+    commits rows as soon as an append succeeds.
+
+    Appends are atomic, so rows that BigQuery rejects are reported as errors and
+    the rest of the batch is appended again without them.
+    """
+
+    def __init__(
+        self,
+        project_id: str,
+        dataset_id: str,
+        table_id: str,
+        model: Type[BaseModel],
+        timestamp_fields: Set[str] = frozenset({"timestamp"}),
+        write_client=None,
+    ):
+        self.write_client = write_client or bigquery_storage_v1.BigQueryWriteClient()
+        self.stream_name = f"projects/{project_id}/datasets/{dataset_id}/tables/{table_id}/streams/_default"
+        self.timestamp_fields = set(timestamp_fields)
+
+        self.descriptor = build_proto_descriptor(model, self.timestamp_fields)
+        file_descriptor = descriptor_pb2.FileDescriptorProto(
+            name=f"{model.__name__.lower()}.proto", package="aegis", syntax="proto2"
+        )
+        file_descriptor.message_type.add().CopyFrom(self.descriptor)
+        pool = descriptor_pool.DescriptorPool()
+        pool.Add(file_descriptor)
+        self.message_class = message_factory.GetMessageClass(
+            pool.FindMessageTypeByName(f"aegis.{model.__name__}")
+        )
+
+        self._stream = None
+        self._lock = threading.Lock()
+
+    def write(self, rows: List[dict]) -> List[dict]:
+        errors: List[dict] = []
+        encoded: Dict[int, bytes] = {}
+        for index, row in enumerate(rows):
+            try:
+                encoded[index] = self._encode(row).SerializeToString()
+            except Exception as e:
+                errors.append({"index": index, "errors": [{"reason": "invalid", "message": str(e)}]})
+
+        while encoded:
+            indices = list(encoded)
+            row_errors = self._append([encoded[index] for index in indices])
+            if not row_errors:
+                break
+            # Row errors index into the appended batch, which leaves out rows already rejected.
+            failed = [(indices[e.index], e) for e in row_errors if 0 <= e.index < len(indices)]
+            if not failed:
+                # Errors that name no row of the batch would never shrink it, so they fail all of it.
+                failed = [(index, row_errors[0]) for index in indices]
+            for index, row_error in failed:
+                errors.append({
+                    "index": index,
+                    "errors": [{"reason": row_error.code.name.lower(), "message": row_error.message}],
+                })
+                encoded.pop(index, None)
+
+        return sorted(errors, key=lambda error: error["index"])
+
+    def close(self):
+        with self._lock:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+
+    def _encode(self, row: dict):
+        values = dict(row)
+        for name in self.timestamp_fields:
+            if values.get(name) is not None:
+                values[name] = _timestamp_to_micros(values[name])
+        return _fill_message(self.message_class(), values)
+
+    def _append(self, serialized_rows: List[bytes]) -> list:
+        """
+        Appends one batch and returns its row errors, if BigQuery rejected any.
+        Any other failure, including a stream that has closed, reopens the
+        stream for the next append and is raised.
+        """
+        request = types.AppendRowsRequest()
+        proto_data = types.AppendRowsRequest.ProtoData()
+        proto_data.rows = types.ProtoRows(serialized_rows=serialized_rows)
+        request.proto_rows = proto_data
+
+        try:
+            with self._lock:
+                future = self._open_stream().send(request)
+            future.result()
+        except exceptions.GoogleAPICallError as e:
+            response = getattr(e, "response", None)
+            if response is not None and response.row_errors:
+                return list(response.row_errors)
+            self._reset_stream()
+            raise
+        except Exception:
+            self._reset_stream()
+            raise
+        return []
+
+    def _open_stream(self):
+        if self._stream is None:
+            template = types.AppendRowsRequest()
+            template.write_stream = self.stream_name
+            proto_data = types.AppendRowsRequest.ProtoData()
+            proto_data.writer_schema = types.ProtoSchema(proto_descriptor=self.descriptor)
+            template.proto_rows = proto_data
+            self._stream = writer.AppendRowsStream(self.write_client, template)
+        return self._stream
+
+    def _reset_stream(self):
+        with self._lock:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
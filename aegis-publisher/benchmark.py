@@ -0,0 +1,343 @@
+"""
+Benchmark harness for the Aegis Ingestion API.
+
+The Google clients are replaced with in-process stubs that simulate RPC
+latency, so the harness runs without any cloud resources. Requests are sent
+through the ASGI app directly with httpx.
+
+The `publish` scenario instead drives the real Pub/Sub client, so its batching
+and flow control apply, with only the Publish RPC replaced by an in-memory
+stand-in for the Pub/Sub emulator.
+
+Usage:
+    python benchmark.py load --latency-ms 50 --requests 200
+    python benchmark.py publish --latency-ms 20 --uploads 500 --rows 10
+    python benchmark.py ndjson --rows 100000
+    python benchmark.py validation --rows 10000
+"""
+import argparse
+import asyncio
+import concurrent.futures
+import gzip
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from typing import List
+from unittest import mock
+
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import dlp_v2, pubsub_v1
+from google.pubsub_v1 import types as pubsub_types
+
+os.environ.setdefault("GCP_PROJECT_ID", "benchmark-project")
+os.environ.setdefault("PUB_SUB_TOPIC_ID", "benchmark-topic")
+
+SIMULATED_LATENCY_SECONDS = 0.05
+
+
+# --- Stubbed Google Clients ---
+class FakePublisherClient:
+    """Completes every publish future after the simulated RPC latency."""
+
+    def __init__(self, *args, **kwargs):
+        self.published_count = 0
+
+    def topic_path(self, project, topic):
+        return f"projects/{project}/topics/{topic}"
+
+    def publish(self, topic, data, **attrs):
+        future = concurrent.futures.Future()
+        timer = threading.Timer(SIMULATED_LATENCY_SECONDS, future.set_result, args=(str(self.published_count),))
+        timer.daemon = True
+        timer.start()
+        self.published_count += 1
+        return future
+
+
+class InMemoryPubSub:
+    """
+    Stands in for the Publish RPC of a real client. Each call blocks for the
+    simulated latency, keeps the messages and returns their IDs.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.publish_calls = 0
+        self._lock = threading.Lock()
+
+    def publish(self, topic, messages, **kwargs):
+        time.sleep(SIMULATED_LATENCY_SECONDS)
+        with self._lock:
+            first_id = len(self.messages)
+            self.messages.extend(messages)
+            self.publish_calls += 1
+        return pubsub_types.PublishResponse(message_ids=[str(first_id + i) for i in range(len(messages))])
+
+
+class FakeDlpServiceClient:
+    """Blocks for the simulated RPC latency and reports no findings."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def inspect_content(self, request):
+        time.sleep(SIMULATED_LATENCY_SECONDS)
+        return dlp_v2.InspectContentResponse()
+
+
+def load_app():
+    """Imports the service with the stubbed clients in place."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    with mock.patch.object(pubsub_v1, "PublisherClient", FakePublisherClient), \
+            mock.patch.object(dlp_v2, "DlpServiceClient", FakeDlpServiceClient):
+        import main
+    return main
+
+
+def make_rows(count):
+    return [
+        {
+            "user_id": f"user{i % 3}",
+            "timestamp": "2025-08-22T12:00:00+00:00",
+            "signal_type": "NEUTRAL_FLAG",
+            "flag_type": "NEUTRAL",
+            "confidence": 0.9,
+            "topic_category": "Educational Content",
+            "source_platform": "Chrome Extension",
+            "event_details": {
+                "context": "Watching educational videos on history",
+                "corroborating_signals": ["neutral user activity"],
+            },
+        }
+        for i in range(count)
+    ]
+
+
+# --- Scenarios ---
+async def run_load(app, total_requests, concurrency, rows_per_request):
+    """Sends `total_requests` uploads with at most `concurrency` in flight."""
+    import httpx
+
+    rows = make_rows(rows_per_request)
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as http:
+        async def send():
+            async with semaphore:
+                response = await http.post("/upload_data", json=rows)
+                response.raise_for_status()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(send() for _ in range(total_requests)))
+        return time.perf_counter() - start
+
+
+def load_scenario(args):
+    main = load_app()
+    print(f"Simulated RPC latency: {args.latency_ms} ms, {args.rows} rows per request")
+    print(f"{'concurrency':>12} {'requests/sec':>14}")
+    for concurrency in args.concurrency:
+        elapsed = asyncio.run(run_load(main.app, args.requests, concurrency, args.rows))
+        print(f"{concurrency:>12} {args.requests / elapsed:>14.1f}")
+
+
+def use_in_memory_publisher(main, batch_settings):
+    """
+    Gives the service a real Pub/Sub client with `batch_settings` whose Publish
+    RPC goes to an in-memory stand-in, and returns the stand-in.
+    """
+    stand_in = InMemoryPubSub()
+    main.publisher = pubsub_v1.PublisherClient(
+        batch_settings=batch_settings,
+        publisher_options=main.PUBSUB_PUBLISHER_OPTIONS,
+        credentials=AnonymousCredentials(),
+    )
+    main.publisher._gapic_publish = stand_in.publish
+    return stand_in
+
+
+def run_publish(main, total_uploads, concurrency, rows_per_upload, users):
+    """
+    Publishes `total_uploads` uploads from `concurrency` threads, as the
+    endpoint does, and records the time from publish() to each message's ack.
+    Each upload belongs to one of `users` users, whose messages share an
+    ordering key and are therefore published one batch at a time.
+    """
+    uploads = []
+    for user in range(users):
+        rows = [main.SignalData(**{**row, "user_id": f"user{user}"}) for row in make_rows(rows_per_upload)]
+        uploads.append((rows, [main.SIGNAL_DATA.dump_json(row) for row in rows]))
+    latencies = []
+
+    def upload(index):
+        rows, payloads = uploads[index % users]
+        start = time.perf_counter()
+        futures = main.publish_rows(rows, payloads)
+        for future in futures:
+            future.add_done_callback(lambda _: latencies.append(time.perf_counter() - start))
+        concurrent.futures.wait(futures)
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as uploaders:
+        list(uploaders.map(upload, range(total_uploads)))
+    return time.perf_counter() - start, latencies
+
+
+def publish_scenario(args):
+    main = load_app()
+    print(f"Simulated RPC latency: {args.latency_ms} ms, {args.rows} rows per upload from {args.users} users, "
+          f"{args.concurrency} concurrent uploads, compression from {args.compression_min_bytes or '-'} bytes")
+    print(f"{'max messages':>12} {'max latency ms':>15} {'messages/sec':>13} {'RPCs':>6} {'p50 ms':>8} {'p99 ms':>8}")
+    main.PUBSUB_COMPRESSION_MIN_BYTES = args.compression_min_bytes
+    for max_messages in args.max_messages:
+        for max_latency_ms in args.max_latency_ms:
+            stand_in = use_in_memory_publisher(main, main.BatchSettings(
+                max_messages=max_messages,
+                max_bytes=main.PUBSUB_BATCH_SETTINGS.max_bytes,
+                max_latency=max_latency_ms / 1000.0,
+            ))
+            elapsed, latencies = run_publish(main, args.uploads, args.concurrency, args.rows, args.users)
+            main.publisher.stop()
+            quantiles = statistics.quantiles(latencies, n=100)
+            print(f"{max_messages:>12} {max_latency_ms:>15g} {len(stand_in.messages) / elapsed:>13.0f} "
+                  f"{stand_in.publish_calls:>6} {quantiles[49] * 1000:>8.1f} {quantiles[98] * 1000:>8.1f}")
+
+
+async def run_upload(app, path, body, headers, piece_bytes=64 * 1024):
+    """Streams `body` to `path` in pieces, as a client on a slow link would."""
+    import httpx
+
+    async def pieces():
+        for start in range(0, len(body), piece_bytes):
+            yield body[start:start + piece_bytes]
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as http:
+        start = time.perf_counter()
+        response = await http.post(path, content=pieces(), headers=headers)
+        response.raise_for_status()
+        return time.perf_counter() - start
+
+
+def ndjson_scenario(args):
+    """Throughput and peak memory of one large upload as a JSON array and as NDJSON."""
+    import zstandard
+
+    main = load_app()
+    rows = make_rows(args.rows)
+    # Vary every row, so the bodies compress like real uploads rather than
+    # like one row repeated.
+    for i, row in enumerate(rows):
+        row["user_id"] = f"user{i % args.users}"
+        row["timestamp"] = f"2025-08-22T{i // 3600 % 24:02d}:{i // 60 % 60:02d}:{i % 60:02d}+00:00"
+        row["confidence"] = round(random.random(), 3)
+        row["event_details"]["context"] += f" (video {random.randrange(10 ** 9)})"
+    ndjson = b"".join(json.dumps(row).encode("utf-8") + b"\n" for row in rows)
+    uploads = [
+        ("json array", "/upload_data", json.dumps(rows).encode("utf-8"), {"Content-Type": "application/json"}),
+        ("ndjson", "/upload_ndjson", ndjson, {}),
+        ("ndjson+gzip", "/upload_ndjson", gzip.compress(ndjson), {"Content-Encoding": "gzip"}),
+        ("ndjson+zstd", "/upload_ndjson", zstandard.ZstdCompressor().compress(ndjson), {"Content-Encoding": "zstd"}),
+    ]
+    del rows, ndjson
+    use_in_memory_publisher(main, main.PUBSUB_BATCH_SETTINGS)
+
+    print(f"Simulated RPC latency: {args.latency_ms} ms, {args.rows} rows per upload from {args.users} users")
+    print(f"{'upload':>12} {'body MB':>8} {'rows/sec':>10} {'peak MB':>8}")
+    for label, path, body, headers in uploads:
+        elapsed = asyncio.run(run_upload(main.app, path, body, headers))
+        # Peak memory is measured on a second run, since tracing slows allocation down.
+        tracemalloc.start()
+        asyncio.run(run_upload(main.app, path, body, headers))
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{label:>12} {len(body) / 1e6:>8.1f} {args.rows / elapsed:>10.0f} {peak / 1e6:>8.1f}")
+
+
+def validation_scenario(args):
+    """
+    CPU time and peak memory per row for turning a request body into message
+    payloads, the way FastAPI did it and straight from bytes to bytes.
+    """
+    from pydantic import TypeAdapter
+
+    main = load_app()
+    body = json.dumps(make_rows(args.rows)).encode("utf-8")
+    legacy_adapter = TypeAdapter(List[main.SignalData])
+
+    def parse_and_dump(body):
+        # FastAPI parses the body with json.loads and validates the Python objects.
+        rows = legacy_adapter.validate_python(json.loads(body))
+        return [json.dumps(row.model_dump()).encode("utf-8") for row in rows]
+
+    def validate_json_and_dump_json(body):
+        rows = main.SIGNAL_DATA_LIST.validate_json(body)
+        return [main.SIGNAL_DATA.dump_json(row) for row in rows]
+
+    print(f"{args.rows} rows, {len(body) / 1e6:.1f} MB body")
+    print(f"{'path':>28} {'us/row':>8} {'peak bytes/row':>15}")
+    for label, convert in [
+        ("json.loads + model_dump", parse_and_dump),
+        ("validate_json + dump_json", validate_json_and_dump_json),
+    ]:
+        elapsed = float("inf")
+        for _ in range(args.repeat):
+            start = time.process_time()
+            convert(body)
+            elapsed = min(elapsed, time.process_time() - start)
+        tracemalloc.start()
+        convert(body)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(f"{label:>28} {elapsed / args.rows * 1e6:>8.2f} {peak / args.rows:>15.0f}")
+
+
+def main():
+    global SIMULATED_LATENCY_SECONDS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="scenario", required=True)
+
+    load = subparsers.add_parser("load", help="Requests/sec against /upload_data at increasing concurrency.")
+    load.add_argument("--latency-ms", type=float, default=50.0)
+    load.add_argument("--requests", type=int, default=200)
+    load.add_argument("--rows", type=int, default=10)
+    load.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    load.set_defaults(handler=load_scenario)
+
+    publish = subparsers.add_parser("publish", help="Messages/sec and publish latency for batch settings.")
+    publish.add_argument("--latency-ms", type=float, default=20.0)
+    publish.add_argument("--uploads", type=int, default=500)
+    publish.add_argument("--rows", type=int, default=10)
+    publish.add_argument("--concurrency", type=int, default=16)
+    publish.add_argument("--users", type=int, default=100)
+    publish.add_argument("--max-messages", type=int, nargs="+", default=[10, 100, 1000])
+    publish.add_argument("--max-latency-ms", type=float, nargs="+", default=[1, 10, 50])
+    publish.add_argument("--compression-min-bytes", type=int, default=0)
+    publish.set_defaults(handler=publish_scenario)
+
+    ndjson = subparsers.add_parser("ndjson", help="Throughput and peak memory of a large JSON array and NDJSON upload.")
+    ndjson.add_argument("--latency-ms", type=float, default=10.0)
+    ndjson.add_argument("--rows", type=int, default=100000)
+    ndjson.add_argument("--users", type=int, default=10)
+    ndjson.set_defaults(handler=ndjson_scenario)
+
+    validation = subparsers.add_parser("validation", help="Per-row CPU and memory of body validation and serialization.")
+    validation.add_argument("--latency-ms", type=float, default=0.0)
+    validation.add_argument("--rows", type=int, default=10000)
+    validation.add_argument("--repeat", type=int, default=5)
+    validation.set_defaults(handler=validation_scenario)
+
+    args = parser.parse_args()
+    SIMULATED_LATENCY_SECONDS = args.latency_ms / 1000.0
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
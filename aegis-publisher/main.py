@@ -1,12 +1,36 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import ValidationError
 from google.cloud import pubsub_v1, dlp_v2
+from google.cloud.pubsub_v1.publisher import exceptions as publisher_exceptions
+from google.cloud.pubsub_v1.types import BatchSettings, LimitExceededBehavior, PublisherOptions, PublishFlowControl
 import os
 import json
-from typing import List, Optional, Dict, Any
+import asyncio
+import gzip
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from typing import List, Optional, Dict, Any, Iterator, Tuple
+from aegis_common.ndjson_stream import BODY_ERRORS, UploadReport, stream_upload
+from aegis_common.schema import SIGNAL_DATA, SIGNAL_DATA_LIST, SignalData
+from aegis_common.validation import request_validation_errors
 
-app = FastAPI()
+# --- Blocking I/O Configuration ---
+# The Google clients are synchronous, so their calls run on a bounded thread
+# pool instead of blocking the event loop for every other request.
+BLOCKING_IO_MAX_WORKERS = int(os.environ.get("BLOCKING_IO_MAX_WORKERS", "16"))
+executor = ThreadPoolExecutor(max_workers=BLOCKING_IO_MAX_WORKERS, thread_name_prefix="blocking-io")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    executor.shutdown(wait=True)
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     "chrome-extension://npaoakoaaldapklgolhgmifigkdnpfne",
@@ -21,7 +45,36 @@ app.add_middleware(
 )
 
 # --- Pub/Sub Configuration ---
-publisher = pubsub_v1.PublisherClient()
+# The client groups messages into one Publish RPC until a batch holds
+# max_messages or max_bytes, or its first message has waited max_latency.
+PUBSUB_BATCH_SETTINGS = BatchSettings(
+    max_messages=int(os.environ.get("PUBSUB_BATCH_MAX_MESSAGES", "100")),
+    max_bytes=int(os.environ.get("PUBSUB_BATCH_MAX_BYTES", str(1000 * 1000))),
+    max_latency=float(os.environ.get("PUBSUB_BATCH_MAX_LATENCY_MS", "10")) / 1000.0,
+)
+
+# Flow control bounds the messages and bytes waiting to be published. When the
+# limit is reached, "block" makes publish() wait for room, "error" rejects the
+# message and "ignore" disables the limit.
+PUBSUB_FLOW_CONTROL = PublishFlowControl(
+    message_limit=int(os.environ.get("PUBSUB_FLOW_CONTROL_MAX_MESSAGES", "1000")),
+    byte_limit=int(os.environ.get("PUBSUB_FLOW_CONTROL_MAX_BYTES", str(10 * 1000 * 1000))),
+    limit_exceeded_behavior=LimitExceededBehavior(
+        os.environ.get("PUBSUB_FLOW_CONTROL_LIMIT_EXCEEDED_BEHAVIOR", "block").lower()
+    ),
+)
+
+# Payloads of at least this many bytes are gzip-compressed and marked with the
+# content encoding attribute. 0 disables compression.
+PUBSUB_COMPRESSION_MIN_BYTES = int(os.environ.get("PUBSUB_COMPRESSION_MIN_BYTES", "0"))
+CONTENT_ENCODING_ATTRIBUTE = "content_encoding"
+
+# Messages are published with the user ID as their ordering key, so each user's
+# records are delivered in the order they were received.
+PUBSUB_PUBLISHER_OPTIONS = PublisherOptions(enable_message_ordering=True, flow_control=PUBSUB_FLOW_CONTROL)
+publisher = pubsub_v1.PublisherClient(
+    batch_settings=PUBSUB_BATCH_SETTINGS, publisher_options=PUBSUB_PUBLISHER_OPTIONS
+)
 PROJECT_ID = os.environ.get("GCP_PROJECT_ID")
 TOPIC_ID = os.environ.get("PUB_SUB_TOPIC_ID")
 
@@ -42,71 +95,252 @@ INFO_TYPES = [
     {"name": "PERSON_NAME"}
 ]
 
-# --- Pydantic Models (unchanged) ---
-class EventDetails(BaseModel):
-    context: Optional[str] = None
-    corroborating_signals: Optional[List[str]] = None
-
-class SignalData(BaseModel):
-    user_id: str
-    timestamp: str
-    signal_type: str
-    flag_type: str
-    confidence: float
-    topic_category: Optional[str] = None
-    source_platform: Optional[str] = None
-    event_details: Optional[EventDetails] = None
+# Rows are packed into a single DLP table item per request. DLP caps a request
+# at 0.5 MB of content, so batches are bounded by both row count and bytes.
+DLP_BATCH_MAX_ROWS = int(os.environ.get("DLP_BATCH_MAX_ROWS", "100"))
+DLP_BATCH_MAX_BYTES = int(os.environ.get("DLP_BATCH_MAX_BYTES", str(400 * 1024)))
 
-@app.post("/upload_data")
-async def upload_data(rows: List[SignalData]):
+# --- Event Attributes ---
+# Every message carries a deterministic event ID, so the consumer can drop
+# duplicates from retries and replays, and the event time, which the consumer
+# uses as the message timestamp. The signal and flag types are copied into
+# attributes, so the consumer can route messages without decoding them.
+EVENT_ID_ATTRIBUTE = "event_id"
+EVENT_TIMESTAMP_ATTRIBUTE = "event_timestamp"
+SIGNAL_TYPE_ATTRIBUTE = "signal_type"
+FLAG_TYPE_ATTRIBUTE = "flag_type"
+
+def event_attributes(row: SignalData) -> Dict[str, str]:
     """
-    Receives a list of JSON objects, inspects them for sensitive data using DLP,
-    and publishes each as a message to a Pub/Sub topic.
+    Returns the Pub/Sub attributes for a record. The event ID hashes the same
+    fields as the consumer's `event_id`, so both derive the same value.
     """
-    published_count = 0
-    
+    context = (row.event_details.context if row.event_details else None) or ""
+    key = json.dumps([row.user_id, row.timestamp, row.flag_type, context])
+
+    # Pub/Sub expects RFC 3339 timestamps. Records whose timestamp does not
+    # parse are stamped with the time they were received.
     try:
-        for row in rows:
-            data_dict = row.model_dump()
-            
-            # --- DLP Inspection ---
-            # Convert the data dictionary to a JSON string for DLP inspection
-            data_to_inspect = json.dumps(data_dict)
-            
-            # The DLP API expects the parent project path
-            parent = f"projects/{PROJECT_ID}"
-            
-            # Create a DLP request to inspect the data
-            request = {
-                "parent": parent,
-                "inspect_config": {
-                    "info_types": INFO_TYPES,
-                    "min_likelihood": dlp_v2.Likelihood.LIKELY,
-                },
-                "item": {"value": data_to_inspect},
+        event_time = datetime.fromisoformat(row.timestamp.replace("Z", "+00:00"))
+        if event_time.tzinfo is None:
+            event_time = event_time.replace(tzinfo=timezone.utc)
+    except ValueError:
+        event_time = datetime.now(timezone.utc)
+
+    return {
+        EVENT_ID_ATTRIBUTE: hashlib.sha256(key.encode("utf-8")).hexdigest(),
+        EVENT_TIMESTAMP_ATTRIBUTE: event_time.astimezone(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z"),
+        SIGNAL_TYPE_ATTRIBUTE: row.signal_type,
+        FLAG_TYPE_ATTRIBUTE: row.flag_type,
+    }
+
+def batch_payloads(payloads: List[bytes]) -> Iterator[List[int]]:
+    """
+    Groups payload indices into batches bounded by DLP_BATCH_MAX_ROWS and
+    DLP_BATCH_MAX_BYTES. A single payload larger than the byte limit still gets
+    a batch of its own.
+    """
+    batch: List[int] = []
+    batch_bytes = 0
+    for index, payload in enumerate(payloads):
+        payload_bytes = len(payload)
+        if batch and (len(batch) >= DLP_BATCH_MAX_ROWS or batch_bytes + payload_bytes > DLP_BATCH_MAX_BYTES):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(index)
+        batch_bytes += payload_bytes
+    if batch:
+        yield batch
+
+
+def inspect_batch(payloads: List[bytes]) -> Dict[int, list]:
+    """
+    Inspects a batch of serialized records with one DLP request. Each record is
+    sent as one row of a table item, and the findings are mapped back to the
+    position of the record in `payloads`.
+    """
+    request = {
+        "parent": f"projects/{PROJECT_ID}",
+        "inspect_config": {
+            "info_types": INFO_TYPES,
+            "min_likelihood": dlp_v2.Likelihood.LIKELY,
+        },
+        "item": {
+            "table": {
+                "headers": [{"name": "record"}],
+                "rows": [{"values": [{"string_value": payload.decode("utf-8")}]} for payload in payloads],
             }
-            
-            # Perform the DLP inspection
-            response = dlp_client.inspect_content(request=request)
-            
-            # Check for any findings
-            if response.result.findings:
-                # If sensitive data is found, you can raise an error or log a warning
-                print(f"Warning: Sensitive data found in a record. Findings: {response.result.findings}")
-                # Optional: Uncomment the following line to block the request entirely
-                # raise HTTPException(status_code=400, detail="Sensitive data detected in payload.")
-
-            # If no sensitive data is found, proceed with Pub/Sub publish
-            data = data_to_inspect.encode("utf-8")
-            future = publisher.publish(TOPIC_PATH, data)
-            future.result()
-            published_count += 1
-
-        return {"status": "success", "messages_published": published_count}
+        },
+    }
+    response = dlp_client.inspect_content(request=request)
+
+    findings_by_row: Dict[int, list] = defaultdict(list)
+    for finding in response.result.findings:
+        for content_location in finding.location.content_locations:
+            row_index = content_location.record_location.table_location.row_index
+            findings_by_row[row_index].append(finding)
+
+    if response.result.findings_truncated:
+        print(f"Warning: DLP findings were truncated for a batch of {len(payloads)} records.")
+
+    return findings_by_row
+
+
+def encode_payload(payload: bytes) -> Tuple[bytes, Dict[str, str]]:
+    """
+    Returns the message data for a serialized record and any attributes that
+    describe its encoding.
+    """
+    if PUBSUB_COMPRESSION_MIN_BYTES and len(payload) >= PUBSUB_COMPRESSION_MIN_BYTES:
+        return gzip.compress(payload), {CONTENT_ENCODING_ATTRIBUTE: "gzip"}
+    return payload, {}
+
+
+def publish_rows(rows: List[SignalData], payloads: List[bytes]) -> list:
+    """
+    Hands every record to the publisher client and returns the publish futures.
+    This runs on the executor, because publish() blocks while flow control is
+    at its limit.
+    """
+    futures = []
+    for row, payload in zip(rows, payloads):
+        data, encoding_attributes = encode_payload(payload)
+        futures.append(publisher.publish(
+            TOPIC_PATH, data, ordering_key=row.user_id, **event_attributes(row), **encoding_attributes
+        ))
+    return futures
 
+
+def resume_failed_ordering_keys(rows: List[SignalData], futures: list):
+    """
+    A failed publish pauses its ordering key, and later messages for that user
+    fail until the key is resumed. The client that retries the upload resends
+    the failed records, so the keys are resumed for it.
+    """
+    failed_keys = {
+        row.user_id for row, future in zip(rows, futures)
+        if future.done() and future.exception() is not None
+    }
+    for ordering_key in failed_keys:
+        publisher.resume_publish(TOPIC_PATH, ordering_key)
+
+
+async def inspect_payloads(payloads: List[bytes]):
+    """
+    Inspects serialized records for sensitive data with DLP, in batches that
+    run concurrently on the executor.
+    """
+    loop = asyncio.get_running_loop()
+    batches = list(batch_payloads(payloads))
+    results = await asyncio.gather(*(
+        loop.run_in_executor(executor, inspect_batch, [payloads[index] for index in batch])
+        for batch in batches
+    ))
+    for batch, findings_by_row in zip(batches, results):
+        for row_index, findings in findings_by_row.items():
+            # If sensitive data is found, you can raise an error or log a warning
+            print(f"Warning: Sensitive data found in record {batch[row_index]}. Findings: {findings}")
+            # Optional: Uncomment the following line to block the request entirely
+            # raise HTTPException(status_code=400, detail="Sensitive data detected in payload.")
+
+
+async def publish_payloads(rows: List[SignalData], payloads: List[bytes]) -> list:
+    """
+    Publishes every message up front so the client can batch them, then waits
+    for all the futures together. Returns each message's ID, or the exception
+    its publish failed with.
+    """
+    loop = asyncio.get_running_loop()
+    futures = await loop.run_in_executor(executor, publish_rows, rows, payloads)
+    results = await asyncio.gather(
+        *(asyncio.wrap_future(future) for future in futures), return_exceptions=True
+    )
+    if any(isinstance(result, Exception) for result in results):
+        resume_failed_ordering_keys(rows, futures)
+    return results
+
+
+@app.post("/upload_data")
+async def upload_data(request: Request):
+    """
+    Receives a list of JSON objects, inspects them for sensitive data using DLP
+    in concurrent batches, and publishes each as a message to a Pub/Sub topic.
+    """
+    # The body is validated straight from bytes in one call, rather than
+    # parsed into Python objects first.
+    try:
+        rows = SIGNAL_DATA_LIST.validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError(request_validation_errors(e))
+
+    try:
+        # Serialize each record to the JSON bytes that are both inspected and published.
+        payloads = [SIGNAL_DATA.dump_json(row) for row in rows]
+
+        # --- DLP Inspection ---
+        await inspect_payloads(payloads)
+
+        # --- Pub/Sub Publish ---
+        results = await publish_payloads(rows, payloads)
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            raise errors[0]
+
+        return {"status": "success", "messages_published": len(results)}
+
+    except publisher_exceptions.FlowControlLimitError as e:
+        raise HTTPException(status_code=503, detail=f"Publisher is over its flow control limit: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An error occurred: {str(e)}")
 
+# --- NDJSON Upload Configuration ---
+# /upload_ndjson inspects and publishes a streamed body NDJSON_CHUNK_ROWS lines
+# at a time, with at most NDJSON_MAX_PENDING_CHUNKS chunks in flight, so memory
+# stays flat however large the upload is.
+NDJSON_CHUNK_ROWS = int(os.environ.get("NDJSON_CHUNK_ROWS", "500"))
+NDJSON_MAX_PENDING_CHUNKS = int(os.environ.get("NDJSON_MAX_PENDING_CHUNKS", "4"))
+NDJSON_MAX_LINE_BYTES = int(os.environ.get("NDJSON_MAX_LINE_BYTES", str(1024 * 1024)))
+NDJSON_MAX_REPORTED_ERRORS = int(os.environ.get("NDJSON_MAX_REPORTED_ERRORS", "100"))
+
+async def publish_chunk(rows: List[SignalData]) -> Dict[int, list]:
+    """Inspects and publishes one chunk of rows and returns their errors keyed by position."""
+    payloads = [SIGNAL_DATA.dump_json(row) for row in rows]
+    await inspect_payloads(payloads)
+    results = await publish_payloads(rows, payloads)
+    return {
+        index: [{"message": str(result)}]
+        for index, result in enumerate(results) if isinstance(result, Exception)
+    }
+
+@app.post("/upload_ndjson")
+async def upload_ndjson(request: Request):
+    """
+    Receives newline-delimited JSON, optionally compressed with gzip or zstd as
+    named by the Content-Encoding header, and inspects and publishes it in
+    chunks as it arrives. Lines that fail validation or publishing are reported
+    by line number without failing the rest of the upload.
+    """
+    report = UploadReport(NDJSON_MAX_REPORTED_ERRORS)
+    try:
+        await stream_upload(
+            request.stream(),
+            request.headers.get("content-encoding"),
+            SignalData,
+            publish_chunk,
+            report,
+            chunk_rows=NDJSON_CHUNK_ROWS,
+            max_pending_chunks=NDJSON_MAX_PENDING_CHUNKS,
+            max_line_bytes=NDJSON_MAX_LINE_BYTES,
+        )
+    except BODY_ERRORS as e:
+        # Rows forwarded before the body broke off stay published.
+        raise HTTPException(
+            status_code=400, detail={**report.as_response("messages_published"), "status": "error", "message": str(e)}
+        )
+
+    return report.as_response("messages_published")
+
 @app.get("/")
 def health_check():
     return {"status": "ok"}
\ No newline at end of file